@@ -6,8 +6,17 @@ import google
 from google import genai
 import time
 from dotenv import load_dotenv
+import corpus_store
+from llm_cache import LLMCache, DEFAULT_CACHE_DIR
+from llm_batch import run_batch, BATCH_POLL_SECONDS
+from amendment_engine import AddressedBill, apply_amendment, load_amendment_order, in_adoption_order
+from bill_diff import check_amended
+from line_table import load_line_table
+from llm_utils import response_token_usage
+from metrics import METRICS
 
 
+AMENDMENT_MODEL = 'gemini-2.5-pro'
 PROMPT_TEMPLATE = (
     "Below you will find bill markdown wrapped in the tags <bill></bill>, "
     "followed by amendment markdown wrapped in the tags <amendment></amendment>. "
@@ -18,44 +27,235 @@ PROMPT_TEMPLATE = (
 )
 
 
-def gemini_query(client, contents):
+def gemini_query(client, contents, cache=None):
+    """
+    Sends contents to AMENDMENT_MODEL. With an llm_cache.LLMCache, a previous response to the
+    same contents is returned without querying Gemini.
+    """
+    if cache is not None:
+        cache_key = cache.key('gemini', AMENDMENT_MODEL, None, None, contents)
+        cached_text = cache.get(cache_key)
+        if cached_text is not None:
+            return cached_text
+    start = time.perf_counter()
     response = client.models.generate_content(
-        model='gemini-2.5-pro',
+        model=AMENDMENT_MODEL,
         contents=contents,
     )
+    input_tokens, output_tokens = response_token_usage('gemini', response)
+    METRICS.observe('llm_latency_seconds', time.perf_counter() - start, model_family='gemini', model=AMENDMENT_MODEL)
+    METRICS.count('llm_requests', model_family='gemini', model=AMENDMENT_MODEL)
+    METRICS.count('llm_input_tokens', input_tokens, model_family='gemini', model=AMENDMENT_MODEL)
+    METRICS.count('llm_output_tokens', output_tokens, model_family='gemini', model=AMENDMENT_MODEL)
+    if cache is not None and response.text is not None:
+        cache.put(cache_key, response.text, 'gemini', AMENDMENT_MODEL)
     return response.text
 
 
-def main(client, session_year):
+def apply_amendments(client, bill_md, amendment_mds, cache=None, stats=None, line_table=None):
+    """
+    Applies each amendment markdown to the bill markdown in order. Instructions are applied
+    by amendment_engine; the LLM is only sent the bill and the instructions the engine could
+    not apply, and its output is what the next amendment is applied to.
+
+    Args:
+        client: Gemini client for the fallback, or None to apply amendments locally only.
+        stats: Optional dict counting 'applied' and 'residual' instructions and 'llm' fallbacks.
+        line_table: Optional line table of the bill, for its printed line numbers. LLM output
+            is numbered from its markdown.
+
+    Returns:
+        The amended markdown, or None if an amendment needed the LLM and it was unavailable
+        or failed.
+    """
+    bill = AddressedBill(bill_md, line_table)
+    for amendment_md in amendment_mds:
+        residual_md = apply_amendment(bill, amendment_md, stats)
+        if not residual_md:
+            continue
+        if client is None:
+            print(f"The LLM is needed for:\n{residual_md}")
+            return None
+        if stats is not None:
+            stats['llm'] = stats.get('llm', 0) + 1
+        amended_bill_md = gemini_query(client, PROMPT_TEMPLATE.format(bill.markdown(), residual_md), cache=cache)
+        if amended_bill_md is None:
+            return None
+        bill = AddressedBill(amended_bill_md)
+    return bill.markdown()
+
+
+def apply_amendments_in_batch(client, bills, work_dir, cache=None, poll_seconds=BATCH_POLL_SECONDS, stats=None, line_tables=None):
+    """
+    Applies amendments to many bills like apply_amendments, sending the LLM fallbacks through
+    Gemini Batch Mode. Round k applies every bill's kth amendment with amendment_engine and
+    submits one request for each bill it left instructions for.
+
+    Args:
+        bills: Maps each bill number to (bill_md, amendment_mds).
+        line_tables: Optional dict mapping bill numbers to their line tables.
+
+    Returns:
+        A dict mapping each bill number to its amended markdown, or None if a request failed.
+    """
+    line_tables = line_tables or dict()
+    addressed_bills = {bill_number: AddressedBill(bill_md, line_tables.get(bill_number)) for bill_number, (bill_md, _) in bills.items()}
+    round_count = max((len(amendment_mds) for _, amendment_mds in bills.values()), default=0)
+    for round_index in range(round_count):
+        requests = []
+        cache_keys = dict()
+        for bill_number, (_, amendment_mds) in bills.items():
+            if round_index >= len(amendment_mds) or addressed_bills[bill_number] is None:
+                continue
+            residual_md = apply_amendment(addressed_bills[bill_number], amendment_mds[round_index], stats)
+            if not residual_md:
+                continue
+            if stats is not None:
+                stats['llm'] = stats.get('llm', 0) + 1
+            prompt = PROMPT_TEMPLATE.format(addressed_bills[bill_number].markdown(), residual_md)
+            if cache is not None:
+                cache_keys[bill_number] = cache.key('gemini', AMENDMENT_MODEL, None, None, prompt)
+                cached_text = cache.get(cache_keys[bill_number])
+                if cached_text is not None:
+                    addressed_bills[bill_number] = AddressedBill(cached_text)
+                    continue
+            requests.append((bill_number, None, prompt, None))
+        if not requests:
+            continue
+        results = run_batch(client, 'gemini', AMENDMENT_MODEL, requests, work_dir, f'amend_leg_md_round{round_index + 1}', poll_seconds)
+        for bill_number, text in results.items():
+            addressed_bills[bill_number] = AddressedBill(text) if text is not None else None
+            if cache is not None and text is not None:
+                cache.put(cache_keys[bill_number], text, 'gemini', AMENDMENT_MODEL)
+    return {
+        bill_number: bill.markdown() if bill is not None else None
+        for bill_number, bill in addressed_bills.items()
+    }
+
+
+def flag_over_edits(bill_number, bill_md, amendment_mds, amended_bill_md, stats, line_table=None):
+    """Warns when the amended markdown changes text that no amendment instruction addresses."""
+    over_edits = check_amended(bill_md, amendment_mds, amended_bill_md, line_table)['over_edits']
+    if over_edits:
+        stats['over_edited'] = stats.get('over_edited', 0) + 1
+        METRICS.count('amendment_over_edits', len(over_edits))
+        print(f"{bill_number}: {len(over_edits)} changes go beyond the amendment instructions; review with bill_diff.py")
+
+
+def amendment_names_by_bill(conn, session_year, input_dir):
+    """
+    Maps each bill number to its amendment document names, in the adoption order recorded by
+    download_legislation.py. Amendments it did not record fall back to amendment-ID order.
+    """
+    if conn is not None:
+        amendment_names = corpus_store.document_names(conn, session_year, 'amendment')
+    else:
+        amendment_names = [os.path.splitext(os.path.basename(amendment_file))[0] for amendment_file in glob(os.path.join(input_dir, '*_amd*.md'))]
+    names_by_bill = dict()
+    for file_name in amendment_names:
+        names_by_bill.setdefault(file_name.split('_')[0], []).append(file_name)
+    amendment_order = load_amendment_order(os.path.dirname(os.path.normpath(input_dir)))
+    return {
+        bill_number: in_adoption_order(names, amendment_order.get(bill_number, []))
+        for bill_number, names in sorted(names_by_bill.items())
+    }
+
+
+def load_unamended_bills(conn, session_year, input_dir):
+    """
+    Reads the markdown of every bill with amendments but without an amended markdown.
+
+    Returns:
+        A dict mapping each bill number to (bill_md, amendment_mds).
+    """
+    bills = dict()
+    for bill_number, bill_amendment_names in amendment_names_by_bill(conn, session_year, input_dir).items():
+        if os.path.exists(os.path.join(input_dir, f'{bill_number}_amended.md')):
+            continue
+        doc_mds = []
+        for doc_name in [bill_number] + bill_amendment_names:
+            if conn is not None:
+                doc_mds.append(corpus_store.document_markdown(conn, session_year, doc_name))
+            else:
+                with open(os.path.join(input_dir, f'{doc_name}.md'), 'r', encoding='utf-8') as f:
+                    doc_mds.append(f.read())
+        bills[bill_number] = (doc_mds[0], doc_mds[1:])
+    return bills
+
+
+def save_amended(conn, session_year, input_dir, bill_number, amended_bill_md):
+    destination_file_path = os.path.join(input_dir, f'{bill_number}_amended.md')
+    with open(destination_file_path, 'w', encoding='utf-8') as destination_file:
+        destination_file.write(amended_bill_md)
+    if conn is not None:
+        corpus_store.ingest_document(conn, session_year, destination_file_path)
+        conn.commit()
+
+
+def batch_main(client, session_year, from_store=False, cache=None, poll_seconds=BATCH_POLL_SECONDS):
+    """
+    Applies every amendment of each bill without an amended markdown, in amendment order,
+    with LLM fallbacks sent through Gemini Batch Mode.
+    """
     input_dir = os.path.abspath(f'data/{session_year}rs/md')
-    amendment_wildcard = os.path.join(input_dir, '*_amd*.md')
-    amendment_files = glob(amendment_wildcard)
-    for amendment_file in tqdm(amendment_files):
-        file_basename = os.path.basename(amendment_file)
-        file_name, _ = os.path.splitext(file_basename)
-        bill_number = file_name.split('_')[0]
-        bill_file_name = f'{bill_number}.md'
-        bill_file = os.path.join(input_dir, bill_file_name)
-        with open(bill_file, 'r', encoding='utf-8') as b_f:
-            bill_md = b_f.read()
-        with open(amendment_file, 'r', encoding='utf-8') as a_f:
-            amendment_md = a_f.read()
-        destination_basename = f'{bill_number}_amended.md'
-        destination_file_path = os.path.join(input_dir, destination_basename)
-        if not os.path.exists(destination_file_path):
-            prompt = PROMPT_TEMPLATE.format(bill_md, amendment_md)
-            amended_bill_md = gemini_query(client, prompt)
-            with open(destination_file_path, 'w', encoding='utf-8') as destination_file:
-                destination_file.write(amended_bill_md)
+    conn = corpus_store.connect() if from_store else None
+    bills = load_unamended_bills(conn, session_year, input_dir)
+    line_tables = {bill_number: load_line_table(os.path.dirname(input_dir), bill_number) for bill_number in bills}
+    print(f"Applying amendments to {len(bills)} bills in batch.")
+
+    stats = dict()
+    amended_mds = apply_amendments_in_batch(
+        client, bills, os.path.join(os.path.dirname(input_dir), 'batch'), cache=cache, poll_seconds=poll_seconds,
+        stats=stats, line_tables=line_tables
+    )
+    for bill_number, amended_bill_md in amended_mds.items():
+        if amended_bill_md is None:
+            print(f"No amended markdown for {bill_number}")
+            continue
+        flag_over_edits(bill_number, *bills[bill_number], amended_bill_md, stats, line_tables[bill_number])
+        save_amended(conn, session_year, input_dir, bill_number, amended_bill_md)
+    print(f"Amendment instructions: {stats}")
+    if cache is not None:
+        print(f"LLM cache: {cache.stats}")
+
+
+def main(client, session_year, from_store=False, cache=None):
+    input_dir = os.path.abspath(f'data/{session_year}rs/md')
+    conn = corpus_store.connect() if from_store else None
+    bills = load_unamended_bills(conn, session_year, input_dir)
+    stats = dict()
+    for bill_number, (bill_md, amendment_mds) in tqdm(bills.items()):
+        line_table = load_line_table(os.path.dirname(input_dir), bill_number)
+        amended_bill_md = apply_amendments(client, bill_md, amendment_mds, cache=cache, stats=stats, line_table=line_table)
+        if amended_bill_md is None:
+            print(f"No amended markdown for {bill_number}")
+            continue
+        flag_over_edits(bill_number, bill_md, amendment_mds, amended_bill_md, stats, line_table)
+        save_amended(conn, session_year, input_dir, bill_number, amended_bill_md)
+    print(f"Amendment instructions: {stats}")
+    if cache is not None:
+        print(f"LLM cache: {cache.stats}")
+
 
 if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='Use Gemini 2.5 Pro to apply amendment markdown text.')
+    parser = argparse.ArgumentParser(description='Apply amendment markdown text, using Gemini 2.5 Pro for instructions that cannot be applied directly.')
     parser.add_argument('session_year', type=int, help='The regular session year')
+    parser.add_argument('--from-store', action='store_true', help='Read bill and amendment markdown from the corpus store')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='Directory of the LLM response cache')
+    parser.add_argument('--cache-read-only', action='store_true', help='Use cached responses but do not store new ones')
+    parser.add_argument('--no-cache', action='store_true', help='Query Gemini for every amendment, ignoring the cache')
+    parser.add_argument('--batch', action='store_true', help='Send the instructions that need the LLM through Gemini Batch Mode and wait for the results')
+    parser.add_argument('--batch-poll-seconds', type=float, default=BATCH_POLL_SECONDS, help='Seconds between batch job status checks')
     args = parser.parse_args()
     load_dotenv()
     GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-    if GEMINI_API_KEY is None:
+    cache = None if args.no_cache else LLMCache(args.cache_dir, read_only=args.cache_read_only)
+    if GEMINI_API_KEY is None and args.batch:
         print("Please provide a GEMINI_API_KEY in a .env file.")
+    elif args.batch:
+        batch_main(genai.Client(api_key=GEMINI_API_KEY), args.session_year, from_store=args.from_store, cache=cache, poll_seconds=args.batch_poll_seconds)
     else:
-        client = genai.Client(api_key=GEMINI_API_KEY)
-        main(client, args.session_year)
\ No newline at end of file
+        if GEMINI_API_KEY is None:
+            print("No GEMINI_API_KEY in .env: bills with instructions that cannot be applied directly will be skipped.")
+        client = genai.Client(api_key=GEMINI_API_KEY) if GEMINI_API_KEY is not None else None
+        main(client, args.session_year, from_store=args.from_store, cache=cache)
\ No newline at end of file
@@ -0,0 +1,521 @@
+# Deterministic application of MGA amendment instructions to bill markdown.
+# Printed bills number the lines of each page in the left margin, so every line of leg_to_md
+# output for a bill can be addressed as (page, line). Amendments are written in a regular form
+# ("On page 2, in line 5, strike "the" and substitute "a"; after line 9, insert: "..."), which
+# is parsed here into strike, substitute, insert and line-range operations and applied
+# directly, keeping each line's margin number so later amendments to the same printed bill
+# still resolve. Clauses that do not parse, or whose line or text cannot be found, are
+# returned as residual amendment text for amend_leg_md.py to hand to the LLM.
+
+import os
+import re
+import json
+import argparse
+
+
+# Bump whenever a change to this module or to line numbering alters the amended output
+ENGINE_VERSION = 2
+
+# Written by download_legislation.py into the session directory
+AMENDMENT_ORDER_FILE = 'amendment_order.json'
+
+PAGE_START_PATTERN = re.compile(r'^START OF PAGE (\d+)$')
+PAGE_END_PATTERN = re.compile(r'^END OF PAGE (\d+)$')
+MARGIN_NUMBER_PATTERN = re.compile(r'^(\d{1,2})(?: (.*))?$')
+# Amendment page furniture that can fall in the middle of an instruction
+AMENDMENT_NOISE_PATTERNS = [
+    re.compile(r'^[HS][BJR]\d{4}/\d+/\d+'),
+    re.compile(r'^Amendments? to [HS][BJR] ?\d+', re.IGNORECASE),
+    re.compile(r'^Page \d+ of \d+$'),
+    re.compile(r'^– ?\d+ ?–$'),
+]
+AMENDMENT_NUMBER_PATTERN = re.compile(r'AMENDMENT NO\. *(\d+)')
+SENTENCE_PATTERN = re.compile(r'On pages? (\d+),\s*(.*?)(?=On pages? \d+,|$)', re.DOTALL)
+
+QUOTED = r'[“"](?P<{}>[^”"]*)[”"]'
+LINE = r'(?P<{}>\d+)(?: on page (?P<{}>\d+))?'
+ORDINALS = {'first': 1, 'second': 2, 'third': 3, 'fourth': 4, 'fifth': 5, 'last': -1}
+OCCURRENCE = r'(?:the (?P<occurrence>first|second|third|fourth|fifth|last) )?'
+
+LINE_CONTEXT_PATTERN = re.compile(
+    r'^in (?:lines? (?P<line>\d+)(?:\s+(?:and|through)\s+(?P<last_line>\d+))?(?:,?\s+inclusive)?|the same line),\s*(?P<rest>.*)$',
+    re.DOTALL
+)
+STRIKE_PATTERN = re.compile(
+    r'^strike ' + OCCURRENCE + QUOTED.format('text') + r'(?:\s+and substitute ' + QUOTED.format('substitute') + r')?$', re.DOTALL
+)
+INSERT_PATTERN = re.compile(
+    r'^(?P<where>after|before) ' + OCCURRENCE + QUOTED.format('anchor') + r'\s+insert ' + QUOTED.format('text') + r'$', re.DOTALL
+)
+STRIKE_LINES_PATTERN = re.compile(
+    r'^strike (?:'
+    r'in (?:its|their) entirety lines? ' + LINE.format('first', 'first_page') + r'(?:\s+(?:through|and)\s+' + LINE.format('last', 'last_page') + r')?'
+    r'|lines? ' + LINE.format('first2', 'first_page2') + r'(?:\s+(?:through|and)\s+' + LINE.format('last2', 'last_page2') + r')?\s+in (?:its|their) entirety'
+    r'|beginning with line ' + LINE.format('first3', 'first_page3') + r'\s+down through line ' + LINE.format('last3', 'last_page3') +
+    r')(?:,?\s+inclusive)?(?:,?\s+and substitute:?\s*' + QUOTED.format('substitute') + r')?$',
+    re.DOTALL
+)
+STRIKE_RANGE_PATTERN = re.compile(
+    r'^strike beginning with ' + QUOTED.format('start') + r'\s+in line ' + LINE.format('first', 'first_page') +
+    r'\s+down through ' + QUOTED.format('end') + r'\s+in line ' + LINE.format('last', 'last_page') +
+    r'(?:,?\s+inclusive)?(?:,?\s+and substitute ' + QUOTED.format('substitute') + r')?$',
+    re.DOTALL
+)
+INSERT_LINES_PATTERN = re.compile(
+    r'^(?P<where>after|before) line ' + LINE.format('line', 'line_page') + r',?\s+insert:?\s*' + QUOTED.format('text') + r'$', re.DOTALL
+)
+
+
+class UnresolvedInstruction(Exception):
+    """An instruction parsed but could not be located in the bill."""
+
+
+def normalize_inline(text):
+    return ' '.join(text.split())
+
+
+def normalize_block(text):
+    """Keeps an inserted block's paragraph breaks, dropping the amendment's own line wrapping."""
+    paragraphs = re.split(r'\n\s*\n', text.strip())
+    return [normalize_inline(paragraph) for paragraph in paragraphs if paragraph.strip()]
+
+
+def split_clauses(sentence):
+    """
+    Splits an instruction sentence at semicolons outside quotes, collapsing the line wrapping
+    outside quotes to single spaces.
+    """
+    clauses = []
+    current = []
+    quoted = False
+    for character in sentence:
+        if character in '“”"':
+            quoted = character == '“' or (character == '"' and not quoted)
+        if character == ';' and not quoted:
+            clauses.append(''.join(current))
+            current = []
+        elif character.isspace() and not quoted:
+            if current and current[-1] != ' ':
+                current.append(' ')
+        else:
+            current.append(character)
+    clauses.append(''.join(current))
+    clauses = [re.sub(r'^(?:and|also)\s+', '', clause.strip()).rstrip('.').strip() for clause in clauses]
+    return [clause for clause in clauses if clause]
+
+
+def clean_amendment_text(amendment_md):
+    lines = []
+    for line in amendment_md.split('\n'):
+        stripped = line.strip()
+        if PAGE_START_PATTERN.match(stripped) or PAGE_END_PATTERN.match(stripped):
+            continue
+        if any(pattern.match(stripped) for pattern in AMENDMENT_NOISE_PATTERNS):
+            continue
+        lines.append(stripped.replace('~~', ''))
+    return '\n'.join(lines)
+
+
+def parse_amendment(amendment_md):
+    """
+    Parses amendment markdown into instruction clauses.
+
+    Returns:
+        A list of (amendment_number, page, line_context, clause, source) tuples in document
+        order. line_context is the (first, last) line the clause's "in line N" refers to,
+        possibly carried over from an earlier clause of the sentence, clause is the
+        instruction without it, and source is the clause as written with that context
+        made explicit.
+    """
+    text = clean_amendment_text(amendment_md)
+    numbered = AMENDMENT_NUMBER_PATTERN.split(text)
+    # Text before the first AMENDMENT NO. heading belongs to amendment 1
+    sections = [(1, numbered[0])] + [(int(numbered[index]), numbered[index + 1]) for index in range(1, len(numbered), 2)]
+    instructions = []
+    for amendment_number, section_text in sections:
+        for match in SENTENCE_PATTERN.finditer(section_text):
+            page = int(match.group(1))
+            line_context = None
+            for clause in split_clauses(match.group(2)):
+                source = clause
+                context_match = LINE_CONTEXT_PATTERN.match(clause)
+                if context_match:
+                    if context_match.group('line'):
+                        line_context = (int(context_match.group('line')), int(context_match.group('last_line') or context_match.group('line')))
+                    clause = context_match.group('rest')
+                elif line_context is not None and not clause.startswith(('in ', 'after line', 'before line', 'strike in', 'strike line', 'strike beginning with line')):
+                    first_line, last_line = line_context
+                    source = f'in line {first_line}, {clause}' if first_line == last_line else f'in lines {first_line} through {last_line}, {clause}'
+                instructions.append((amendment_number, page, line_context, clause, source))
+    return instructions
+
+
+def parse_clause(page, line_context, clause):
+    """
+    Turns one clause into an operation dict, or returns None if it is not in a supported form.
+    """
+    strike_lines = STRIKE_LINES_PATTERN.match(clause)
+    if strike_lines:
+        groups = strike_lines.groupdict()
+        for suffix in ('', '2', '3'):
+            if groups.get(f'first{suffix}'):
+                first = (int(groups[f'first_page{suffix}'] or page), int(groups[f'first{suffix}']))
+                last_line = groups[f'last{suffix}']
+                last = (int(groups[f'last_page{suffix}'] or first[0]), int(last_line)) if last_line else first
+        substitute = normalize_block(groups['substitute']) if groups['substitute'] is not None else []
+        return {'op': 'strike_lines', 'first': first, 'last': last, 'substitute': substitute}
+    strike_range = STRIKE_RANGE_PATTERN.match(clause)
+    if strike_range:
+        groups = strike_range.groupdict()
+        first = (int(groups['first_page'] or page), int(groups['first']))
+        return {
+            'op': 'strike_range',
+            'first': first,
+            'last': (int(groups['last_page'] or first[0]), int(groups['last'])),
+            'start': normalize_inline(groups['start']),
+            'end': normalize_inline(groups['end']),
+            'substitute': normalize_inline(groups['substitute']) if groups['substitute'] is not None else '',
+        }
+    insert_lines = INSERT_LINES_PATTERN.match(clause)
+    if insert_lines:
+        groups = insert_lines.groupdict()
+        return {
+            'op': f"insert_{groups['where']}_line",
+            'line': (int(groups['line_page'] or page), int(groups['line'])),
+            'lines': normalize_block(groups['text']),
+        }
+    if line_context is None:
+        return None
+    lines = ((page, line_context[0]), (page, line_context[1]))
+    strike = STRIKE_PATTERN.match(clause)
+    if strike:
+        return {
+            'op': 'strike',
+            'lines': lines,
+            'text': normalize_inline(strike.group('text')),
+            'occurrence': ORDINALS.get(strike.group('occurrence'), 1),
+            'substitute': normalize_inline(strike.group('substitute')) if strike.group('substitute') is not None else '',
+        }
+    insert = INSERT_PATTERN.match(clause)
+    if insert:
+        return {
+            'op': f"insert_{insert.group('where')}",
+            'lines': lines,
+            'anchor': normalize_inline(insert.group('anchor')),
+            'occurrence': ORDINALS.get(insert.group('occurrence'), 1),
+            'text': normalize_inline(insert.group('text')),
+        }
+    return None
+
+
+def tidy(text):
+    text = text.replace('~~~~', '')
+    return re.sub(r'  +', ' ', text).strip()
+
+
+def number_lines(markdown, line_table=None):
+    """
+    Splits markdown into (page, margin number, text) tuples, one per line. page is None
+    outside the page markers, and number is None for page markers, headers, blank lines and
+    any line without a margin number, whose text is then the whole line.
+
+    With the document's line table (line_table.LineTable), a page's numbers are the printed
+    line numbers the table found in the PDF margin column, as long as its rows line up with
+    the page's non-blank lines. Otherwise margin numbers count up from 1 on every page. A
+    number may skip ahead when the next numbered line continues from it, as in LLM output
+    that dropped struck lines; a lone number out of sequence (e.g. "45 days" at the start
+    of a line of text) is bill text.
+    """
+    lines = markdown.split('\n')
+    pages = []
+    candidates = []
+    page_lines = dict()
+    page = None
+    for index, line in enumerate(lines):
+        start_match = PAGE_START_PATTERN.match(line)
+        if start_match:
+            page = int(start_match.group(1))
+        end_match = PAGE_END_PATTERN.match(line)
+        margin_match = MARGIN_NUMBER_PATTERN.match(line) if page is not None and not start_match else None
+        pages.append(page)
+        candidates.append(int(margin_match.group(1)) if margin_match else None)
+        if page is not None and not start_match and not end_match and line.strip():
+            page_lines.setdefault(page, []).append(index)
+        if end_match:
+            page = None
+
+    table_numbers = dict()
+    if line_table is not None:
+        for page, indices in page_lines.items():
+            if not 1 <= page <= line_table.page_count or len(indices) != len(line_table.page_rows(page)):
+                continue
+            numbers = line_table.page_line_numbers(page)
+            if all(candidates[index] == number for index, number in zip(indices, numbers) if number):
+                table_numbers.update((index, number or None) for index, number in zip(indices, numbers))
+
+    def next_candidate(index):
+        for later in range(index + 1, len(lines)):
+            if pages[later] != pages[index]:
+                return None
+            if candidates[later] is not None:
+                return candidates[later]
+        return None
+
+    numbered = []
+    last_number = 0
+    for index, line in enumerate(lines):
+        if index == 0 or pages[index] != pages[index - 1]:
+            last_number = 0
+        number = candidates[index]
+        if index in table_numbers:
+            number = table_numbers[index]
+        elif number is not None and number != last_number + 1:
+            if number <= last_number or next_candidate(index) != number + 1:
+                number = None
+        if number is None:
+            numbered.append((pages[index], None, line))
+        else:
+            last_number = number
+            numbered.append((pages[index], number, MARGIN_NUMBER_PATTERN.match(line).group(2) or ''))
+    return numbered
+
+
+class AddressedBill:
+    """
+    Bill markdown as a list of line entries ({'page', 'number', 'text', 'before', 'after'}),
+    where number is the line's margin number (None for page markers, headers and blank
+    lines) and text excludes it. Struck lines keep their entry with empty text, and inserted
+    lines hang off their neighbour's 'before' or 'after' list, so printed line numbers stay
+    valid for every instruction of every amendment, and line_index maps each (page, line)
+    to its entry once, when the bill is read, from the bill's line table when one is given.
+    """
+
+    def __init__(self, bill_md, line_table=None):
+        self.entries = []
+        self.line_index = dict()
+        for page, number, text in number_lines(bill_md, line_table):
+            if number is not None:
+                self.line_index[(page, number)] = len(self.entries)
+            self.entries.append({'page': page, 'number': number, 'text': text, 'before': [], 'after': []})
+
+    def find_line(self, page, number):
+        if (page, number) not in self.line_index:
+            raise UnresolvedInstruction(f'page {page}, line {number} not found')
+        return self.line_index[(page, number)]
+
+    def numbered_indices(self, first, last):
+        """Entry indices of the numbered lines from (page, line) first through last."""
+        first_index = self.find_line(*first)
+        last_index = self.find_line(*last)
+        if last_index < first_index:
+            raise UnresolvedInstruction(f'line range {first} through {last} is reversed')
+        return [index for index in range(first_index, last_index + 1) if self.entries[index]['number'] is not None]
+
+    def plain_view(self, indices):
+        """
+        The text of the given lines joined by spaces, with strikethrough markers removed,
+        and the (entry index, offset) each of its characters came from.
+        """
+        characters = []
+        positions = []
+        for position, index in enumerate(indices):
+            text = self.entries[index]['text']
+            if position:
+                characters.append(' ')
+                positions.append((indices[position - 1], len(self.entries[indices[position - 1]]['text'])))
+            offset = 0
+            while offset < len(text):
+                if text.startswith('~~', offset):
+                    offset += 2
+                    continue
+                characters.append(text[offset])
+                positions.append((index, offset))
+                offset += 1
+        return ''.join(characters), positions
+
+    def find_text(self, indices, text, occurrence=1, after=None):
+        """
+        Locates the occurrence-th match of text in the given lines (the last for -1), searching
+        from plain offset after when given.
+
+        Returns:
+            ((start entry, start offset), (end entry, end offset), plain end offset)
+        """
+        plain, positions = self.plain_view(indices)
+        starts = []
+        start = plain.find(text, after or 0)
+        while start != -1 and text:
+            starts.append(start)
+            start = plain.find(text, start + 1)
+        if not starts or occurrence > len(starts):
+            raise UnresolvedInstruction(f'"{text}" not found')
+        start = starts[occurrence - 1] if occurrence > 0 else starts[-1]
+        end = start + len(text)
+        end_index, end_offset = positions[end - 1]
+        return positions[start], (end_index, end_offset + 1), end
+
+    def replace_span(self, start, end, replacement):
+        """Replaces the text from start to end ((entry index, offset) pairs) with replacement."""
+        start_index, start_offset = start
+        end_index, end_offset = end
+        start_text = self.entries[start_index]['text']
+        end_text = self.entries[end_index]['text']
+        # Take a whole struck word rather than leaving its markers behind, and insert
+        # outside struck words rather than inside them
+        start_struck = start_text[:start_offset].count('~~') % 2 == 1
+        end_struck = end_text[:end_offset].count('~~') % 2 == 1
+        if start == end:
+            if start_struck and start_text[start_offset - 2:start_offset] == '~~':
+                start_offset -= 2
+            elif start_struck and start_text[start_offset:start_offset + 2] == '~~':
+                start_offset += 2
+            end_offset = start_offset
+        else:
+            if start_struck and start_text[start_offset - 2:start_offset] == '~~':
+                start_offset -= 2
+            if end_struck and end_text[end_offset:end_offset + 2] == '~~':
+                end_offset += 2
+        prefix = start_text[:start_offset]
+        suffix = end_text[end_offset:]
+        if replacement:
+            if prefix and not prefix.endswith((' ', '(', '“')) and replacement[0] not in ',.;:)”':
+                replacement = ' ' + replacement
+            if suffix and not suffix.startswith((' ', ',', '.', ';', ':', ')', '”')):
+                replacement = replacement + ' '
+        if start_index == end_index:
+            self.entries[start_index]['text'] = tidy(prefix + replacement + suffix)
+            return
+        self.entries[start_index]['text'] = tidy(prefix + replacement)
+        for index in range(start_index + 1, end_index):
+            if self.entries[index]['number'] is not None:
+                self.entries[index]['text'] = ''
+        self.entries[end_index]['text'] = tidy(suffix)
+
+    def apply(self, operation):
+        op = operation['op']
+        if op == 'strike':
+            indices = self.numbered_indices(*operation['lines'])
+            start, end, _ = self.find_text(indices, operation['text'], operation['occurrence'])
+            self.replace_span(start, end, operation['substitute'])
+        elif op in ('insert_after', 'insert_before'):
+            indices = self.numbered_indices(*operation['lines'])
+            start, end, _ = self.find_text(indices, operation['anchor'], operation['occurrence'])
+            position = end if op == 'insert_after' else start
+            self.replace_span(position, position, operation['text'])
+        elif op == 'strike_range':
+            indices = self.numbered_indices(operation['first'], operation['last'])
+            start, _, start_end = self.find_text(indices[:1], operation['start'])
+            if len(indices) == 1:
+                _, end, _ = self.find_text(indices, operation['end'], after=start_end)
+            else:
+                _, end, _ = self.find_text(indices[-1:], operation['end'])
+            self.replace_span(start, end, operation['substitute'])
+        elif op == 'strike_lines':
+            indices = self.numbered_indices(operation['first'], operation['last'])
+            for index in indices:
+                self.entries[index]['text'] = ''
+            self.entries[indices[0]]['before'].extend(operation['substitute'])
+        elif op in ('insert_after_line', 'insert_before_line'):
+            index = self.find_line(*operation['line'])
+            if op == 'insert_after_line':
+                self.entries[index]['after'].extend(operation['lines'])
+            else:
+                self.entries[index]['before'].extend(operation['lines'])
+
+    def markdown(self):
+        lines = []
+        for entry in self.entries:
+            lines.extend(entry['before'])
+            if entry['number'] is None:
+                lines.append(entry['text'])
+            elif entry['text']:
+                lines.append(f"{entry['number']} {entry['text']}")
+            else:
+                # A struck line keeps its margin number, so the markdown still numbers every line
+                lines.append(str(entry['number']))
+            lines.extend(entry['after'])
+        return '\n'.join(lines)
+
+
+def residual_markdown(residual):
+    """Writes unapplied (amendment_number, page, clause) instructions back out as amendment text."""
+    sections = []
+    for amendment_number, page, clause in residual:
+        heading = f'AMENDMENT NO. {amendment_number}'
+        if not sections or sections[-1][0] != heading:
+            sections.append((heading, []))
+        sections[-1][1].append(f'On page {page}, {clause}.')
+    return '\n\n'.join(heading + '\n' + '\n'.join(sentences) for heading, sentences in sections)
+
+
+def apply_amendment(bill, amendment_md, stats=None):
+    """
+    Applies the instructions of one amendment document to an AddressedBill in place. Keep
+    using the same AddressedBill for a bill's later amendments, so lines inserted by earlier
+    ones stay attached to the printed lines they were inserted at.
+
+    Args:
+        stats: Optional dict whose 'applied' and 'residual' counts are incremented.
+
+    Returns:
+        Amendment text holding the clauses that could not be parsed or located, or '' when
+        every clause was applied.
+    """
+    residual = []
+    for amendment_number, page, line_context, clause, source in parse_amendment(amendment_md):
+        operation = parse_clause(page, line_context, clause)
+        if operation is not None:
+            try:
+                bill.apply(operation)
+            except UnresolvedInstruction:
+                operation = None
+        if operation is None:
+            residual.append((amendment_number, page, source))
+        if stats is not None:
+            outcome = 'residual' if operation is None else 'applied'
+            stats[outcome] = stats.get(outcome, 0) + 1
+    return residual_markdown(residual)
+
+
+def load_amendment_order(session_dir):
+    """Reads {bill_number: [amendment name]} in adoption order, or {} before the first full sync."""
+    order_path = os.path.join(session_dir, AMENDMENT_ORDER_FILE)
+    if not os.path.exists(order_path):
+        return dict()
+    with open(order_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def in_adoption_order(amendment_names, adopted_names):
+    """
+    Sorts a bill's amendment names by their position in adopted_names, the bill's entry in
+    amendment_order.json. Names missing from it follow in amendment-ID order.
+    """
+    position = {name: index for index, name in enumerate(adopted_names)}
+    return sorted(amendment_names, key=lambda name: (position.get(name, len(position)), name))
+
+
+def main(args):
+    line_table = None
+    if args.lines is not None:
+        from line_table import LineTable
+        line_table = LineTable.load(args.lines)
+    with open(args.bill, 'r', encoding='utf-8') as f:
+        bill = AddressedBill(f.read(), line_table)
+    stats = dict()
+    for amendment_path in args.amendments:
+        with open(amendment_path, 'r', encoding='utf-8') as f:
+            residual_md = apply_amendment(bill, f.read(), stats)
+        if residual_md:
+            print(f'Not applied from {amendment_path}:\n{residual_md}\n')
+    print(bill.markdown())
+    print(stats)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Apply amendment markdown to bill markdown without an LLM.')
+    parser.add_argument('bill', help='Bill markdown file')
+    parser.add_argument('amendments', nargs='+', help='Amendment markdown files, applied in the order given (adoption order is recorded in amendment_order.json)')
+    parser.add_argument('--lines', default=None, help='Line table of the bill (.npz from extract_legislation.py), for its printed line numbers')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,143 @@
+# Per-page benchmark of the PDF converters over the committed data/*/pdf corpus.
+# Each converter (strike detection, page markdown, plain text and the single-pass
+# extract_page) runs in its own fresh worker process, so its peak RSS is its own, and every
+# page is timed separately for pages/sec and latency percentiles. Results can be saved as a
+# JSON baseline and later runs compared against it; --check also runs golden_check on the
+# same PDFs, so a speed-up that changes output is caught.
+
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pymupdf
+from leg_to_md import get_struck_word_rects, pdf_page_to_markdown
+from leg_to_basic_txt import page_text
+from extract_legislation import extract_page
+from bench_leg_to_md import corpus_pdf_files
+from golden_check import check_file, GOLDEN_KINDS
+from metrics import peak_rss_bytes
+from file_utils import atomic_write_text
+
+
+def iter_pymupdf_pages(pdf_files, function):
+    for pdf_file in pdf_files:
+        with pymupdf.open(pdf_file) as doc:
+            for page in doc:
+                yield lambda page=page: function(page)
+
+
+# Converter name: function returning one zero-argument callable per page of the PDFs
+CONVERTERS = {
+    'get_struck_word_rects': lambda pdf_files: iter_pymupdf_pages(pdf_files, get_struck_word_rects),
+    'pdf_page_to_markdown': lambda pdf_files: iter_pymupdf_pages(pdf_files, pdf_page_to_markdown),
+    'page_text': lambda pdf_files: iter_pymupdf_pages(pdf_files, page_text),
+    'extract_page': lambda pdf_files: iter_pymupdf_pages(pdf_files, extract_page),
+}
+PERCENTILES = (50, 90, 99)
+
+
+def run_converter(converter, pdf_files, trace_memory=False):
+    """
+    Times every page of one converter. Runs in a fresh worker process.
+
+    Returns:
+        A dict of the page count, total seconds, per-page latency percentiles in
+        milliseconds, peak RSS and (with trace_memory) peak traced Python allocations.
+    """
+    if trace_memory:
+        tracemalloc.start()
+    latencies = []
+    for convert_page in CONVERTERS[converter](pdf_files):
+        start = time.perf_counter()
+        convert_page()
+        latencies.append(time.perf_counter() - start)
+    result = {
+        'converter': converter,
+        'pages': len(latencies),
+        'seconds': float(np.sum(latencies)),
+        'pages_per_second': len(latencies) / max(float(np.sum(latencies)), 1e-9),
+        'peak_rss_bytes': peak_rss_bytes(),
+    }
+    result.update({
+        f'p{percentile}_ms': value * 1000
+        for percentile, value in zip(PERCENTILES, np.percentile(latencies, PERCENTILES) if latencies else [0.0] * len(PERCENTILES))
+    })
+    if trace_memory:
+        result['peak_traced_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """Returns a description of every converter whose pages/sec fell more than tolerance below the baseline."""
+    baseline_by_converter = {result['converter']: result for result in baseline}
+    regressions = []
+    for result in results:
+        previous = baseline_by_converter.get(result['converter'])
+        if previous is None:
+            continue
+        if result['pages_per_second'] < previous['pages_per_second'] * (1 - tolerance):
+            regressions.append(
+                f"{result['converter']}: {result['pages_per_second']:.1f} pages/s, "
+                f"baseline {previous['pages_per_second']:.1f} pages/s"
+            )
+    return regressions
+
+
+def main(args):
+    repo_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    pdf_files = corpus_pdf_files(repo_dir, args.sessions, args.limit)
+    results = []
+    for converter in args.converters:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            results.append(executor.submit(run_converter, converter, pdf_files, args.trace_memory).result())
+
+    print(f'{len(pdf_files)} PDFs from sessions {", ".join(str(s) for s in args.sessions)}')
+    percentile_headers = ''.join(f'{f"p{percentile} ms":>9}' for percentile in PERCENTILES)
+    print(f'{"converter":<22} {"pages":>7} {"seconds":>9} {"pages/s":>9}{percentile_headers} {"RSS MB":>8}')
+    for result in results:
+        percentile_values = ''.join(f"{result[f'p{percentile}_ms']:>9.2f}" for percentile in PERCENTILES)
+        print(
+            f"{result['converter']:<22} {result['pages']:>7} {result['seconds']:>9.2f} {result['pages_per_second']:>9.1f}"
+            f"{percentile_values} {(result['peak_rss_bytes'] or 0) / 2 ** 20:>8.1f}"
+        )
+        if 'peak_traced_bytes' in result:
+            print(f"    peak traced Python allocations: {result['peak_traced_bytes'] / 2 ** 20:.1f} MB")
+
+    status = 0
+    if args.output:
+        atomic_write_text(args.output, json.dumps(results, indent=1))
+        print(f'Saved results to {args.output}')
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare_with_baseline(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f'Slower than baseline: {regression}')
+        if regressions:
+            status = 1
+    if args.check:
+        failures = [failure for failure in map(check_file, [(kind, pdf_file) for pdf_file in pdf_files for kind in GOLDEN_KINDS]) if failure is not None]
+        for failure in failures:
+            print(failure)
+        print(f'{len(failures)} of {len(pdf_files) * len(GOLDEN_KINDS)} outputs differ from the golden md and basic_txt files.')
+        if failures:
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the PDF converters page by page.')
+    parser.add_argument('--sessions', type=int, nargs='+', default=[2023, 2024, 2025], help='Sessions whose PDFs are converted')
+    parser.add_argument('--limit', type=int, default=None, help='Only convert the first N PDFs')
+    parser.add_argument('--converters', nargs='+', choices=list(CONVERTERS), default=list(CONVERTERS), help='Converters to benchmark')
+    parser.add_argument('--trace-memory', action='store_true', help='Also report peak Python allocations with tracemalloc (slows the run)')
+    parser.add_argument('--output', default=None, help='Save the results as JSON, e.g. as a baseline')
+    parser.add_argument('--baseline', default=None, help='Exit with status 1 if a converter is slower than in this saved JSON')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed fractional drop in pages/sec against --baseline')
+    parser.add_argument('--check', action='store_true', help='Also compare md and basic_txt output byte-for-byte with the committed files')
+    args = parser.parse_args()
+    sys.exit(main(args))
@@ -0,0 +1,160 @@
+# Benchmark for download_legislation against a local stub of the MGA website.
+# The stub serves a canned legislation.json built from a committed legislation.csv,
+# synthetic bill detail pages and the committed bill PDFs, with configurable latency,
+# injected 429/503 responses and ETag validation, so both cold and warm (conditional) syncs
+# can be measured.
+
+import os
+import re
+import json
+import hashlib
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pandas as pd
+import download_legislation
+
+
+DETAIL_TEMPLATE = (
+    "<html><body>"
+    "<table><tr><td>{bill_number}</td></tr></table>"
+    "<table>"
+    "<tr><td><a href=\"/{session_year}RS/bills/{prefix}/{lower}T.pdf\">Text - Third - {bill_number}</a></td></tr>"
+    "</table>"
+    "</body></html>"
+)
+
+
+def canned_legislation(repo_dir, session_year, limit=None):
+    csv_path = os.path.join(repo_dir, f'data/{session_year}rs/csv/legislation.csv')
+    df = pd.read_csv(csv_path, dtype=str, keep_default_na=False)
+    if limit:
+        df = df.head(limit)
+    records = df.to_dict(orient='records')
+    for record in records:
+        record['PassedByMGA'] = record.get('PassedByMGA') == 'True'
+    return records
+
+
+def make_handler(repo_dir, session_year, legislation, latency, fail_every):
+    pdf_dir = os.path.join(repo_dir, f'data/{session_year}rs/pdf')
+    legislation_bytes = json.dumps(legislation).encode('utf-8')
+    counter = {'requests': 0, 'bytes': 0}
+    counter_lock = threading.Lock()
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def send_body(self, body, content_type):
+            etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            with counter_lock:
+                counter['bytes'] += len(body)
+
+        def do_GET(self):
+            with counter_lock:
+                counter['requests'] += 1
+                request_number = counter['requests']
+            if latency:
+                time.sleep(latency)
+            if fail_every and request_number % fail_every == 0:
+                self.send_response(429 if request_number % 2 else 503)
+                self.send_header('Retry-After', '0')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            path = self.path.split('?')[0]
+            if path == f'/{session_year}rs/misc/billsmasterlist/legislation.json':
+                self.send_body(legislation_bytes, 'application/json')
+                return
+            detail_match = re.match(r'^/mgawebsite/Legislation/Details/(\w+)$', path)
+            if detail_match:
+                bill_number = detail_match.group(1)
+                body = DETAIL_TEMPLATE.format(
+                    bill_number=bill_number, session_year=session_year,
+                    prefix=bill_number[:2].lower(), lower=bill_number.lower()
+                )
+                self.send_body(body.encode('utf-8'), 'text/html')
+                return
+            pdf_match = re.match(rf'^/{session_year}RS/bills/\w+/(\w+)T\.pdf$', path)
+            if pdf_match:
+                pdf_path = os.path.join(pdf_dir, f'{pdf_match.group(1).upper()}.pdf')
+                if os.path.exists(pdf_path):
+                    with open(pdf_path, 'rb') as pdf_file:
+                        self.send_body(pdf_file.read(), 'application/pdf')
+                    return
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+    return StubHandler, counter
+
+
+def run_cold_and_warm(session_year, base_url, workers, rate, counter):
+    """
+    Runs a cold sync into an empty directory, then a warm sync over the same directory
+    so the second run exercises the conditional-GET cache.
+    """
+    work_dir = tempfile.mkdtemp(prefix='bench_download_')
+    previous_dir = os.getcwd()
+    os.chdir(work_dir)
+    timings = []
+    try:
+        for label in ('cold', 'warm'):
+            counter['requests'] = 0
+            counter['bytes'] = 0
+            start = time.perf_counter()
+            download_legislation.main(session_year, workers=workers, requests_per_second=rate, base_url=base_url)
+            elapsed = time.perf_counter() - start
+            pdf_count = len(os.listdir(os.path.join(work_dir, f'data/{session_year}rs/pdf')))
+            timings.append((label, elapsed, pdf_count, counter['requests'], counter['bytes']))
+    finally:
+        os.chdir(previous_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return timings
+
+
+def main(args):
+    repo_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    legislation = canned_legislation(repo_dir, args.session_year, args.limit)
+    handler, counter = make_handler(repo_dir, args.session_year, legislation, args.latency, args.fail_every)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    results = []
+    try:
+        for workers in args.workers:
+            for timing in run_cold_and_warm(args.session_year, base_url, workers, args.rate, counter):
+                results.append((workers, *timing))
+    finally:
+        server.shutdown()
+    print(f'{"workers":>8} {"sync":>5} {"seconds":>9} {"bills/s":>9} {"pdfs":>6} {"requests":>9} {"MB sent":>9}')
+    for workers, label, elapsed, pdf_count, request_count, byte_count in results:
+        print(f'{workers:>8} {label:>5} {elapsed:>9.2f} {pdf_count / elapsed:>9.1f} {pdf_count:>6} {request_count:>9} {byte_count / 1e6:>9.2f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark download_legislation against a local stub server.')
+    parser.add_argument('--session-year', type=int, default=2025, help='Session whose committed data backs the stub')
+    parser.add_argument('--limit', type=int, default=100, help='Number of bills served in legislation.json')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 8], help='Worker counts to compare')
+    parser.add_argument('--rate', type=float, default=0, help='Per-host requests per second (0 to disable)')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds of simulated server latency per request')
+    parser.add_argument('--fail-every', type=int, default=25, help='Answer every Nth request with 429/503 (0 to disable)')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,67 @@
+# Benchmark for leg_to_md conversion throughput over the committed data/*/pdf corpus.
+# Converts into a temporary directory and reports pages per second for each worker count.
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+from glob import glob
+from leg_to_md import convert_pdfs
+
+
+def corpus_pdf_files(repo_dir, sessions, limit=None):
+    pdf_files = []
+    for session_year in sessions:
+        pdf_files.extend(sorted(glob(os.path.join(repo_dir, f'data/{session_year}rs/pdf/*.pdf'))))
+    if limit:
+        pdf_files = pdf_files[:limit]
+    return pdf_files
+
+
+def compare_with_committed(pdf_files, output_dir):
+    """Returns the names of converted files that differ from the committed data/*/md output."""
+    mismatches = []
+    for pdf_file in pdf_files:
+        file_name, _ = os.path.splitext(os.path.basename(pdf_file))
+        committed_path = os.path.join(os.path.dirname(os.path.dirname(pdf_file)), 'md', f'{file_name}.md')
+        with open(os.path.join(output_dir, f'{file_name}.md'), 'rb') as f:
+            converted = f.read()
+        with open(committed_path, 'rb') as f:
+            committed = f.read()
+        if converted != committed:
+            mismatches.append(file_name)
+    return mismatches
+
+
+def main(args):
+    repo_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    pdf_files = corpus_pdf_files(repo_dir, args.sessions, args.limit)
+    results = []
+    for workers in args.workers:
+        output_dir = tempfile.mkdtemp(prefix='bench_leg_to_md_')
+        try:
+            start = time.perf_counter()
+            page_count = convert_pdfs(pdf_files, output_dir, workers=workers, max_memory_mb=args.max_memory_mb)
+            elapsed = time.perf_counter() - start
+            mismatches = compare_with_committed(pdf_files, output_dir) if args.check else []
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+        results.append((workers, page_count, elapsed, mismatches))
+    print(f'{len(pdf_files)} PDFs from sessions {", ".join(str(s) for s in args.sessions)}')
+    print(f'{"workers":>8} {"pages":>7} {"seconds":>9} {"pages/s":>9}')
+    for workers, page_count, elapsed, mismatches in results:
+        print(f'{workers:>8} {page_count:>7} {elapsed:>9.2f} {page_count / elapsed:>9.1f}')
+        if mismatches:
+            print(f'    {len(mismatches)} files differ from committed markdown: {", ".join(mismatches[:10])}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark leg_to_md conversion throughput.')
+    parser.add_argument('--sessions', type=int, nargs='+', default=[2023, 2024, 2025], help='Sessions whose PDFs are converted')
+    parser.add_argument('--limit', type=int, default=None, help='Only convert the first N PDFs')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, os.cpu_count() or 1], help='Worker counts to compare')
+    parser.add_argument('--max-memory-mb', type=int, default=None, help='Address-space limit for each worker process, in MB')
+    parser.add_argument('--check', action='store_true', help='Also compare the output byte-for-byte with data/*/md')
+    args = parser.parse_args()
+    main(args)
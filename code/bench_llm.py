@@ -0,0 +1,148 @@
+# Benchmark for the concurrent LLM executor against a local fake LLM server.
+# The fake server speaks the OpenAI chat completions API, answers every request with a valid
+# AnswersToQuestions JSON after a log-normally distributed delay, and returns 429 with
+# Retry-After when more than a configured number of requests arrive in one second, so
+# throughput, latency percentiles and rate limit handling can be measured offline.
+
+import os
+import json
+import time
+import argparse
+import threading
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+from openai import OpenAI
+from leg_qa import SYSTEM_PROMPT, AnswersToQuestions, bill_markdown_path
+from llm_executor import LLMExecutor, ModelBudget
+
+
+def fake_answers(bill_md):
+    return AnswersToQuestions(
+        bill_summary=' '.join(bill_md.split()[:40]),
+        programmatic=False,
+        responsible_party='Maryland Department of Legislative Services',
+        stakeholders='Residents of Maryland',
+        innovative_summary='Not innovative.',
+        innovative_score=1,
+        child_poverty_direct_summary='No direct impact.',
+        child_poverty_direct_score=1,
+    ).model_dump_json()
+
+
+def make_handler(latency, max_requests_per_second, seed=0):
+    rng = np.random.default_rng(seed)
+    rng_lock = threading.Lock()
+    recent = deque()
+    counter = {'requests': 0, 'rate_limited': 0}
+    counter_lock = threading.Lock()
+
+    class FakeLLMHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, payload, headers=None):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            with counter_lock:
+                counter['requests'] += 1
+                now = time.monotonic()
+                while recent and recent[0] < now - 1:
+                    recent.popleft()
+                limited = bool(max_requests_per_second) and len(recent) >= max_requests_per_second
+                if limited:
+                    counter['rate_limited'] += 1
+                else:
+                    recent.append(now)
+            if limited:
+                self.send_json(429, {'error': {'message': 'Rate limit exceeded', 'type': 'rate_limit_error'}}, {'Retry-After': '1'})
+                return
+            with rng_lock:
+                delay = rng.lognormal(np.log(latency), 0.5) if latency else 0
+            time.sleep(delay)
+            bill_md = request['messages'][-1]['content']
+            content = fake_answers(bill_md)
+            prompt_tokens = sum(len(message['content']) for message in request['messages']) // 4
+            self.send_json(200, {
+                'id': f"chatcmpl-{counter['requests']}",
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': request['model'],
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': content, 'refusal': None},
+                    'finish_reason': 'stop',
+                    'logprobs': None,
+                }],
+                'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(content) // 4, 'total_tokens': prompt_tokens + len(content) // 4},
+            })
+
+    return FakeLLMHandler, counter
+
+
+def load_bill_mds(repo_dir, session_year, limit):
+    md_dir = os.path.join(repo_dir, f'data/{session_year}rs/md')
+    bill_numbers = sorted(
+        file_name[:-3] for file_name in os.listdir(md_dir)
+        if file_name.endswith('.md') and '_' not in file_name
+    )[:limit]
+    bill_mds = []
+    for bill_number in bill_numbers:
+        with open(bill_markdown_path(md_dir, bill_number), 'r', encoding='utf-8') as f:
+            bill_mds.append(f.read())
+    return bill_mds
+
+
+def main(args):
+    repo_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    bill_mds = load_bill_mds(repo_dir, args.session_year, args.limit)
+    handler, counter = make_handler(args.latency, args.server_rps)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    # The client's own retries are disabled so 429s reach the executor's adaptive backoff
+    client = OpenAI(api_key='fake', base_url=f'http://127.0.0.1:{server.server_address[1]}/v1', max_retries=0)
+    results = []
+    try:
+        for workers in args.workers:
+            counter['requests'] = 0
+            counter['rate_limited'] = 0
+            budget = ModelBudget(args.rpm, args.tpm)
+            executor = LLMExecutor(client, 'fake-model', 'gpt', workers=workers, budget=budget, max_retries=args.max_retries)
+            start = time.perf_counter()
+            answers = executor.map(SYSTEM_PROMPT, bill_mds, AnswersToQuestions, progress=False)
+            elapsed = time.perf_counter() - start
+            failures = sum(answer is None for answer in answers)
+            percentiles = executor.latency_percentiles()
+            results.append((workers, elapsed, len(bill_mds) / elapsed, percentiles, counter['requests'], counter['rate_limited'], failures))
+    finally:
+        server.shutdown()
+    print(f'{"workers":>8} {"seconds":>9} {"bills/s":>9} {"p50 s":>7} {"p90 s":>7} {"p99 s":>7} {"requests":>9} {"429s":>6} {"failed":>7}')
+    for workers, elapsed, throughput, percentiles, request_count, rate_limited, failures in results:
+        print(
+            f'{workers:>8} {elapsed:>9.2f} {throughput:>9.1f} {percentiles[50]:>7.2f} {percentiles[90]:>7.2f} '
+            f'{percentiles[99]:>7.2f} {request_count:>9} {rate_limited:>6} {failures:>7}'
+        )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the concurrent LLM executor against a local fake LLM server.')
+    parser.add_argument('--session-year', type=int, default=2025, help='Session whose committed markdown is sent as bills')
+    parser.add_argument('--limit', type=int, default=100, help='Number of bills to query')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 8, 32], help='Worker counts to compare')
+    parser.add_argument('--latency', type=float, default=0.2, help='Median seconds of simulated model latency per request')
+    parser.add_argument('--server-rps', type=int, default=50, help='Requests per second the fake server accepts before answering 429 (0 to disable)')
+    parser.add_argument('--rpm', type=int, default=None, help='Client requests per minute budget (default: unlimited)')
+    parser.add_argument('--tpm', type=int, default=None, help='Client tokens per minute budget (default: unlimited)')
+    parser.add_argument('--max-retries', type=int, default=5, help='Attempts per bill')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,86 @@
+# Micro-benchmark for strikethrough matching in leg_to_md over the committed data/*/pdf corpus.
+# Times leg_to_md.match_struck_words against the original word-by-strike loop on every page
+# that has strike lines, and checks that both find exactly the same struck words.
+
+import os
+import time
+import argparse
+from glob import glob
+from tqdm import tqdm
+import pymupdf
+from leg_to_md import find_strike_line_rects, match_struck_words
+
+
+def reference_match_struck_words(words, strikethrough_line_rects):
+    """The original O(words x strikes) matching loop from get_struck_word_rects."""
+    struck_word_bounding_boxes = set()
+    for word_data in words:
+        word_rect = pymupdf.Rect(word_data[:4])
+        word_text = word_data[4]
+
+        if word_rect.is_empty or not word_text.strip():
+            continue
+
+        for strike_rect in strikethrough_line_rects:
+            intersect_rect = word_rect & strike_rect
+            if not intersect_rect.is_empty:
+                word_v_center = word_rect.y0 + word_rect.height / 2
+                strike_v_center = strike_rect.y0 + strike_rect.height / 2
+                if (abs(word_v_center - strike_v_center) < (word_rect.height / 4)) and \
+                   (intersect_rect.width > word_rect.width * 0.5 or intersect_rect.width > 5):
+                    struck_word_bounding_boxes.add(word_rect)
+                    break
+    return struck_word_bounding_boxes
+
+
+def main(args):
+    repo_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    pdf_files = []
+    for session_year in args.sessions:
+        pdf_files.extend(sorted(glob(os.path.join(repo_dir, f'data/{session_year}rs/pdf/*.pdf'))))
+    if args.limit:
+        pdf_files = pdf_files[:args.limit]
+
+    page_count = 0
+    pair_count = 0
+    struck_count = 0
+    reference_seconds = 0.0
+    indexed_seconds = 0.0
+    mismatches = []
+    for pdf_file in tqdm(pdf_files):
+        with pymupdf.open(pdf_file) as doc:
+            for page in doc:
+                strike_rects = find_strike_line_rects(page)
+                if not strike_rects:
+                    continue
+                words = page.get_text("words")
+                page_count += 1
+                pair_count += len(words) * len(strike_rects)
+
+                start = time.perf_counter()
+                expected = reference_match_struck_words(words, strike_rects)
+                reference_seconds += time.perf_counter() - start
+
+                start = time.perf_counter()
+                actual = match_struck_words(words, strike_rects)
+                indexed_seconds += time.perf_counter() - start
+
+                struck_count += len(expected)
+                if actual != expected:
+                    mismatches.append(f'{os.path.basename(pdf_file)} page {page.number + 1}')
+
+    print(f'{page_count} pages with strike lines, {pair_count} word x strike pairs, {struck_count} struck words')
+    print(f'reference loop: {reference_seconds:.3f}s')
+    print(f'indexed:        {indexed_seconds:.3f}s ({reference_seconds / max(indexed_seconds, 1e-9):.1f}x)')
+    if mismatches:
+        print(f'{len(mismatches)} pages differ: {", ".join(mismatches[:10])}')
+    else:
+        print('Struck word sets are identical on every page.')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark strikethrough matching in leg_to_md.')
+    parser.add_argument('--sessions', type=int, nargs='+', default=[2023, 2024, 2025], help='Sessions whose PDFs are scanned')
+    parser.add_argument('--limit', type=int, default=None, help='Only scan the first N PDFs')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,104 @@
+# Structure-aware chunking of bill markdown for prompts that do not fit one context window.
+# Struck text is dropped (or compressed to a marker), then the bill is split at the largest
+# structural boundary that yields pieces under the token budget: bill SECTIONs, then
+# statute Articles, then pages, then paragraphs, then lines. Pieces are packed greedily
+# into chunks, measured with the same tiktoken tokenizer as count_tokens.py.
+
+import re
+from count_tokens import count_tokens
+
+
+STRUCK_RUN_PATTERN = re.compile(r'~~[^~\n]*~~(?:[ \t]*~~[^~\n]*~~)*')
+END_OF_PAGE_PATTERN = re.compile(r'^END OF PAGE \d+$')
+# Boundaries to split at, from the largest unit to the smallest
+BOUNDARY_PATTERNS = [
+    re.compile(r'^SECTION \d+'),
+    re.compile(r'^Article – '),
+    re.compile(r'^START OF PAGE \d+$'),
+    re.compile(r'^$'),
+]
+STRUCK_MODES = ('drop', 'compress', 'keep')
+
+
+def prepare_markdown(bill_md, struck='drop'):
+    """
+    Removes END OF PAGE markers and, unless struck is 'keep', struck text: 'drop' deletes
+    it, 'compress' replaces each run of struck words with a short marker.
+
+    Returns:
+        The bill's lines.
+    """
+    lines = []
+    for line in bill_md.split('\n'):
+        if END_OF_PAGE_PATTERN.match(line):
+            continue
+        if struck == 'drop':
+            line = re.sub(r'  +', ' ', STRUCK_RUN_PATTERN.sub('', line)).strip()
+        elif struck == 'compress':
+            line = STRUCK_RUN_PATTERN.sub('~~…~~', line)
+        lines.append(line)
+    return lines
+
+
+def split_at(lines, pattern):
+    """Splits lines into groups, each starting at a line that matches pattern."""
+    groups = [[]]
+    for line in lines:
+        if pattern.match(line) and groups[-1]:
+            groups.append([])
+        groups[-1].append(line)
+    return groups
+
+
+def split_text_by_tokens(text, tokenizer, max_tokens):
+    tokens = tokenizer.encode(text)
+    return [tokenizer.decode(tokens[start:start + max_tokens]) for start in range(0, len(tokens), max_tokens)]
+
+
+def split_lines(lines, tokenizer, max_tokens, level=0):
+    """
+    Splits lines into (text, token_count) pieces of at most max_tokens, using the largest
+    boundary in BOUNDARY_PATTERNS (from level on) that separates them.
+    """
+    text = '\n'.join(lines)
+    token_count = count_tokens(tokenizer, text)
+    if token_count <= max_tokens:
+        return [(text, token_count)]
+    if level == len(BOUNDARY_PATTERNS):
+        # No boundary left: one line at a time, and an oversized line by token count
+        if len(lines) == 1:
+            return [(piece, count_tokens(tokenizer, piece)) for piece in split_text_by_tokens(text, tokenizer, max_tokens)]
+        groups = [[line] for line in lines]
+    else:
+        groups = split_at(lines, BOUNDARY_PATTERNS[level])
+        if len(groups) == 1:
+            return split_lines(lines, tokenizer, max_tokens, level + 1)
+    pieces = []
+    for group in groups:
+        pieces.extend(split_lines(group, tokenizer, max_tokens, level + 1))
+    return pieces
+
+
+def chunk_bill(bill_md, tokenizer, max_tokens, struck='drop'):
+    """
+    Splits bill markdown into chunks of at most about max_tokens tokens along the bill's
+    structure, with struck text handled as in prepare_markdown.
+
+    Returns:
+        A list of chunk texts, in bill order.
+    """
+    pieces = split_lines(prepare_markdown(bill_md, struck), tokenizer, max_tokens)
+    chunks = []
+    current = []
+    current_tokens = 0
+    for text, token_count in pieces:
+        # A newline between pieces is about one token
+        if current and current_tokens + 1 + token_count > max_tokens:
+            chunks.append('\n'.join(current))
+            current = []
+            current_tokens = 0
+        current.append(text)
+        current_tokens += token_count + (1 if len(current) > 1 else 0)
+    if current:
+        chunks.append('\n'.join(current))
+    return chunks
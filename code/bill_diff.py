@@ -0,0 +1,307 @@
+# Line- and word-level diffs of leg_to_md markdown: between two versions of a bill (e.g. first
+# reader and enrolled) or between {bill}.md and {bill}_amended.md. Every line is interned to
+# an integer and every page to the tuple of its line ids, so matching pages are aligned and
+# skipped by comparing integers; only the pages that differ are diffed line by line, and only
+# the replaced lines word by word. For amended bills, the changes are also checked against
+# the lines and text the amendment instructions address, flagging LLM output that changed
+# (or silently dropped) text no instruction touched.
+
+import os
+import re
+import sys
+import json
+import argparse
+from glob import glob
+from difflib import SequenceMatcher
+from tqdm import tqdm
+from file_utils import atomic_write_text
+from bill_chunking import STRUCK_RUN_PATTERN
+from amendment_engine import (
+    AddressedBill, UnresolvedInstruction, PAGE_START_PATTERN, PAGE_END_PATTERN,
+    number_lines, parse_amendment, parse_clause, normalize_inline
+)
+from line_table import LineTable, load_line_table
+
+
+WORD_PATTERN = re.compile(r'[a-z0-9]+')
+QUOTED_PATTERN = re.compile(r'[“"]([^”"]*)[”"]')
+CLAUSE_LINES_PATTERN = re.compile(r'lines? (\d+)(?:\s+(?:through|and)\s+(\d+))?')
+# Amended text may be re-wrapped, so a change this many lines from an addressed line is
+# still taken as that instruction's
+LINE_TOLERANCE = 1
+
+
+def document_lines(markdown, struck='keep', line_table=None):
+    """
+    The text lines of leg_to_md markdown as (page, margin line number, text) tuples, without
+    page markers, blank lines or margin numbers, numbered by amendment_engine.number_lines
+    (from line_table when given). struck='drop' removes struck text first. Markdown without
+    page markers (e.g. LLM output) has page None throughout.
+    """
+    lines = []
+    for page, number, text in number_lines(markdown, line_table):
+        if number is None and (PAGE_START_PATTERN.match(text) or PAGE_END_PATTERN.match(text)):
+            continue
+        if struck == 'drop':
+            text = STRUCK_RUN_PATTERN.sub('', text)
+        text = normalize_inline(text)
+        if text:
+            lines.append((page, number, text))
+    return lines
+
+
+def words(text):
+    return WORD_PATTERN.findall(text.replace('~~', ' ').lower())
+
+
+def word_changes(old_text, new_text):
+    """Word-level edits turning old_text into new_text, as {'op', 'old', 'new'} dicts."""
+    old_words = old_text.split()
+    new_words = new_text.split()
+    changes = []
+    for op, i1, i2, j1, j2 in SequenceMatcher(None, old_words, new_words, autojunk=False).get_opcodes():
+        if op != 'equal':
+            changes.append({'op': op, 'old': ' '.join(old_words[i1:i2]), 'new': ' '.join(new_words[j1:j2])})
+    return changes
+
+
+def line_record(line):
+    page, number, text = line
+    return {'page': page, 'line': number, 'text': text}
+
+
+def diff_lines(old_lines, new_lines):
+    """
+    Diffs two lists of document_lines, skipping matching pages by their hashes.
+
+    Returns:
+        A dict with 'stats' and 'changes', each change holding its 'op' (insert, delete or
+        replace), the 'old' and 'new' lines, word-level 'words' for replacements, and
+        'old_position', the index in old_lines where it starts.
+    """
+    line_ids = dict()
+    old_ids = [line_ids.setdefault(text, len(line_ids)) for _, _, text in old_lines]
+    new_ids = [line_ids.setdefault(text, len(line_ids)) for _, _, text in new_lines]
+
+    def page_blocks(lines, ids):
+        """(start, end) line index ranges of each page, with a hashable id per page."""
+        blocks = []
+        for index, (page, _, _) in enumerate(lines):
+            if not blocks or lines[blocks[-1][0]][0] != page:
+                blocks.append([index, index + 1])
+            else:
+                blocks[-1][1] = index + 1
+        return blocks, [tuple(ids[start:end]) for start, end in blocks]
+
+    old_blocks, old_block_ids = page_blocks(old_lines, old_ids)
+    new_blocks, new_block_ids = page_blocks(new_lines, new_ids)
+    stats = {
+        'old_lines': len(old_lines), 'new_lines': len(new_lines), 'pages_unchanged': 0,
+        'lines_unchanged': 0, 'lines_deleted': 0, 'lines_inserted': 0, 'words_deleted': 0, 'words_inserted': 0,
+    }
+    changes = []
+    block_matcher = SequenceMatcher(None, old_block_ids, new_block_ids, autojunk=False)
+    for op, b1, b2, c1, c2 in block_matcher.get_opcodes():
+        old_start = old_blocks[b1][0] if b1 < len(old_blocks) else len(old_lines)
+        old_end = old_blocks[b2 - 1][1] if b2 > b1 else old_start
+        new_start = new_blocks[c1][0] if c1 < len(new_blocks) else len(new_lines)
+        new_end = new_blocks[c2 - 1][1] if c2 > c1 else new_start
+        if op == 'equal':
+            stats['pages_unchanged'] += b2 - b1
+            stats['lines_unchanged'] += old_end - old_start
+            continue
+        line_matcher = SequenceMatcher(None, old_ids[old_start:old_end], new_ids[new_start:new_end], autojunk=False)
+        for line_op, i1, i2, j1, j2 in line_matcher.get_opcodes():
+            if line_op == 'equal':
+                stats['lines_unchanged'] += i2 - i1
+                continue
+            old_part = old_lines[old_start + i1:old_start + i2]
+            new_part = new_lines[new_start + j1:new_start + j2]
+            change = {
+                'op': line_op,
+                'old_position': old_start + i1,
+                'old': [line_record(line) for line in old_part],
+                'new': [line_record(line) for line in new_part],
+            }
+            if line_op == 'replace':
+                change['words'] = word_changes(' '.join(text for _, _, text in old_part), ' '.join(text for _, _, text in new_part))
+                deleted = sum(len(word['old'].split()) for word in change['words'])
+                inserted = sum(len(word['new'].split()) for word in change['words'])
+            else:
+                deleted = sum(len(text.split()) for _, _, text in old_part)
+                inserted = sum(len(text.split()) for _, _, text in new_part)
+            stats['lines_deleted'] += len(old_part)
+            stats['lines_inserted'] += len(new_part)
+            stats['words_deleted'] += deleted
+            stats['words_inserted'] += inserted
+            changes.append(change)
+    stats['changes'] = len(changes)
+    return {'stats': stats, 'changes': changes}
+
+
+def diff_markdown(old_md, new_md, struck='keep', line_table=None):
+    return diff_lines(document_lines(old_md, struck, line_table), document_lines(new_md, struck))
+
+
+def amendment_scope(bill_md, amendment_mds, line_table=None):
+    """
+    What the amendment instructions address in the original bill: the (page, line) pairs
+    they name, the pages named by instructions without a line, and the words of their
+    quoted text.
+    """
+    bill = AddressedBill(bill_md, line_table)
+    scope = {'lines': set(), 'pages': set(), 'words': set()}
+    for amendment_md in amendment_mds:
+        for _, page, line_context, clause, _ in parse_amendment(amendment_md):
+            for quoted in QUOTED_PATTERN.findall(clause):
+                scope['words'].update(words(quoted))
+            operation = parse_clause(page, line_context, clause)
+            if operation is not None and operation['op'] in ('strike_range', 'strike_lines'):
+                first, last = operation['first'], operation['last']
+            elif operation is not None and operation['op'] in ('insert_after_line', 'insert_before_line'):
+                first = last = operation['line']
+            elif operation is not None:
+                first, last = operation['lines']
+            elif line_context is not None:
+                first, last = (page, line_context[0]), (page, line_context[1])
+            else:
+                # An instruction that did not parse: take the lines it names on its page, if any
+                named = [(int(first_line), int(last_line or first_line)) for first_line, last_line in CLAUSE_LINES_PATTERN.findall(clause)]
+                if not named:
+                    scope['pages'].add(page)
+                for first_line, last_line in named:
+                    scope['lines'].update((page, line) for line in range(first_line, last_line + 1))
+                continue
+            try:
+                indices = bill.numbered_indices(first, last)
+                scope['lines'].update((bill.entries[index]['page'], bill.entries[index]['number']) for index in indices)
+            except UnresolvedInstruction:
+                scope['pages'].update(range(first[0], last[0] + 1))
+    return scope
+
+
+def in_scope(scope, page, number):
+    if page in scope['pages']:
+        return True
+    if number is None:
+        return False
+    return any((page, number + offset) in scope['lines'] for offset in range(-LINE_TOLERANCE, LINE_TOLERANCE + 1))
+
+
+def check_amended(bill_md, amendment_mds, amended_md, line_table=None):
+    """
+    Diffs a bill with its amended markdown and flags the changes no amendment instruction
+    accounts for: changes to lines of the bill that no instruction addresses ('outside
+    instructions'), and inserted words found neither in the instructions' quoted text nor in
+    the text they replace ('unexplained text'). line_table is the bill's line table, if any.
+
+    Returns:
+        The diff_lines result with an 'over_edits' list of {'change', 'reasons', 'words'},
+        where change indexes 'changes'.
+    """
+    old_lines = document_lines(bill_md, line_table=line_table)
+    result = diff_lines(old_lines, document_lines(amended_md))
+    scope = amendment_scope(bill_md, amendment_mds, line_table)
+    over_edits = []
+    for change_index, change in enumerate(result['changes']):
+        if change['old']:
+            touched = [(line['page'], line['line']) for line in change['old']]
+        else:
+            # An insertion is placed by the bill lines on either side of it
+            position = change['old_position']
+            touched = [old_lines[index][:2] for index in (position - 1, position) if 0 <= index < len(old_lines)]
+        reasons = []
+        if change['old'] and not all(in_scope(scope, page, number) for page, number in touched):
+            reasons.append('outside instructions')
+        elif not change['old'] and not any(in_scope(scope, page, number) for page, number in touched):
+            reasons.append('outside instructions')
+        replaced_words = set(words(' '.join(line['text'] for line in change['old'])))
+        unexplained = sorted(set(words(' '.join(line['text'] for line in change['new']))) - replaced_words - scope['words'])
+        if unexplained:
+            reasons.append('unexplained text')
+        if reasons:
+            over_edits.append({'change': change_index, 'reasons': reasons, 'words': unexplained})
+    result['over_edits'] = over_edits
+    result['stats']['over_edits'] = len(over_edits)
+    return result
+
+
+def summary(result):
+    stats = result['stats']
+    text = (
+        f"{stats['changes']} changes: {stats['lines_deleted']} lines (-{stats['words_deleted']} words) out, "
+        f"{stats['lines_inserted']} lines (+{stats['words_inserted']} words) in, "
+        f"{stats['lines_unchanged']} lines and {stats['pages_unchanged']} pages unchanged"
+    )
+    if 'over_edits' in result:
+        text += f", {len(result['over_edits'])} beyond the amendment instructions"
+    return text
+
+
+def read_markdown(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def check_session(session_year, bill_numbers=None):
+    """
+    Checks every {bill}_amended.md of a session against its bill and _amd amendments.
+
+    Returns:
+        A dict mapping each bill number to its check_amended result.
+    """
+    session_dir = f'data/{session_year}rs'
+    md_dir = os.path.join(session_dir, 'md')
+    results = dict()
+    for amended_path in tqdm(sorted(glob(os.path.join(md_dir, '*_amended.md'))), desc=f'{session_year} amended bills'):
+        bill_number = os.path.basename(amended_path)[:-len('_amended.md')]
+        if bill_numbers and bill_number not in bill_numbers:
+            continue
+        amendment_paths = sorted(glob(os.path.join(md_dir, f'{bill_number}_amd*.md')))
+        results[bill_number] = check_amended(
+            read_markdown(os.path.join(md_dir, f'{bill_number}.md')),
+            [read_markdown(path) for path in amendment_paths],
+            read_markdown(amended_path),
+            load_line_table(session_dir, bill_number)
+        )
+    return results
+
+
+def main(args):
+    if args.command == 'diff':
+        line_table = LineTable.load(args.lines) if args.lines else None
+        if args.amendments:
+            result = check_amended(read_markdown(args.old), [read_markdown(path) for path in args.amendments], read_markdown(args.new), line_table)
+        else:
+            result = diff_markdown(read_markdown(args.old), read_markdown(args.new), args.struck, line_table)
+        print(summary(result))
+        flagged = bool(result.get('over_edits'))
+    else:
+        result = check_session(args.session_year, args.bills)
+        flagged_bills = [bill_number for bill_number, bill_result in result.items() if bill_result['over_edits']]
+        for bill_number in flagged_bills:
+            print(f'{bill_number}: {summary(result[bill_number])}')
+        print(f'{len(flagged_bills)} of {len(result)} amended bills change text beyond their amendment instructions.')
+        flagged = bool(flagged_bills)
+    if args.output:
+        atomic_write_text(args.output, json.dumps(result, indent=1, ensure_ascii=False))
+        print(f'Saved the diff to {args.output}')
+    return 1 if flagged else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Diff bill markdown versions and check LLM-amended bills against their amendments.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    diff_parser = subparsers.add_parser('diff', help='Diff two markdown files')
+    diff_parser.add_argument('old', help='The earlier markdown, e.g. data/2025rs/md/HB0001.md')
+    diff_parser.add_argument('new', help='The later markdown, e.g. data/2025rs/md/HB0001_amended.md')
+    diff_parser.add_argument('--amendments', nargs='+', default=None, help='Amendment markdown applied to old to get new; flags changes beyond them')
+    diff_parser.add_argument('--lines', default=None, help='Line table of old (.npz from extract_legislation.py), for its printed line numbers')
+    diff_parser.add_argument('--struck', choices=['keep', 'drop'], default='keep', help='Compare struck text too, or drop it first')
+    diff_parser.add_argument('--output', default=None, help='Write the structured diff to this JSON path')
+    check_parser = subparsers.add_parser('check-amended', help="Check a session's _amended.md files against their amendments")
+    check_parser.add_argument('session_year', type=int, help='The regular session year')
+    check_parser.add_argument('--bills', nargs='+', default=None, help='Only check these bill numbers')
+    check_parser.add_argument('--output', default=None, help='Write the structured diffs to this JSON path')
+    args = parser.parse_args()
+    sys.exit(main(args))
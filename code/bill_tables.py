@@ -0,0 +1,187 @@
+# Crossfile resolution and normalised bill metadata tables for download_legislation.
+# The MGA master list nests sponsors, subjects and statutes inside each bill, and
+# legislation.csv keeps them as Python reprs. Here they are flattened into typed long tables
+# (bill x sponsor, bill x subject, bill x statute section), each saved column by column as an
+# uncompressed .npz under data/{session_year}rs/tables/, so a table loads in milliseconds
+# without re-parsing the CSV. Crossfiled bills are resolved as a graph, without row loops.
+
+import os
+import ast
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from file_utils import atomic_open
+
+
+TABLE_NAMES = ['bill_sponsors', 'bill_subjects', 'bill_statutes']
+# Column dtypes of each table, for the empty tables of a session with no bills yet
+TABLE_COLUMNS = {
+    'bill_sponsors': {'bill_number': str, 'position': np.int16, 'sponsor': str, 'primary': bool},
+    'bill_subjects': {'bill_number': str, 'kind': str, 'code': str, 'name': str},
+    'bill_statutes': {'bill_number': str, 'article_code': str, 'article_title': str, 'section': str},
+}
+
+
+def parse_nested(value):
+    """A nested master-list field as a list, from the JSON list itself or its CSV repr."""
+    if isinstance(value, list):
+        return value
+    if isinstance(value, str) and value.startswith('['):
+        return ast.literal_eval(value)
+    return []
+
+
+def resolve_crossfiles(df):
+    """
+    Keeps one bill of each group of crossfiled bills. Bills are linked when either names the
+    other as its CrossfileBillNumber, and linked bills form a group (so chains of crossfiles
+    collapse too). The canonical bill of a group is the one with the lowest BillNumber in
+    string order: the House bill of a House/Senate pair, otherwise the lower number. The
+    master list is sorted by BillNumber, so this is the bill the earlier row-order filter kept.
+
+    Returns:
+        The rows of the canonical bills, in their original order (df itself when it is
+        empty, e.g. a session before any bill has passed).
+    """
+    if df.empty:
+        return df
+    bill_numbers = df['BillNumber'].to_numpy(dtype=str)
+    positions = pd.Series(np.arange(len(df)), index=bill_numbers)
+    partners = df['CrossfileBillNumber'].map(positions).to_numpy()
+    linked = ~np.isnan(partners)
+    left = np.flatnonzero(linked)
+    right = partners[linked].astype(np.int64)
+    # Each bill starts labelled with its BillNumber rank; labels spread along links until
+    # every bill carries the lowest rank of its group
+    labels = np.argsort(np.argsort(bill_numbers, kind='stable'), kind='stable')
+    ranks = labels.copy()
+    while True:
+        smallest = np.minimum(labels[left], labels[right])
+        updated = labels.copy()
+        np.minimum.at(updated, left, smallest)
+        np.minimum.at(updated, right, smallest)
+        if np.array_equal(updated, labels):
+            break
+        labels = updated
+    return df[labels == ranks]
+
+
+def explode_nested(df, column):
+    """One row per element of a nested column: (BillNumber, position, element dict)."""
+    nested = df.set_index('BillNumber')[column].map(parse_nested).explode().dropna()
+    return pd.DataFrame({
+        'bill_number': nested.index.to_numpy(dtype=str),
+        'position': nested.groupby(level=0).cumcount().to_numpy(dtype=np.int16),
+        'element': nested.to_numpy(),
+    })
+
+
+def sponsors_table(df):
+    sponsors = explode_nested(df, 'Sponsors')
+    names = sponsors['element'].map(lambda element: element.get('Name', ''))
+    primary = sponsors['bill_number'].map(df.set_index('BillNumber')['SponsorPrimary'])
+    return pd.DataFrame({
+        'bill_number': sponsors['bill_number'],
+        'position': sponsors['position'],
+        'sponsor': names,
+        'primary': (names == primary).to_numpy(dtype=bool),
+    })
+
+
+def subjects_table(df):
+    tables = []
+    for kind, column in (('broad', 'BroadSubjects'), ('narrow', 'NarrowSubjects')):
+        subjects = explode_nested(df, column)
+        tables.append(pd.DataFrame({
+            'bill_number': subjects['bill_number'],
+            'kind': kind,
+            'code': subjects['element'].map(lambda element: element.get('Code', '')),
+            'name': subjects['element'].map(lambda element: element.get('Name', '')),
+        }))
+    return pd.concat(tables, ignore_index=True).sort_values(['bill_number', 'kind'], kind='stable', ignore_index=True)
+
+
+def statutes_table(df):
+    articles = explode_nested(df, 'Statutes')
+    sections = pd.DataFrame({
+        'bill_number': articles['bill_number'],
+        'article_code': articles['element'].map(lambda element: element.get('Article', {}).get('Code', '')),
+        'article_title': articles['element'].map(lambda element: element.get('Article', {}).get('Title', '')),
+        'section': articles['element'].map(lambda element: [section.get('Section', '') for section in element.get('Sections') or []]),
+    }).explode('section').dropna(subset=['section'])
+    return sections.reset_index(drop=True)
+
+
+def normalise_tables(df, session_year):
+    """
+    Flattens the nested master-list fields of df (JSON lists or their CSV reprs).
+
+    Returns:
+        A dict of DataFrames keyed by TABLE_NAMES, each with a session_year column. They are
+        empty, with the same columns, when df is.
+    """
+    if df.empty:
+        tables = {
+            name: pd.DataFrame({column: np.array([], dtype=dtype) for column, dtype in columns.items()})
+            for name, columns in TABLE_COLUMNS.items()
+        }
+    else:
+        tables = {
+            'bill_sponsors': sponsors_table(df),
+            'bill_subjects': subjects_table(df),
+            'bill_statutes': statutes_table(df),
+        }
+    for table in tables.values():
+        table.insert(0, 'session_year', np.full(len(table), session_year, dtype=np.int16))
+    return tables
+
+
+def tables_dir(session_year):
+    return f'data/{session_year}rs/tables'
+
+
+def save_table(table, path):
+    """Saves a DataFrame column by column; text columns become fixed-width unicode arrays."""
+    columns = dict()
+    for name in table.columns:
+        values = table[name].to_numpy()
+        columns[name] = values.astype(str) if values.dtype == object else values
+    with atomic_open(path, 'wb') as f:
+        np.savez(f, **columns)
+
+
+def load_table(path):
+    with np.load(path) as arrays:
+        return pd.DataFrame({name: arrays[name] for name in arrays.files})
+
+
+def write_session_tables(df, session_year):
+    output_dir = tables_dir(session_year)
+    os.makedirs(output_dir, exist_ok=True)
+    tables = normalise_tables(df, session_year)
+    for name, table in tables.items():
+        save_table(table, os.path.join(output_dir, f'{name}.npz'))
+    return tables
+
+
+def load_session_table(session_year, name):
+    return load_table(os.path.join(tables_dir(session_year), f'{name}.npz'))
+
+
+def main(args):
+    for session_year in args.session_years:
+        data = pd.read_csv(f'data/{session_year}rs/csv/legislation.csv', dtype=str, keep_default_na=False)
+        tables = write_session_tables(data, session_year)
+        for name in TABLE_NAMES:
+            start = time.perf_counter()
+            load_session_table(session_year, name)
+            elapsed = time.perf_counter() - start
+            print(f'{session_year} {name}: {len(tables[name])} rows, loads in {elapsed * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write the normalised sponsor, subject and statute tables of sessions from legislation.csv.')
+    parser.add_argument('session_years', type=int, nargs='+', help='Regular session years')
+    args = parser.parse_args()
+    main(args)
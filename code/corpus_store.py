@@ -0,0 +1,300 @@
+# SQLite corpus store for every session's bills.
+# One database (data/corpus.sqlite) holds bill metadata from legislation.csv, documents
+# (bill text, adopted amendments and amended bills) with page-level markdown rows, plain text,
+# amendment linkage and QA results. Stages can load one session, or query across sessions,
+# without globbing and re-reading thousands of small files. Reads go through SQLite's
+# memory-mapped I/O.
+
+import os
+import re
+import json
+import sqlite3
+import argparse
+from glob import glob
+import pandas as pd
+from tqdm import tqdm
+from file_utils import sha256_file
+from leg_to_md import iter_markdown_file_pages
+
+
+DEFAULT_STORE_PATH = 'data/corpus.sqlite'
+MMAP_SIZE = 1 << 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bills (
+    session_year INTEGER NOT NULL,
+    bill_number TEXT NOT NULL,
+    chapter_number TEXT,
+    crossfile_bill_number TEXT,
+    title TEXT,
+    synopsis TEXT,
+    sponsor_primary TEXT,
+    status TEXT,
+    passed_by_mga INTEGER,
+    year_and_session TEXT,
+    metadata_json TEXT NOT NULL,
+    PRIMARY KEY (session_year, bill_number)
+);
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id INTEGER PRIMARY KEY,
+    session_year INTEGER NOT NULL,
+    doc_name TEXT NOT NULL,
+    bill_number TEXT NOT NULL,
+    kind TEXT NOT NULL CHECK (kind IN ('bill', 'amendment', 'amended')),
+    amendment_id TEXT,
+    md_sha256 TEXT,
+    txt_sha256 TEXT,
+    paged INTEGER NOT NULL DEFAULT 1,
+    page_count INTEGER,
+    text TEXT,
+    UNIQUE (session_year, doc_name)
+);
+CREATE INDEX IF NOT EXISTS documents_bill ON documents (session_year, bill_number, kind);
+CREATE TABLE IF NOT EXISTS pages (
+    doc_id INTEGER NOT NULL REFERENCES documents (doc_id) ON DELETE CASCADE,
+    page_number INTEGER NOT NULL,
+    markdown TEXT NOT NULL,
+    PRIMARY KEY (doc_id, page_number)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS qa (
+    session_year INTEGER NOT NULL,
+    bill_number TEXT NOT NULL,
+    answers_json TEXT,
+    PRIMARY KEY (session_year, bill_number)
+);
+"""
+
+BILL_COLUMNS = {
+    'ChapterNumber': 'chapter_number',
+    'CrossfileBillNumber': 'crossfile_bill_number',
+    'Title': 'title',
+    'Synopsis': 'synopsis',
+    'SponsorPrimary': 'sponsor_primary',
+    'Status': 'status',
+    'PassedByMGA': 'passed_by_mga',
+    'YearAndSession': 'year_and_session',
+}
+AMENDMENT_PATTERN = re.compile(r'^(?P<bill>[A-Z]+\d+)_amd(?P<amendment>.+)$')
+AMENDED_PATTERN = re.compile(r'^(?P<bill>[A-Z]+\d+)_amended$')
+
+
+def connect(path=DEFAULT_STORE_PATH, read_only=False):
+    """
+    Opens the store, creating it if needed. read_only connections never create or modify it.
+    """
+    if read_only:
+        conn = sqlite3.connect(f'file:{os.path.abspath(path)}?mode=ro', uri=True)
+    else:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = sqlite3.connect(path)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.executescript(SCHEMA)
+    conn.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+    conn.execute('PRAGMA foreign_keys = ON')
+    return conn
+
+
+def classify_document(doc_name):
+    """Returns (bill_number, kind, amendment_id) for a document file name without extension."""
+    amendment_match = AMENDMENT_PATTERN.match(doc_name)
+    if amendment_match:
+        return amendment_match.group('bill'), 'amendment', amendment_match.group('amendment')
+    amended_match = AMENDED_PATTERN.match(doc_name)
+    if amended_match:
+        return amended_match.group('bill'), 'amended', None
+    return doc_name, 'bill', None
+
+
+def join_pages(pages):
+    return "\n\n".join(f'START OF PAGE {page_number}\n{markdown}\nEND OF PAGE {page_number}' for page_number, markdown in pages)
+
+
+def ingest_bills(conn, session_year, csv_path):
+    data = pd.read_csv(csv_path, dtype=str, keep_default_na=False)
+    rows = []
+    for record in data.to_dict(orient='records'):
+        row = {column: record.get(csv_column) for csv_column, column in BILL_COLUMNS.items()}
+        row['passed_by_mga'] = int(row['passed_by_mga'] == 'True') if row['passed_by_mga'] is not None else None
+        rows.append((session_year, record['BillNumber'], *row.values(), json.dumps(record)))
+    placeholders = ', '.join(['?'] * (len(BILL_COLUMNS) + 3))
+    conn.executemany(
+        f"INSERT OR REPLACE INTO bills (session_year, bill_number, {', '.join(BILL_COLUMNS.values())}, metadata_json) "
+        f"VALUES ({placeholders})",
+        rows
+    )
+    return len(rows)
+
+
+def ingest_document(conn, session_year, md_path, txt_path=None, force=False):
+    """
+    Stores one markdown document (and its plain text, when a .txt exists) as page rows.
+    Documents whose markdown and text hashes are unchanged are skipped.
+
+    Returns:
+        True if the document was (re)written.
+    """
+    doc_name, _ = os.path.splitext(os.path.basename(md_path))
+    bill_number, kind, amendment_id = classify_document(doc_name)
+    md_sha256 = sha256_file(md_path)
+    txt_sha256 = sha256_file(txt_path) if txt_path and os.path.exists(txt_path) else None
+    existing = conn.execute(
+        'SELECT doc_id, md_sha256, txt_sha256 FROM documents WHERE session_year = ? AND doc_name = ?',
+        (session_year, doc_name)
+    ).fetchone()
+    if existing is not None and not force and existing[1] == md_sha256 and existing[2] == txt_sha256:
+        return False
+
+    pages = list(iter_markdown_file_pages(md_path))
+    with open(md_path, 'r', encoding='utf-8') as f:
+        markdown = f.read()
+    # LLM-written markdown (e.g. amended bills) may not follow the page-marker layout;
+    # keep those documents whole, as a single page 0, so they round-trip exactly
+    paged = bool(pages) and join_pages(pages) == markdown
+    if not paged:
+        pages = [(0, markdown)]
+    text = None
+    if txt_sha256 is not None:
+        with open(txt_path, 'r', encoding='utf-8', errors='ignore') as f:
+            text = f.read()
+
+    if existing is not None:
+        conn.execute('DELETE FROM documents WHERE doc_id = ?', (existing[0],))
+    cursor = conn.execute(
+        'INSERT INTO documents (session_year, doc_name, bill_number, kind, amendment_id, md_sha256, txt_sha256, paged, page_count, text) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        (session_year, doc_name, bill_number, kind, amendment_id, md_sha256, txt_sha256, int(paged), len(pages) if paged else None, text)
+    )
+    conn.executemany(
+        'INSERT INTO pages (doc_id, page_number, markdown) VALUES (?, ?, ?)',
+        [(cursor.lastrowid, page_number, page_markdown) for page_number, page_markdown in pages]
+    )
+    return True
+
+
+def ingest_qa(conn, session_year, csv_path):
+    data = pd.read_csv(csv_path)
+    answer_columns = [column for column in data.columns if column not in ('YearAndSession', 'BillNumber', 'Title', 'Synopsis')]
+    rows = []
+    for record in data.to_dict(orient='records'):
+        answers = {column: record[column] for column in answer_columns}
+        answers = {key: (None if pd.isna(value) else value) for key, value in answers.items()}
+        rows.append((session_year, record['BillNumber'], json.dumps(answers)))
+    conn.executemany('INSERT OR REPLACE INTO qa (session_year, bill_number, answers_json) VALUES (?, ?, ?)', rows)
+    return len(rows)
+
+
+def save_qa(conn, session_year, bill_number, answers):
+    conn.execute(
+        'INSERT OR REPLACE INTO qa (session_year, bill_number, answers_json) VALUES (?, ?, ?)',
+        (session_year, bill_number, json.dumps(answers) if answers is not None else None)
+    )
+    conn.commit()
+
+
+def ingest_session(conn, session_year, force=False):
+    """Loads one session's CSVs, markdown and plain text into the store."""
+    session_dir = f'data/{session_year}rs'
+    csv_path = os.path.join(session_dir, 'csv', 'legislation.csv')
+    if os.path.exists(csv_path):
+        print(f'{ingest_bills(conn, session_year, csv_path)} bills from {csv_path}')
+    md_files = sorted(glob(os.path.join(session_dir, 'md', '*.md')))
+    written = 0
+    for md_path in tqdm(md_files, desc=f'{session_year} documents'):
+        doc_name, _ = os.path.splitext(os.path.basename(md_path))
+        txt_path = os.path.join(session_dir, 'basic_txt', f'{doc_name}.txt')
+        written += ingest_document(conn, session_year, md_path, txt_path, force=force)
+    print(f'{written} of {len(md_files)} documents written ({len(md_files) - written} unchanged)')
+    qa_path = os.path.join(session_dir, 'csv', 'legislation_model_responses.csv')
+    if os.path.exists(qa_path):
+        print(f'{ingest_qa(conn, session_year, qa_path)} QA rows from {qa_path}')
+    conn.commit()
+
+
+def load_bills(conn, session_years=None):
+    """Returns bill metadata for the given sessions (all sessions by default) as a DataFrame."""
+    query = 'SELECT * FROM bills'
+    params = []
+    if session_years:
+        query += f" WHERE session_year IN ({', '.join(['?'] * len(session_years))})"
+        params = list(session_years)
+    return pd.read_sql_query(query + ' ORDER BY session_year, bill_number', conn, params=params)
+
+
+def load_qa(conn, session_years=None):
+    """Returns QA answers joined to bill metadata, one column per answer field."""
+    query = (
+        'SELECT b.session_year, b.year_and_session, b.bill_number, b.title, b.synopsis, q.answers_json '
+        'FROM bills b LEFT JOIN qa q USING (session_year, bill_number)'
+    )
+    params = []
+    if session_years:
+        query += f" WHERE b.session_year IN ({', '.join(['?'] * len(session_years))})"
+        params = list(session_years)
+    data = pd.read_sql_query(query + ' ORDER BY b.session_year, b.bill_number', conn, params=params)
+    answers = pd.DataFrame.from_records([json.loads(value) if value else {} for value in data.pop('answers_json')])
+    return pd.concat([data, answers], axis=1)
+
+
+def document_markdown(conn, session_year, doc_name):
+    """Reassembles a document's markdown exactly as leg_to_md wrote it, or None if absent."""
+    row = conn.execute(
+        'SELECT doc_id, paged FROM documents WHERE session_year = ? AND doc_name = ?', (session_year, doc_name)
+    ).fetchone()
+    if row is None:
+        return None
+    pages = conn.execute('SELECT page_number, markdown FROM pages WHERE doc_id = ? ORDER BY page_number', (row[0],)).fetchall()
+    return join_pages(pages) if row[1] else pages[0][1]
+
+
+def bill_markdown(conn, session_year, bill_number):
+    """Prefers the amended bill markdown when one exists, like leg_qa.bill_markdown_path."""
+    amended_markdown = document_markdown(conn, session_year, f'{bill_number}_amended')
+    if amended_markdown is not None:
+        return amended_markdown
+    return document_markdown(conn, session_year, bill_number)
+
+
+def document_names(conn, session_year, kind, bill_number=None):
+    """Names of a session's documents of one kind ('bill', 'amendment' or 'amended'), optionally for one bill."""
+    query = 'SELECT doc_name FROM documents WHERE session_year = ? AND kind = ?'
+    params = [session_year, kind]
+    if bill_number is not None:
+        query += ' AND bill_number = ?'
+        params.append(bill_number)
+    return [row[0] for row in conn.execute(query + ' ORDER BY doc_name', params)]
+
+
+def iter_document_texts(conn, session_years=None, kinds=('bill', 'amendment')):
+    """Yields (session_year, doc_name, text) for documents with plain text."""
+    query = f"SELECT session_year, doc_name, text FROM documents WHERE text IS NOT NULL AND kind IN ({', '.join(['?'] * len(kinds))})"
+    params = list(kinds)
+    if session_years:
+        query += f" AND session_year IN ({', '.join(['?'] * len(session_years))})"
+        params += list(session_years)
+    yield from conn.execute(query + ' ORDER BY session_year, doc_name', params)
+
+
+def main(args):
+    if args.command == 'ingest':
+        conn = connect(args.store)
+        for session_year in args.session_years:
+            ingest_session(conn, session_year, force=args.force)
+        conn.close()
+    elif args.command == 'query':
+        conn = connect(args.store, read_only=True)
+        with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', None):
+            print(pd.read_sql_query(args.sql, conn))
+        conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build and query the SQLite corpus store.')
+    parser.add_argument('--store', default=DEFAULT_STORE_PATH, help='Path of the SQLite store')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    ingest_parser = subparsers.add_parser('ingest', help='Load sessions into the store')
+    ingest_parser.add_argument('session_years', type=int, nargs='+', help='The regular session years')
+    ingest_parser.add_argument('--force', action='store_true', help='Rewrite documents even if unchanged')
+    query_parser = subparsers.add_parser('query', help='Run a read-only SQL query against the store')
+    query_parser.add_argument('sql', help='The SQL query')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,189 @@
+# Token and cost estimates for the LLM stages, per bill and per model family.
+# QA requests are counted as leg_qa.py sends them: SYSTEM_PROMPT plus the bill, or for bills
+# over the family's DEFAULT_MAX_BILL_TOKENS one CHUNK_SYSTEM_PROMPT request per chunk and a
+# REDUCE_SYSTEM_PROMPT request combining the answers. Amendment requests are counted only for
+# amendments with instructions amendment_engine cannot apply, as PROMPT_TEMPLATE around the
+# bill and the residual instructions, with the whole bill expected back. Every family is
+# measured with the count_tokens.py tokenizer, so counts for non-OpenAI models are approximate.
+
+import os
+import csv
+import argparse
+import pandas as pd
+from tqdm import tqdm
+import corpus_store
+from count_tokens import MODEL as TOKENIZER_MODEL, TokenCountCache, TOKEN_COUNT_CACHE_PATH
+from bill_chunking import chunk_bill, STRUCK_MODES
+from amendment_engine import AddressedBill, apply_amendment
+from amend_leg_md import AMENDMENT_MODEL, PROMPT_TEMPLATE, load_unamended_bills
+from leg_qa import (
+    SYSTEM_PROMPT, CHUNK_SYSTEM_PROMPT, REDUCE_SYSTEM_PROMPT, DEFAULT_MAX_BILL_TOKENS,
+    default_model_name, bill_markdown_path, load_tokenizer,
+)
+
+
+# USD per million (input, output) tokens; models not listed (e.g. local Ollama models) are free
+PRICES = {
+    'gemini-2.5-flash': (0.30, 2.50),
+    'gemini-2.5-pro': (1.25, 10.00),
+    'gpt-4.1-nano': (0.10, 0.40),
+}
+# Typical size of one AnswersToQuestions JSON answer
+QA_OUTPUT_TOKENS = 600
+MODEL_FAMILIES = ['gemini', 'gpt', 'ollama']
+ESTIMATE_FIELDS = ['requests', 'input_tokens', 'output_tokens', 'cost']
+
+
+def request_cost(model_name, input_tokens, output_tokens):
+    input_price, output_price = PRICES.get(model_name, (0.0, 0.0))
+    return (input_tokens * input_price + output_tokens * output_price) / 1000000
+
+
+def estimate(model_name, requests, input_tokens, output_tokens):
+    return {
+        'requests': requests,
+        'input_tokens': input_tokens,
+        'output_tokens': output_tokens,
+        'cost': request_cost(model_name, input_tokens, output_tokens),
+    }
+
+
+class CostEstimator:
+    """
+    Estimates the requests, tokens and cost of answering or amending a bill. Token counts of
+    whole documents go through a TokenCountCache, so re-estimating unchanged bills is cheap.
+    """
+
+    def __init__(self, tokenizer=None, cache_path=TOKEN_COUNT_CACHE_PATH):
+        self.tokenizer = tokenizer or load_tokenizer()
+        self.cache = TokenCountCache(cache_path)
+        self.prompt_tokens = {
+            prompt: len(self.tokenizer.encode_ordinary(prompt))
+            for prompt in (SYSTEM_PROMPT, CHUNK_SYSTEM_PROMPT, REDUCE_SYSTEM_PROMPT, PROMPT_TEMPLATE.format('', ''))
+        }
+
+    def tokens(self, text):
+        key = TokenCountCache.key(self.tokenizer, text)
+        count = self.cache.get(key)
+        if count is None:
+            count = len(self.tokenizer.encode_ordinary(text))
+            self.cache.put(key, count)
+        return count
+
+    def qa_estimate(self, bill_md, model_family, model_name=None, max_bill_tokens=None, struck='drop'):
+        """Estimates leg_qa.answer_bill for one bill, chunking it the same way."""
+        model_name = model_name or default_model_name(model_family)
+        if max_bill_tokens is None:
+            max_bill_tokens = DEFAULT_MAX_BILL_TOKENS[model_family]
+        bill_tokens = self.tokens(bill_md)
+        if not max_bill_tokens or bill_tokens <= max_bill_tokens:
+            return estimate(model_name, 1, self.prompt_tokens[SYSTEM_PROMPT] + bill_tokens, QA_OUTPUT_TOKENS)
+        chunks = chunk_bill(bill_md, self.tokenizer, max_bill_tokens, struck)
+        # Each chunk is prefixed with "PART i OF n", about six tokens
+        input_tokens = sum(self.prompt_tokens[CHUNK_SYSTEM_PROMPT] + self.tokens(chunk) + 6 for chunk in chunks)
+        requests = len(chunks)
+        if len(chunks) > 1:
+            input_tokens += self.prompt_tokens[REDUCE_SYSTEM_PROMPT] + len(chunks) * QA_OUTPUT_TOKENS
+            requests += 1
+        return estimate(model_name, requests, input_tokens, requests * QA_OUTPUT_TOKENS)
+
+    def amendment_estimate(self, bill_md, amendment_mds):
+        """
+        Estimates amend_leg_md.apply_amendments for one bill, assuming each LLM fallback
+        returns a bill as long as the one it was sent.
+        """
+        bill = AddressedBill(bill_md)
+        requests = input_tokens = output_tokens = 0
+        for amendment_md in amendment_mds:
+            residual_md = apply_amendment(bill, amendment_md)
+            if not residual_md:
+                continue
+            bill_tokens = self.tokens(bill.markdown())
+            requests += 1
+            input_tokens += self.prompt_tokens[PROMPT_TEMPLATE.format('', '')] + bill_tokens + self.tokens(residual_md)
+            output_tokens += bill_tokens
+        return estimate(AMENDMENT_MODEL, requests, input_tokens, output_tokens)
+
+    def save(self):
+        self.cache.save()
+
+
+def load_qa_bills(conn, session_year, md_dir):
+    """Yields (bill_number, bill_md) for every bill in the session, preferring amended markdown."""
+    if conn is not None:
+        bill_numbers = corpus_store.load_bills(conn, [session_year])['bill_number'].tolist()
+    else:
+        bill_numbers = pd.read_csv(f'data/{session_year}rs/csv/legislation.csv')['BillNumber'].tolist()
+    for bill_number in bill_numbers:
+        if conn is not None:
+            bill_md = corpus_store.bill_markdown(conn, session_year, bill_number)
+        else:
+            bill_filepath = bill_markdown_path(md_dir, bill_number)
+            if not os.path.exists(bill_filepath):
+                continue
+            with open(bill_filepath, 'r', encoding='utf-8') as f:
+                bill_md = f.read()
+        if bill_md is not None:
+            yield bill_number, bill_md
+
+
+def main(args):
+    md_dir = os.path.abspath(f'data/{args.session_year}rs/md')
+    conn = corpus_store.connect(read_only=True) if args.from_store else None
+    estimator = CostEstimator(cache_path=args.cache_path)
+    rows = dict()
+
+    for bill_number, (bill_md, amendment_mds) in tqdm(load_unamended_bills(conn, args.session_year, md_dir).items(), desc='amended'):
+        amended = estimator.amendment_estimate(bill_md, amendment_mds)
+        rows.setdefault(bill_number, {'bill_number': bill_number}).update({f'amended_{field}': amended[field] for field in ESTIMATE_FIELDS})
+    for bill_number, bill_md in tqdm(load_qa_bills(conn, args.session_year, md_dir), desc='qa'):
+        row = rows.setdefault(bill_number, {'bill_number': bill_number})
+        row['bill_tokens'] = estimator.tokens(bill_md)
+        for model_family in args.model_families:
+            qa = estimator.qa_estimate(bill_md, model_family, struck=args.struck)
+            row.update({f'qa_{model_family}_{field}': qa[field] for field in ESTIMATE_FIELDS})
+    estimator.save()
+    if conn is not None:
+        conn.close()
+
+    print(f"Token counts use the {TOKENIZER_MODEL} tokenizer for every model family.")
+    stages = [('amended', f'amended ({AMENDMENT_MODEL})')] + [
+        (f'qa_{model_family}', f'qa ({default_model_name(model_family)})') for model_family in args.model_families
+    ]
+    for prefix, label in stages:
+        totals = {field: sum(row.get(f'{prefix}_{field}', 0) for row in rows.values()) for field in ESTIMATE_FIELDS}
+        print(
+            f"{label}: {totals['requests']} requests, {totals['input_tokens']} input and "
+            f"{totals['output_tokens']} output tokens, ${totals['cost']:.2f}"
+        )
+
+    rank_family = args.model_families[0]
+
+    def bill_cost(row):
+        return row.get('amended_cost', 0) + row.get(f'qa_{rank_family}_cost', 0)
+
+    ranked = sorted(rows.values(), key=bill_cost, reverse=True)
+    print(f"Most expensive bills (amendments and {rank_family} QA):")
+    for row in ranked[:args.top]:
+        print(f"  {row['bill_number']}: {row.get('bill_tokens', 0)} tokens, ${bill_cost(row):.4f}")
+
+    if args.output:
+        fieldnames = ['bill_number', 'bill_tokens'] + [f'{prefix}_{field}' for prefix, _ in stages for field in ESTIMATE_FIELDS]
+        with open(args.output, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames, restval=0)
+            writer.writeheader()
+            writer.writerows(ranked)
+        print(f"Saved per-bill estimates to {args.output}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Estimate LLM tokens and cost per bill for amendments and QA.')
+    parser.add_argument('session_year', type=int, help='The regular session year')
+    parser.add_argument('--model-families', nargs='+', choices=MODEL_FAMILIES, default=MODEL_FAMILIES, help='QA model families to estimate; the first ranks the bills')
+    parser.add_argument('--struck', default='drop', choices=STRUCK_MODES, help='How struck text is chunked for oversized bills, as in leg_qa.py')
+    parser.add_argument('--from-store', action='store_true', help='Read bills from the corpus store instead of md files')
+    parser.add_argument('--top', type=int, default=10, help='Number of most expensive bills to list')
+    parser.add_argument('--output', default=None, help='Write per-bill estimates to this CSV file')
+    parser.add_argument('--cache-path', default=TOKEN_COUNT_CACHE_PATH, help='JSON file of cached per-document token counts')
+    args = parser.parse_args()
+    main(args)
@@ -1,31 +1,123 @@
 import sys
 import os
+import json
 import argparse
+import threading
 import tiktoken
 from glob import glob
 from tqdm import tqdm
+import corpus_store
+from file_utils import sha256_bytes, atomic_write_text
 
 
 MODEL = "o3"
+TOKEN_COUNT_CACHE_PATH = 'data/token_counts.json'
+# Characters of uncached text tokenized per parallel batch, bounding memory use
+BATCH_CHARS = 4000000
+DEFAULT_TOKENIZER_THREADS = os.cpu_count() or 1
 
 
 def count_tokens(tokenizer, text):
     return len(tokenizer.encode(text))
 
 
-def main(session_year):
-    tokenizer = tiktoken.encoding_for_model(MODEL)
-    input_dir = os.path.abspath(f'data/{session_year}rs/basic_txt')
-    txt_wildcard = os.path.join(input_dir, '*.txt')
-    txt_files = glob(txt_wildcard)
+class TokenCountCache:
+    """
+    Token counts keyed by tokenizer name and the SHA-256 of the text, saved as one JSON file,
+    so unchanged documents are never tokenized twice.
+    """
+
+    def __init__(self, path=TOKEN_COUNT_CACHE_PATH):
+        self.path = path
+        self.counts = dict()
+        self.lock = threading.Lock()
+        self.unsaved = 0
+        if path is not None and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.counts = json.load(f)
+
+    @staticmethod
+    def key(tokenizer, text):
+        return f"{tokenizer.name}:{sha256_bytes(text.encode('utf-8'))}"
+
+    def get(self, key):
+        return self.counts.get(key)
+
+    def put(self, key, count):
+        with self.lock:
+            self.counts[key] = count
+            self.unsaved += 1
+
+    def save(self):
+        if self.path is None or not self.unsaved:
+            return
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            atomic_write_text(self.path, json.dumps(self.counts, sort_keys=True))
+            self.unsaved = 0
+
+
+def count_documents(documents, tokenizer, cache=None, threads=DEFAULT_TOKENIZER_THREADS, batch_chars=BATCH_CHARS):
+    """
+    Counts the tokens of (name, text) documents, read lazily from any iterable. Cached counts
+    are reused; the rest are tokenized in batches of about batch_chars characters, each
+    batch across `threads` tokenizer threads.
 
-    full_text_list = list()
-    for txt_file_path in tqdm(txt_files):
-        with open(txt_file_path, 'r', encoding='utf-8', errors='ignore') as txt_file:
-            full_text_list.append(txt_file.read())
+    Returns:
+        A dict mapping each document name to its token count.
+    """
+    counts = dict()
+    batch = []
+    batch_size = 0
+
+    def flush():
+        token_lists = tokenizer.encode_ordinary_batch([text for _, _, text in batch], num_threads=threads)
+        for (name, key, _), tokens in zip(batch, token_lists):
+            counts[name] = len(tokens)
+            if cache is not None:
+                cache.put(key, len(tokens))
+        batch.clear()
+
+    for name, text in documents:
+        key = TokenCountCache.key(tokenizer, text) if cache is not None else None
+        cached_count = cache.get(key) if cache is not None else None
+        if cached_count is not None:
+            counts[name] = cached_count
+            continue
+        batch.append((name, key, text))
+        batch_size += len(text)
+        if batch_size >= batch_chars:
+            flush()
+            batch_size = 0
+    if batch:
+        flush()
+    if cache is not None:
+        cache.save()
+    return counts
+
+
+def iter_text_files(paths):
+    """Yields (path, text) for each file, reading one file at a time."""
+    for path in paths:
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            yield path, f.read()
+
+
+def main(session_year, from_store=False, threads=DEFAULT_TOKENIZER_THREADS, cache_path=TOKEN_COUNT_CACHE_PATH):
+    tokenizer = tiktoken.encoding_for_model(MODEL)
+    cache = TokenCountCache(cache_path)
+    if from_store:
+        conn = corpus_store.connect(read_only=True)
+        documents = ((doc_name, text) for _, doc_name, text in corpus_store.iter_document_texts(conn, [session_year]))
+        counts = count_documents(documents, tokenizer, cache, threads)
+        conn.close()
+    else:
+        input_dir = os.path.abspath(f'data/{session_year}rs/basic_txt')
+        txt_wildcard = os.path.join(input_dir, '*.txt')
+        txt_files = sorted(glob(txt_wildcard))
+        counts = count_documents(iter_text_files(tqdm(txt_files)), tokenizer, cache, threads)
 
-    full_text = "\n".join(full_text_list)
-    token_count = count_tokens(tokenizer, full_text)
+    token_count = sum(counts.values())
     token_cost = 0.15
     token_cost_per = 1000000
     print(
@@ -33,10 +125,14 @@ def main(session_year):
             token_count, round((token_count / token_cost_per) * token_cost, 2), MODEL
         )
     )
+    print("Per-bill and per-stage estimates: python code/cost_estimator.py {}".format(session_year))
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Parse Maryland legislation into basic text for token count.')
     parser.add_argument('session_year', type=int, help='The regular session year')
+    parser.add_argument('--from-store', action='store_true', help='Read plain text from the corpus store instead of basic_txt files')
+    parser.add_argument('--threads', type=int, default=DEFAULT_TOKENIZER_THREADS, help='Tokenizer threads per batch')
+    parser.add_argument('--cache-path', default=TOKEN_COUNT_CACHE_PATH, help='JSON file of cached per-document token counts')
     args = parser.parse_args()
-    main(args.session_year)
\ No newline at end of file
+    main(args.session_year, from_store=args.from_store, threads=args.threads, cache_path=args.cache_path)
@@ -0,0 +1,132 @@
+# HTTP crawl helpers for download_legislation: pooled session, per-host rate limiting,
+# retry/backoff and a persistent journal so interrupted crawls can resume.
+
+import os
+import json
+import time
+import threading
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
+}
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class HostRateLimiter:
+    """
+    Thread-safe limiter that spaces requests to the same host at least
+    1 / requests_per_second seconds apart. A rate of 0 or None disables limiting.
+    """
+
+    def __init__(self, requests_per_second=None):
+        self.min_interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self.next_allowed = dict()
+        self.lock = threading.Lock()
+
+    def wait(self, url):
+        if not self.min_interval:
+            return
+        host = urlparse(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_allowed.get(host, now))
+            self.next_allowed[host] = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class CrawlJournal:
+    """
+    Append-only JSONL journal of finished crawl units. Each line is a JSON object with
+    at least a 'key' and a 'status' ('done' or 'failed'). Only 'done' entries are skipped
+    when a crawl is resumed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = dict()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as journal_file:
+                for line in journal_file:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn final line from an interrupted write; everything before it is intact
+                        continue
+                    self.entries[entry['key']] = entry
+
+    def is_done(self, key):
+        entry = self.entries.get(key)
+        return entry is not None and entry.get('status') == 'done'
+
+    def record(self, key, status, **data):
+        entry = dict(key=key, status=status, **data)
+        with self.lock:
+            self.entries[key] = entry
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as journal_file:
+                journal_file.write(json.dumps(entry) + '\n')
+                journal_file.flush()
+
+    def clear(self):
+        with self.lock:
+            self.entries = dict()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+def make_session(pool_size=8, headers=None):
+    """
+    Creates a requests.Session whose connection pool is large enough for pool_size
+    concurrent workers, so connections are reused instead of re-opened per request.
+    """
+    session = requests.Session()
+    session.headers.update(headers or DEFAULT_HEADERS)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def retry_delay(response, attempt, backoff_factor):
+    """
+    Seconds to wait before the next attempt: the server's Retry-After header when it
+    sends one, otherwise exponential backoff.
+    """
+    if response is not None:
+        retry_after = response.headers.get('Retry-After')
+        if retry_after is not None:
+            try:
+                return max(0.0, float(retry_after))
+            except ValueError:
+                pass
+    return backoff_factor * (2 ** attempt)
+
+
+def fetch(session, url, limiter=None, max_retries=5, backoff_factor=0.5, timeout=60, **kwargs):
+    """
+    GET a URL with per-host rate limiting, retrying connection errors and 429/5xx
+    responses with backoff. Returns the final response (raise_for_status is left to the caller).
+    """
+    for attempt in range(max_retries):
+        if limiter is not None:
+            limiter.wait(url)
+        try:
+            response = session.get(url, timeout=timeout, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if attempt < max_retries - 1:
+                time.sleep(retry_delay(None, attempt, backoff_factor))
+                continue
+            raise e
+        if response.status_code in RETRY_STATUS_CODES and attempt < max_retries - 1:
+            time.sleep(retry_delay(response, attempt, backoff_factor))
+            continue
+        return response
@@ -1,23 +1,170 @@
 import os
 import json
 import re
+import time
 import argparse
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
 from bs4 import BeautifulSoup
 import tqdm
 import pandas as pd
+from crawler import make_session, HostRateLimiter, CrawlJournal
+from http_cache import HttpCache
+from bill_tables import resolve_crossfiles, write_session_tables
+import statute_index
+from metrics import METRICS
 
 # Enable tqdm for pandas
 tqdm.tqdm.pandas()
 
-def main(session_year):
-    json_url = f'https://mgaleg.maryland.gov/{session_year}rs/misc/billsmasterlist/legislation.json'
+BASE_URL = 'https://mgaleg.maryland.gov'
 
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
+
+def parse_bill_detail(content, session_year):
+    """
+    Finds the latest bill text link on a bill detail page, along with the amendments
+    adopted (and not subsequently withdrawn) after it.
+
+    Returns:
+        A (last_bill_link, subsequent_amd_links) tuple. last_bill_link is None when the
+        page has no bill text table.
+    """
+    soup = BeautifulSoup(content, 'html.parser')
+
+    all_tables = soup.find_all('table')
+
+    last_bill_link = None
+    subsequent_amd_links = dict()
+    if len(all_tables) > 1:
+        target_table = all_tables[1]
+        anchors = target_table.find_all('a', href=True)
+
+        bill_prefix = f'/{session_year}RS/bills/'
+        chapter_prefix = f'/{session_year}RS/Chapters'
+        amd_prefix = f'/{session_year}RS/amds/'
+
+        for anchor in anchors:
+            href = anchor['href']
+            if href.startswith(bill_prefix) or href.startswith(chapter_prefix):
+                last_bill_link = href
+                subsequent_amd_links = dict() # Reset amd links when a new bill link is found
+            elif href.startswith(amd_prefix):
+                # Only collect amd links if they appear after a bill link and were adopted and not subsequently withdrawn
+                if last_bill_link is not None:
+                    amendment_id = anchor.text.replace("/","_")
+                    if 'Adopted' in anchor.parent.text:
+                        subsequent_amd_links[amendment_id] = href
+                    elif 'Withdrawn' in anchor.parent.text:
+                        try:
+                            del subsequent_amd_links[amendment_id]
+                        except KeyError:
+                            pass
+        return last_bill_link, subsequent_amd_links
+    return None, subsequent_amd_links
+
+
+def download_pdf(session, limiter, cache, pdf_url, pdf_path):
+    """
+    Conditionally downloads a PDF through the HTTP cache. Returns the SHA-256 of the
+    file on disk, or None if it could not be fetched.
+    """
+    try:
+        return cache.get(session, pdf_url, dest_path=pdf_path, limiter=limiter).sha256
+    except requests.exceptions.RequestException as e:
+        print(f"Error downloading {pdf_url}: {e}")
+    except IOError as e:
+        print(f"Error saving file {pdf_path}: {e}")
+    return None
+
+
+def crawl_bill(session, limiter, cache, session_year, bill_number, pdf_output_dir, base_url=BASE_URL):
+    """
+    Fetches one bill's detail page and downloads its latest text PDF plus adopted amendment PDFs.
+
+    Returns:
+        A dict mapping each of the bill's PDF file names to its SHA-256 (None for PDFs that
+        could not be downloaded).
+    """
+    start = time.perf_counter()
+    bill_url = f'{base_url}/mgawebsite/Legislation/Details/{bill_number}?ys={session_year}rs'
+    bill_response = cache.get(session, bill_url, limiter=limiter)
+    fetched = time.perf_counter()
+    last_bill_link, subsequent_amd_links = parse_bill_detail(bill_response.content, session_year)
+    parsed = time.perf_counter()
+
+    if last_bill_link is None:
+        print(f"Warning: Could not find the second table for bill {bill_number} at {bill_url}")
+        return dict()
+
+    # Download the main bill PDF
+    bill_pdf_name = f'{bill_number}.pdf'
+    pdf_hashes = dict()
+    pdf_hashes[bill_pdf_name] = download_pdf(session, limiter, cache, f'{base_url}{last_bill_link}', os.path.join(pdf_output_dir, bill_pdf_name))
+
+    # Download subsequent amendment PDFs
+    for amd_id, amd_link in subsequent_amd_links.items():
+        amd_pdf_name = f'{bill_number}_amd{amd_id}.pdf'
+        pdf_hashes[amd_pdf_name] = download_pdf(session, limiter, cache, f'{base_url}{amd_link}', os.path.join(pdf_output_dir, amd_pdf_name))
+    METRICS.record_document('download', bill_number, {
+        'fetch': fetched - start + time.perf_counter() - parsed,
+        'parse': parsed - fetched,
+    })
+    return pdf_hashes
+
+
+def write_sync_manifest(session_year, bill_files):
+    """
+    Compares this sync's {bill_number: {pdf_name: sha256}} mapping with the previous one
+    and writes both the new manifest and the list of changed bills for later stages.
+
+    Returns:
+        The sorted list of bill numbers that are new or whose PDFs changed.
+    """
+    session_dir = f'data/{session_year}rs'
+    manifest_path = os.path.join(session_dir, 'sync_manifest.json')
+    previous_bill_files = dict()
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            previous_bill_files = json.load(f)
+    changed_bill_numbers = sorted(
+        bill_number for bill_number, files in bill_files.items()
+        if previous_bill_files.get(bill_number) != files
+    )
+    removed_bill_numbers = sorted(set(previous_bill_files) - set(bill_files))
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(bill_files, f, indent=2, sort_keys=True)
+    changes = {
+        'session_year': session_year,
+        'synced_at': datetime.now(timezone.utc).isoformat(),
+        'changed': changed_bill_numbers,
+        'removed': removed_bill_numbers,
     }
-    response = requests.get(json_url, headers=headers)
-    response.raise_for_status()
+    with open(os.path.join(session_dir, 'changed_bills.json'), 'w', encoding='utf-8') as f:
+        json.dump(changes, f, indent=2)
+    return changed_bill_numbers
+
+
+def write_amendment_order(session_year, bill_files):
+    """
+    Writes {bill_number: [amendment document name]} with each bill's amendments in the order
+    they appear on its detail page, which is the order they were adopted in.
+    """
+    amendment_order = {
+        bill_number: [os.path.splitext(pdf_name)[0] for pdf_name in files if '_amd' in pdf_name]
+        for bill_number, files in bill_files.items()
+    }
+    with open(os.path.join(f'data/{session_year}rs', 'amendment_order.json'), 'w', encoding='utf-8') as f:
+        json.dump({bill_number: names for bill_number, names in amendment_order.items() if names}, f, indent=2)
+
+
+def main(session_year, workers=8, requests_per_second=4.0, fresh=False, base_url=BASE_URL, metrics_path=None):
+    json_url = f'{base_url}/{session_year}rs/misc/billsmasterlist/legislation.json'
+
+    session = make_session(pool_size=workers)
+    limiter = HostRateLimiter(requests_per_second)
+    cache = HttpCache(f'data/{session_year}rs/http_cache')
+    response = cache.get(session, json_url, limiter=limiter)
     leg_data = response.json()
 
     if session_year == 2026:
@@ -27,88 +174,45 @@ def main(session_year):
 
     df = pd.DataFrame.from_records(filtered_leg_data)
 
-    seen_crossfiled_bill_numbers = list()
-    df_rows_to_remove = list()
-
     print(f'Processing {df.shape[0]} rows for {session_year}...')
-    for index, row in tqdm.tqdm(df.iterrows(), total=df.shape[0], desc=f'Processing {session_year} bills'):
-        bill_number = row['BillNumber']
-        if bill_number in seen_crossfiled_bill_numbers:
-            df_rows_to_remove.append(index)
-            continue
-        crossfiled_bill_number = row['CrossfileBillNumber']
-        seen_crossfiled_bill_numbers.append(crossfiled_bill_number)
-        bill_url = f'https://mgaleg.maryland.gov/mgawebsite/Legislation/Details/{bill_number}?ys={session_year}rs'
-        bill_response = requests.get(bill_url, headers=headers)
-        bill_response.raise_for_status()
-        soup = BeautifulSoup(bill_response.content, 'html.parser')
-
-        all_tables = soup.find_all('table')
-
-        last_bill_link = None
-        subsequent_amd_links = dict()
-        if len(all_tables) > 1:
-            target_table = all_tables[1]
-            anchors = target_table.find_all('a', href=True)
-
-            bill_prefix = f'/{session_year}RS/bills/'
-            chapter_prefix = f'/{session_year}RS/Chapters'
-            amd_prefix = f'/{session_year}RS/amds/'
-
-            for anchor in anchors:
-                href = anchor['href']
-                if href.startswith(bill_prefix) or href.startswith(chapter_prefix):
-                    last_bill_link = href
-                    subsequent_amd_links = dict() # Reset amd links when a new bill link is found
-                elif href.startswith(amd_prefix):
-                    # Only collect amd links if they appear after a bill link and were adopted and not subsequently withdrawn
-                    if last_bill_link is not None:
-                        amendment_id = anchor.text.replace("/","_")
-                        if 'Adopted' in anchor.parent.text:
-                            subsequent_amd_links[amendment_id] = href
-                        elif 'Withdrawn' in anchor.parent.text:
-                            try:
-                                del subsequent_amd_links[amendment_id]
-                            except KeyError:
-                                pass
-        else:
-            print(f"Warning: Could not find the second table for bill {bill_number} at {bill_url}")
-        if last_bill_link:
-            print(f"Found {len(subsequent_amd_links.keys()) + 1} PDFs to download for {bill_number}.")
-            pdf_output_dir = f'data/{session_year}rs/pdf'
-            os.makedirs(pdf_output_dir, exist_ok=True)
-
-            # Download the main bill PDF
-            bill_pdf_url = f'https://mgaleg.maryland.gov{last_bill_link}'
-            bill_pdf_path = os.path.join(pdf_output_dir, f'{bill_number}.pdf')
-            if not os.path.exists(bill_pdf_path):
-                try:
-                    pdf_response = requests.get(bill_pdf_url, headers=headers)
-                    pdf_response.raise_for_status()
-                    with open(bill_pdf_path, 'wb') as f:
-                        f.write(pdf_response.content)
-                except requests.exceptions.RequestException as e:
-                    print(f"Error downloading {bill_pdf_url}: {e}")
-                except IOError as e:
-                    print(f"Error saving file {bill_pdf_path}: {e}")
-
-            # Download subsequent amendment PDFs
-            for amd_id, amd_link in subsequent_amd_links.items():
-                amd_pdf_url = f'https://mgaleg.maryland.gov{amd_link}'
-                amd_pdf_path = os.path.join(pdf_output_dir, f'{bill_number}_amd{amd_id}.pdf')
-                if not os.path.exists(amd_pdf_path):
-                    try:
-                        pdf_response = requests.get(amd_pdf_url, headers=headers)
-                        pdf_response.raise_for_status()
-                        with open(amd_pdf_path, 'wb') as f:
-                            f.write(pdf_response.content)
-                        # print(f"Successfully downloaded {amd_pdf_url} to {amd_pdf_path}")
-                    except requests.exceptions.RequestException as e:
-                        print(f"Error downloading {amd_pdf_url}: {e}")
-                    except IOError as e:
-                        print(f"Error saving file {amd_pdf_path}: {e}")
-    print(f"Removing {len(df_rows_to_remove)} crossfiled bills.")
-    df.drop(df_rows_to_remove, inplace=True)
+    row_count = df.shape[0]
+    df = resolve_crossfiles(df)
+    crossfiled_row_count = row_count - df.shape[0]
+    bill_numbers = df['BillNumber'].tolist() if not df.empty else []
+
+    pdf_output_dir = f'data/{session_year}rs/pdf'
+    os.makedirs(pdf_output_dir, exist_ok=True)
+    journal = CrawlJournal(f'data/{session_year}rs/crawl_journal.jsonl')
+    if fresh:
+        journal.clear()
+    pending_bill_numbers = [bill_number for bill_number in bill_numbers if not journal.is_done(bill_number)]
+    if len(pending_bill_numbers) < len(bill_numbers):
+        print(f'Resuming crawl: {len(bill_numbers) - len(pending_bill_numbers)} bills already done.')
+
+    failed_bill_numbers = list()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(crawl_bill, session, limiter, cache, session_year, bill_number, pdf_output_dir, base_url): bill_number
+            for bill_number in pending_bill_numbers
+        }
+        for future in tqdm.tqdm(as_completed(futures), total=len(futures), desc=f'Processing {session_year} bills'):
+            bill_number = futures[future]
+            try:
+                pdf_hashes = future.result()
+            except requests.exceptions.RequestException as e:
+                print(f"Error crawling {bill_number}: {e}")
+                journal.record(bill_number, 'failed', error=str(e))
+                failed_bill_numbers.append(bill_number)
+                continue
+            missing_pdf_names = sorted(pdf_name for pdf_name, sha256 in pdf_hashes.items() if sha256 is None)
+            if missing_pdf_names:
+                # Journaled as failed so that a resumed crawl downloads the missing PDFs again
+                journal.record(bill_number, 'failed', error=f"Missing {', '.join(missing_pdf_names)}", files=pdf_hashes)
+                failed_bill_numbers.append(bill_number)
+                continue
+            journal.record(bill_number, 'done', files=pdf_hashes)
+
+    print(f"Removed {crossfiled_row_count} crossfiled bills.")
     print(f'Finished processing {session_year}.')
 
     csv_output_dir = f'data/{session_year}rs/csv'
@@ -116,10 +220,37 @@ def main(session_year):
     csv_output_file = os.path.join(csv_output_dir, 'legislation.csv')
     df.to_csv(csv_output_file, index=False)
     print(f'Saved DataFrame to {csv_output_file}')
+    tables = write_session_tables(df, session_year)
+    print(f"Saved {', '.join(f'{len(table)} {name} rows' for name, table in tables.items())}.")
+    index = statute_index.update_session(session_year, tables['bill_statutes'])
+    print(f'Statute index: {len(index)} bill sections across sessions {", ".join(str(year) for year in sorted(set(index.session_year.tolist())))}.')
+
+    print(
+        f"HTTP cache: {cache.stats['requests']} requests, {cache.stats['not_modified']} not modified, "
+        f"{cache.stats['bytes_downloaded']} bytes downloaded."
+    )
+    if failed_bill_numbers:
+        print(f'{len(failed_bill_numbers)} bills failed; re-run to resume from the crawl journal.')
+    else:
+        bill_files = {
+            bill_number: journal.entries[bill_number].get('files', dict())
+            for bill_number in bill_numbers
+        }
+        changed_bill_numbers = write_sync_manifest(session_year, bill_files)
+        write_amendment_order(session_year, bill_files)
+        print(f'{len(changed_bill_numbers)} bills changed since the last sync.')
+        journal.clear()
+    if metrics_path is not None:
+        METRICS.write(metrics_path)
+        print(f'Saved metrics to {metrics_path}')
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Download Maryland legislation.')
     parser.add_argument('session_year', type=int, help='The regular session year')
+    parser.add_argument('--workers', type=int, default=8, help='Number of concurrent download workers')
+    parser.add_argument('--rate', type=float, default=4.0, help='Maximum requests per second to each host (0 to disable)')
+    parser.add_argument('--fresh', action='store_true', help='Ignore any crawl journal left by an interrupted run')
+    parser.add_argument('--metrics', default=None, help='Write HTTP timings and counters to this JSON (or .prom Prometheus textfile) path')
     args = parser.parse_args()
-    main(args.session_year)
\ No newline at end of file
+    main(args.session_year, workers=args.workers, requests_per_second=args.rate, fresh=args.fresh, metrics_path=args.metrics)
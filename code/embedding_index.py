@@ -0,0 +1,355 @@
+# Embedding index over bill markdown for semantic retrieval.
+# Each bill's markdown (the amended bill when there is one, as leg_qa reads it) is split with
+# bill_chunking and every chunk is embedded, either by a local Ollama embedding model or by a
+# deterministic feature-hashing stand-in that needs no model at all. Unit-length vectors are
+# saved as one .npy that queries memory-map, with an inverted-file (IVF) partition from
+# k-means so approximate search only scores the chunks of the closest few clusters. Bills
+# whose markdown is unchanged keep their vectors when the index is rebuilt.
+
+import os
+import re
+import json
+import time
+import hashlib
+import argparse
+from glob import glob
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+import tiktoken
+import ollama
+from tqdm import tqdm
+from file_utils import sha256_bytes, atomic_open, atomic_write_text
+from count_tokens import MODEL as TOKENIZER_MODEL
+from bill_chunking import chunk_bill, STRUCK_MODES
+from corpus_store import classify_document
+from metrics import METRICS
+
+
+DEFAULT_INDEX_DIR = 'data/embedding_index'
+DEFAULT_EMBEDDER = 'hashing'
+DEFAULT_OLLAMA_EMBEDDING_MODEL = 'nomic-embed-text'
+HASHING_DIMENSIONS = 512
+CHUNK_TOKENS = 512
+EMBEDDING_BATCH_SIZE = 32
+SNIPPET_CHARS = 160
+CHUNK_FIELDS = ('session_year', 'bill_number', 'doc_name', 'chunk_number', 'md_sha256', 'snippet')
+# Rows of vectors scored at once by exact search, bounding memory use on large indexes
+SEARCH_BLOCK_ROWS = 65536
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_ROWS = 50000
+DEFAULT_NPROBE = 16
+WORD_PATTERN = re.compile(r'[a-z0-9]+(?:[.-][a-z0-9]+)*')
+# Words too common in bill text to tell chunks apart; left out of hashed features
+STOP_WORDS = frozenset(
+    'a all an and any are as at be been by each for from has have if in into is it its may '
+    'not of on only or other shall such than that the this to under which who whose with'.split()
+)
+PAGE_MARKER_PATTERN = re.compile(r'^(?:START|END) OF PAGE \d+$', re.MULTILINE)
+
+
+def normalise_rows(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.where(norms == 0, 1, norms)).astype(np.float32)
+
+
+@lru_cache(maxsize=1 << 20)
+def hashed_feature(feature, dimensions):
+    """The (column, sign) of a feature; blake2b keeps it stable across processes, unlike hash()."""
+    value = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+    return value % dimensions, 1.0 if value >> 63 else -1.0
+
+
+class HashingEmbedder:
+    """
+    Deterministic offline embeddings: word unigrams and bigrams (without STOP_WORDS) hashed
+    into a fixed number of signed columns, weighted by 1 + log(count). Similar wording gives similar vectors, with
+    no model download and identical vectors on every machine.
+    """
+
+    def __init__(self, dimensions=HASHING_DIMENSIONS):
+        self.dimensions = dimensions
+        self.name = f'hashing-{dimensions}'
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = [word for word in WORD_PATTERN.findall(text.lower()) if word not in STOP_WORDS]
+            features, counts = np.unique(words + [f'{a} {b}' for a, b in zip(words, words[1:])], return_counts=True)
+            for feature, count in zip(features.tolist(), counts.tolist()):
+                column, sign = hashed_feature(feature, self.dimensions)
+                vectors[row, column] += sign * (1 + np.log(count))
+        return normalise_rows(vectors)
+
+
+class OllamaEmbedder:
+    """Embeddings from a model served by the local Ollama server."""
+
+    def __init__(self, model=DEFAULT_OLLAMA_EMBEDDING_MODEL):
+        self.model = model
+        self.name = f'ollama:{model}'
+
+    def embed(self, texts):
+        vectors = []
+        for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+            response = ollama.embed(model=self.model, input=texts[start:start + EMBEDDING_BATCH_SIZE])
+            vectors.extend(response.embeddings)
+        return normalise_rows(np.array(vectors, dtype=np.float32).reshape(len(texts), -1))
+
+
+def load_embedder(name):
+    """An embedder from its name: 'hashing', 'hashing-{dimensions}', 'ollama' or 'ollama:{model}'."""
+    if name.startswith('ollama'):
+        _, _, model = name.partition(':')
+        return OllamaEmbedder(model or DEFAULT_OLLAMA_EMBEDDING_MODEL)
+    if name.startswith('hashing'):
+        _, _, dimensions = name.partition('-')
+        return HashingEmbedder(int(dimensions) if dimensions else HASHING_DIMENSIONS)
+    raise ValueError(f'Unknown embedder {name!r}; use hashing[-dimensions] or ollama[:model]')
+
+
+def kmeans(vectors, clusters, iterations=KMEANS_ITERATIONS, seed=0):
+    """Spherical k-means on unit vectors. Returns unit-length centroids."""
+    rng = np.random.default_rng(seed)
+    sample = vectors[np.sort(rng.choice(len(vectors), min(len(vectors), KMEANS_SAMPLE_ROWS), replace=False))]
+    centroids = sample[rng.choice(len(sample), clusters, replace=False)]
+    for _ in range(iterations):
+        assignments = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        # A cluster left empty keeps its previous centroid
+        empty = ~np.bincount(assignments, minlength=clusters).astype(bool)
+        sums[empty] = centroids[empty]
+        centroids = normalise_rows(sums)
+    return centroids
+
+
+def assign_clusters(vectors, centroids):
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), SEARCH_BLOCK_ROWS):
+        assignments[start:start + SEARCH_BLOCK_ROWS] = np.argmax(vectors[start:start + SEARCH_BLOCK_ROWS] @ centroids.T, axis=1)
+    return assignments
+
+
+class EmbeddingIndex:
+    """
+    A directory holding vectors.npy (one unit vector per chunk, memory-mapped when loaded),
+    chunks.npz (CHUNK_FIELDS for each vector row), ivf.npz (cluster centroids and the vector
+    rows of each cluster) and index.json (the embedder and chunking settings).
+    """
+
+    def __init__(self, index_dir, settings, vectors, chunks, centroids, list_offsets, list_rows):
+        self.index_dir = index_dir
+        self.settings = settings
+        self.vectors = vectors
+        self.chunks = chunks
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+
+    @classmethod
+    def load(cls, index_dir=DEFAULT_INDEX_DIR):
+        with open(os.path.join(index_dir, 'index.json'), 'r', encoding='utf-8') as f:
+            settings = json.load(f)
+        vectors = np.load(os.path.join(index_dir, 'vectors.npy'), mmap_mode='r')
+        with np.load(os.path.join(index_dir, 'chunks.npz')) as arrays:
+            chunks = {name: arrays[name] for name in CHUNK_FIELDS}
+        with np.load(os.path.join(index_dir, 'ivf.npz')) as arrays:
+            centroids, list_offsets, list_rows = arrays['centroids'], arrays['list_offsets'], arrays['list_rows']
+        return cls(index_dir, settings, vectors, chunks, centroids, list_offsets, list_rows)
+
+    @classmethod
+    def save(cls, index_dir, settings, vectors, chunks, clusters=None):
+        """Writes an index (partitioning it into about sqrt(rows) clusters by default) and loads it back."""
+        clusters = clusters or max(1, int(round(np.sqrt(len(vectors)))))
+        clusters = min(clusters, len(vectors))
+        if clusters:
+            centroids = kmeans(vectors, clusters)
+            assignments = assign_clusters(vectors, centroids)
+        else:
+            centroids = np.zeros((0, vectors.shape[1]), dtype=np.float32)
+            assignments = np.zeros(0, dtype=np.int32)
+        list_rows = np.argsort(assignments, kind='stable').astype(np.int64)
+        list_offsets = np.searchsorted(assignments[list_rows], np.arange(clusters + 1)).astype(np.int64)
+        with atomic_open(os.path.join(index_dir, 'vectors.npy'), 'wb') as f:
+            np.save(f, vectors)
+        with atomic_open(os.path.join(index_dir, 'chunks.npz'), 'wb') as f:
+            np.savez(f, **chunks)
+        with atomic_open(os.path.join(index_dir, 'ivf.npz'), 'wb') as f:
+            np.savez(f, centroids=centroids, list_offsets=list_offsets, list_rows=list_rows)
+        atomic_write_text(os.path.join(index_dir, 'index.json'), json.dumps({**settings, 'chunks': len(vectors), 'clusters': clusters}, indent=1))
+        return cls.load(index_dir)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def embedder(self):
+        return load_embedder(self.settings['embedder'])
+
+    def candidate_rows(self, query_vector, nprobe):
+        """The vector rows of the nprobe clusters whose centroids are closest to query_vector."""
+        nprobe = min(nprobe, len(self.centroids))
+        clusters = np.argpartition(-(self.centroids @ query_vector), nprobe - 1)[:nprobe] if nprobe else []
+        return np.concatenate([np.zeros(0, dtype=np.int64)] + [
+            self.list_rows[self.list_offsets[cluster]:self.list_offsets[cluster + 1]] for cluster in clusters
+        ])
+
+    def search(self, query, k=20, session_years=None, approximate=False, nprobe=DEFAULT_NPROBE):
+        """
+        Finds the chunks most similar to query (cosine similarity).
+
+        Args:
+            query: The query text, embedded with the index's embedder.
+            k: The number of chunks returned.
+            session_years: Only return chunks of these sessions.
+            approximate: Only score the chunks of the nprobe closest IVF clusters instead of
+                every chunk.
+            nprobe: The number of clusters scored by approximate search.
+
+        Returns:
+            A DataFrame of CHUNK_FIELDS and score, most similar first.
+        """
+        query_vector = self.embedder().embed([query])[0]
+        if approximate:
+            rows = np.sort(self.candidate_rows(query_vector, nprobe))
+            scores = self.vectors[rows] @ query_vector
+        else:
+            rows = np.arange(len(self.vectors))
+            scores = np.concatenate([np.zeros(0, dtype=np.float32)] + [
+                self.vectors[start:start + SEARCH_BLOCK_ROWS] @ query_vector
+                for start in range(0, len(self.vectors), SEARCH_BLOCK_ROWS)
+            ])
+        if session_years:
+            keep = np.isin(self.chunks['session_year'][rows], session_years)
+            rows, scores = rows[keep], scores[keep]
+        top = np.argsort(-scores, kind='stable')[:k]
+        results = pd.DataFrame({name: self.chunks[name][rows[top]] for name in CHUNK_FIELDS if name != 'md_sha256'})
+        results['score'] = scores[top]
+        return results
+
+    def candidate_bills(self, query, top_bills=100, session_years=None, approximate=False, nprobe=DEFAULT_NPROBE):
+        """
+        Ranks bills by their best-matching chunk, e.g. to choose which bills a narrow
+        question is worth sending to an LLM.
+
+        Returns:
+            A DataFrame of session_year, bill_number, score and the best chunk's snippet.
+        """
+        chunks = self.search(query, k=len(self.vectors), session_years=session_years, approximate=approximate, nprobe=nprobe)
+        bills = chunks.drop_duplicates(['session_year', 'bill_number'])
+        return bills[['session_year', 'bill_number', 'score', 'snippet']].head(top_bills).reset_index(drop=True)
+
+
+def bill_markdown_files(session_year):
+    """Each bill's markdown path, preferring the amended bill, as leg_qa reads it."""
+    paths = dict()
+    for md_path in sorted(glob(f'data/{session_year}rs/md/*.md')):
+        bill_number, kind, _ = classify_document(os.path.splitext(os.path.basename(md_path))[0])
+        if kind == 'amended' or (kind == 'bill' and bill_number not in paths):
+            paths[bill_number] = md_path
+    return paths
+
+
+def build_index(session_years, index_dir=DEFAULT_INDEX_DIR, embedder_name=DEFAULT_EMBEDDER, chunk_tokens=CHUNK_TOKENS, struck='drop', clusters=None):
+    """
+    Chunks and embeds the bills of session_years, reusing the vectors of bills whose
+    markdown is unchanged when the existing index used the same settings. Sessions not in
+    session_years are kept as they are.
+    """
+    embedder = load_embedder(embedder_name)
+    settings = {'embedder': embedder.name, 'chunk_tokens': chunk_tokens, 'struck': struck}
+    previous = None
+    if os.path.exists(os.path.join(index_dir, 'index.json')):
+        previous = EmbeddingIndex.load(index_dir)
+        if {name: previous.settings.get(name) for name in settings} != settings:
+            print('Index settings changed; re-embedding every bill.')
+            previous = None
+    tokenizer = tiktoken.encoding_for_model(TOKENIZER_MODEL)
+
+    vector_parts = []
+    chunk_parts = []
+    if previous is not None:
+        # Sessions that are not being rebuilt
+        keep = ~np.isin(previous.chunks['session_year'], session_years)
+        vector_parts.append(np.asarray(previous.vectors[keep]))
+        chunk_parts.append({name: previous.chunks[name][keep] for name in CHUNK_FIELDS})
+    previous_rows = dict()
+    if previous is not None:
+        keys = zip(previous.chunks['session_year'].tolist(), previous.chunks['doc_name'].tolist(), previous.chunks['md_sha256'].tolist())
+        for row, key in enumerate(keys):
+            previous_rows.setdefault(key, []).append(row)
+    reused = 0
+    embedded = 0
+    for session_year in session_years:
+        for bill_number, md_path in tqdm(bill_markdown_files(session_year).items(), desc=f'{session_year} bills'):
+            with open(md_path, 'rb') as f:
+                content = f.read()
+            md_sha256 = sha256_bytes(content)
+            doc_name = os.path.splitext(os.path.basename(md_path))[0]
+            rows = previous_rows.get((session_year, doc_name, md_sha256))
+            if rows:
+                vector_parts.append(np.asarray(previous.vectors[rows]))
+                chunk_parts.append({name: previous.chunks[name][rows] for name in CHUNK_FIELDS})
+                reused += 1
+                continue
+            texts = [text for text in chunk_bill(content.decode('utf-8'), tokenizer, chunk_tokens, struck) if text.strip()]
+            if not texts:
+                continue
+            with METRICS.timer('embedding_seconds', embedder=embedder.name):
+                vector_parts.append(embedder.embed(texts))
+            METRICS.count('embedded_chunks', len(texts), embedder=embedder.name)
+            chunk_parts.append({
+                'session_year': np.full(len(texts), session_year, dtype=np.int16),
+                'bill_number': np.full(len(texts), bill_number),
+                'doc_name': np.full(len(texts), doc_name),
+                'chunk_number': np.arange(len(texts), dtype=np.int32),
+                'md_sha256': np.full(len(texts), md_sha256),
+                'snippet': np.array([' '.join(PAGE_MARKER_PATTERN.sub('', text).split())[:SNIPPET_CHARS] for text in texts]),
+            })
+            embedded += 1
+    dimensions = vector_parts[0].shape[1] if vector_parts else getattr(embedder, 'dimensions', 0)
+    vectors = np.concatenate([np.zeros((0, dimensions), dtype=np.float32)] + vector_parts)
+    chunks = {
+        name: np.concatenate([part[name] for part in chunk_parts]) if chunk_parts else np.zeros(0)
+        for name in CHUNK_FIELDS
+    }
+    index = EmbeddingIndex.save(index_dir, settings, vectors, chunks, clusters)
+    print(f'{embedded} bills embedded, {reused} unchanged; {len(index)} chunks in {index.settings["clusters"]} clusters in {index_dir}')
+    return index
+
+
+def main(args):
+    if args.command == 'build':
+        build_index(args.session_years, args.index_dir, args.embedder, args.chunk_tokens, args.struck, args.clusters)
+    elif args.command == 'search':
+        index = EmbeddingIndex.load(args.index_dir)
+        start = time.perf_counter()
+        if args.bills:
+            results = index.candidate_bills(args.query, args.limit, args.sessions, args.approximate, args.nprobe)
+        else:
+            results = index.search(args.query, args.limit, args.sessions, args.approximate, args.nprobe)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with pd.option_context('display.max_rows', None, 'display.max_colwidth', 80, 'display.width', None):
+            print(results)
+        print(f'{len(results)} {"bills" if args.bills else "chunks"} in {elapsed_ms:.1f} ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build and query the embedding index over bill markdown.')
+    parser.add_argument('--index-dir', default=DEFAULT_INDEX_DIR, help='Directory of the embedding index')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help='Embed (or re-embed changed) bills of sessions')
+    build_parser.add_argument('session_years', type=int, nargs='+', help='The regular session years')
+    build_parser.add_argument('--embedder', default=DEFAULT_EMBEDDER, help="'hashing[-dimensions]' (offline, deterministic) or 'ollama[:model]'")
+    build_parser.add_argument('--chunk-tokens', type=int, default=CHUNK_TOKENS, help='Maximum tokens per embedded chunk')
+    build_parser.add_argument('--struck', choices=STRUCK_MODES, default='drop', help='How struck text is embedded')
+    build_parser.add_argument('--clusters', type=int, default=None, help='IVF clusters (default: about the square root of the chunk count)')
+    search_parser = subparsers.add_parser('search', help='Find the chunks or bills most similar to a query')
+    search_parser.add_argument('query', help="Query text, e.g. 'child poverty tax credit'")
+    search_parser.add_argument('--sessions', type=int, nargs='+', default=None, help='Only search these session years')
+    search_parser.add_argument('--bills', action='store_true', help='Rank bills by their best chunk instead of listing chunks')
+    search_parser.add_argument('--approximate', action='store_true', help='Only score the chunks of the closest IVF clusters')
+    search_parser.add_argument('--nprobe', type=int, default=DEFAULT_NPROBE, help='Clusters scored by --approximate')
+    search_parser.add_argument('--limit', type=int, default=20, help='Maximum number of results')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,216 @@
+# Single-pass extraction engine for bill PDFs.
+# Each PDF is opened once with PyMuPDF, and every page's words are extracted once. From that one pass it writes the strike-aware markdown (md), the
+# line-addressed line table (lines), the plain text (basic_txt, the same line layout without
+# strikethrough markers, as leg_to_basic_txt writes it) and per-page metadata (meta). A PDF
+# whose content hash matches its metadata is skipped before it is parsed.
+
+import os
+import json
+import time
+import argparse
+from glob import glob
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
+import pymupdf
+from file_utils import sha256_file, atomic_open, atomic_write_text
+from leg_to_md import find_strike_line_rects, match_struck_words, words_to_markdown
+from leg_to_basic_txt import words_text
+from line_table import LineTable, words_to_rows, line_table_path
+from metrics import METRICS, profile
+
+
+# Bump whenever a change to this module, leg_to_md or line_table alters the extracted output
+ENGINE_VERSION = 5
+CORRUPTED_PDF_ERRORS = (pymupdf.FileDataError,)
+
+
+def output_paths(session_dir, file_name):
+    """Returns the (txt, md, meta) output paths for a PDF named file_name.pdf."""
+    return (
+        os.path.join(session_dir, 'basic_txt', f'{file_name}.txt'),
+        os.path.join(session_dir, 'md', f'{file_name}.md'),
+        os.path.join(session_dir, 'meta', f'{file_name}.json'),
+    )
+
+
+def add_seconds(timings, phase, start):
+    """Adds the time since start to timings[phase] and returns the current time."""
+    now = time.perf_counter()
+    if timings is not None:
+        timings[phase] = timings.get(phase, 0.0) + now - start
+    return now
+
+
+def extract_page(page, timings=None):
+    """
+    Extracts one page from a single word extraction.
+
+    Args:
+        timings: Optional dict to which the seconds spent in the 'parse', 'strike' and
+            'layout' phases are added.
+
+    Returns:
+        A (plain_text, markdown, rows, page_metadata) tuple, where rows is the page's
+        line_table.words_to_rows() layout.
+    """
+    start = time.perf_counter()
+    words = page.get_text("words")
+    start = add_seconds(timings, 'parse', start)
+    if not words:
+        return "", "", [], {'page': page.number + 1, 'word_count': 0, 'strike_line_count': 0, 'struck_word_count': 0}
+    strikethrough_line_rects = find_strike_line_rects(page)
+    struck_boxes = {tuple(rect) for rect in match_struck_words(words, strikethrough_line_rects)}
+    start = add_seconds(timings, 'strike', start)
+    markdown = words_to_markdown(words, struck_boxes)
+    plain_text = words_text(words) if struck_boxes else markdown
+    rows = words_to_rows(words, struck_boxes)
+    add_seconds(timings, 'layout', start)
+    page_metadata = {
+        'page': page.number + 1,
+        'word_count': len(words),
+        'strike_line_count': len(strikethrough_line_rects),
+        'struck_word_count': len(struck_boxes),
+    }
+    return plain_text, markdown, rows, page_metadata
+
+
+def is_unchanged(pdf_file, txt_path, md_path, meta_path, source_sha256=None, lines_path=None):
+    """
+    True when all outputs exist and the metadata records the same PDF hash and engine version.
+    """
+    if not (os.path.exists(txt_path) and os.path.exists(md_path) and os.path.exists(meta_path)):
+        return False
+    if lines_path is not None and not os.path.exists(lines_path):
+        return False
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+    except (json.JSONDecodeError, OSError):
+        return False
+    return (
+        metadata.get('engine_version') == ENGINE_VERSION
+        and metadata.get('source_sha256') == (source_sha256 or sha256_file(pdf_file))
+    )
+
+
+def extract_document(pdf_file, txt_path, md_path, meta_path, source_sha256=None, lines_path=None):
+    """
+    Opens pdf_file once and streams its plain text and markdown to txt_path and md_path page
+    by page, then writes the line table to lines_path (when given) and the document metadata
+    to meta_path. Per-phase timings (open, parse, strike, layout, write) are recorded in
+    metrics.METRICS.
+
+    Returns:
+        The document metadata dict.
+    """
+    timings = dict()
+    start = time.perf_counter()
+    source_sha256 = source_sha256 or sha256_file(pdf_file)
+    page_metadata = []
+    page_rows = []
+    with pymupdf.open(pdf_file) as doc, \
+            atomic_open(txt_path) as txt_file, \
+            atomic_open(md_path) as md_file:
+        start = add_seconds(timings, 'open', start)
+        for index, page in enumerate(doc):
+            plain_text, markdown, rows, metadata = extract_page(page, timings)
+            start = time.perf_counter()
+            if index:
+                txt_file.write('\n')
+                md_file.write('\n\n')
+            txt_file.write(plain_text)
+            md_file.write(f'START OF PAGE {index + 1}\n{markdown}\nEND OF PAGE {index + 1}')
+            page_metadata.append(metadata)
+            page_rows.append(rows)
+            start = add_seconds(timings, 'write', start)
+    if lines_path is not None:
+        LineTable.from_pages(page_rows).save(lines_path)
+    document_metadata = {
+        'source': os.path.basename(pdf_file),
+        'source_sha256': source_sha256,
+        'engine_version': ENGINE_VERSION,
+        'page_count': len(page_metadata),
+        'word_count': sum(page['word_count'] for page in page_metadata),
+        'strike_line_count': sum(page['strike_line_count'] for page in page_metadata),
+        'struck_word_count': sum(page['struck_word_count'] for page in page_metadata),
+        'pages': page_metadata,
+    }
+    atomic_write_text(meta_path, json.dumps(document_metadata, indent=1))
+    add_seconds(timings, 'write', start)
+    METRICS.record_document('extract', os.path.basename(pdf_file), timings)
+    METRICS.count('extract_pages', len(page_metadata))
+    METRICS.count('extract_documents')
+    return document_metadata
+
+
+def extract_session_document(pdf_file, session_dir, source_sha256=None):
+    """
+    Extracts a PDF into the session's basic_txt, md, lines and meta directories.
+
+    Returns:
+        The number of pages extracted (0 for a corrupted PDF).
+    """
+    file_name, _ = os.path.splitext(os.path.basename(pdf_file))
+    try:
+        return extract_document(
+            pdf_file, *output_paths(session_dir, file_name), source_sha256=source_sha256,
+            lines_path=line_table_path(session_dir, file_name)
+        )['page_count']
+    except CORRUPTED_PDF_ERRORS:
+        print("Corrupted PDF: {}".format(os.path.basename(pdf_file)))
+        METRICS.count('extract_failures')
+        return 0
+
+
+def extract_in_worker(pdf_file, session_dir, source_sha256=None):
+    """
+    extract_session_document for a worker process, which returns its page count with the
+    metrics it recorded so the parent can merge them.
+    """
+    METRICS.reset()
+    page_count = extract_session_document(pdf_file, session_dir, source_sha256)
+    return page_count, METRICS.snapshot()
+
+
+def main(session_year, workers=1, force=False, metrics_path=None, profile_dir=None):
+    session_dir = f'data/{session_year}rs'
+    pdf_files = sorted(glob(os.path.join(session_dir, 'pdf', '*.pdf')))
+
+    stale = []
+    for pdf_file in pdf_files:
+        file_name, _ = os.path.splitext(os.path.basename(pdf_file))
+        source_sha256 = sha256_file(pdf_file)
+        if force or not is_unchanged(pdf_file, *output_paths(session_dir, file_name), source_sha256=source_sha256, lines_path=line_table_path(session_dir, file_name)):
+            stale.append((pdf_file, source_sha256))
+    print(f'Extracting {len(stale)} of {len(pdf_files)} PDFs ({len(pdf_files) - len(stale)} unchanged).')
+
+    full_page_count = 0
+    with profile('extract', profile_dir):
+        if workers <= 1:
+            for pdf_file, source_sha256 in tqdm(stale):
+                full_page_count += extract_session_document(pdf_file, session_dir, source_sha256)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(extract_in_worker, pdf_file, session_dir, source_sha256)
+                    for pdf_file, source_sha256 in stale
+                ]
+                for future in tqdm(as_completed(futures), total=len(futures)):
+                    page_count, worker_metrics = future.result()
+                    full_page_count += page_count
+                    METRICS.merge(worker_metrics)
+    print(f'Total page count: {full_page_count}')
+    if metrics_path is not None:
+        METRICS.write(metrics_path)
+        print(f'Saved metrics to {metrics_path}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Extract plain text, markdown, line tables and page metadata from Maryland legislation PDFs in one pass.')
+    parser.add_argument('session_year', type=int, help='The regular session year')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Number of worker processes (1 extracts serially)')
+    parser.add_argument('--force', action='store_true', help='Re-extract every PDF, even if unchanged')
+    parser.add_argument('--metrics', default=None, help='Write per-document timings and counters to this JSON (or .prom Prometheus textfile) path')
+    parser.add_argument('--profile-dir', default=None, help='Write a cProfile profile of the extraction to this directory (workers are not profiled)')
+    args = parser.parse_args()
+    main(args.session_year, workers=args.workers, force=args.force, metrics_path=args.metrics, profile_dir=args.profile_dir)
@@ -0,0 +1,119 @@
+# Golden-output regression check for the markdown and plain text the pipeline writes.
+# Runs extract_legislation.extract_document, which writes data/*/md and data/*/basic_txt in
+# pipeline.py and extract_legislation.py, on the committed data/*/pdf corpus in a temporary
+# directory and compares its output byte-for-byte with the committed files. Exits with
+# status 1 if any file differs.
+
+import os
+import sys
+import argparse
+import tempfile
+from glob import glob
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+from extract_legislation import extract_document, output_paths
+
+
+def first_difference(expected, actual):
+    expected_lines = expected.split('\n')
+    actual_lines = actual.split('\n')
+    for line_number, (expected_line, actual_line) in enumerate(zip(expected_lines, actual_lines), start=1):
+        if expected_line != actual_line:
+            return line_number, expected_line, actual_line
+    line_number = min(len(expected_lines), len(actual_lines)) + 1
+    return line_number, '<end of file>' if len(expected_lines) < line_number else expected_lines[line_number - 1], \
+        '<end of file>' if len(actual_lines) < line_number else actual_lines[line_number - 1]
+
+
+# Output kind: (committed directory, file extension)
+GOLDEN_KINDS = {
+    'md': ('md', '.md'),
+    'basic_txt': ('basic_txt', '.txt'),
+}
+
+
+@lru_cache(maxsize=1)
+def extracted_outputs(pdf_file):
+    """
+    Extracts pdf_file into a temporary directory and returns the bytes of each output kind.
+    The last PDF's outputs are kept, so checking every kind of a PDF extracts it once.
+    """
+    file_name, _ = os.path.splitext(os.path.basename(pdf_file))
+    with tempfile.TemporaryDirectory() as session_dir:
+        extract_document(pdf_file, *output_paths(session_dir, file_name))
+        outputs = dict()
+        for kind, (directory, extension) in GOLDEN_KINDS.items():
+            with open(os.path.join(session_dir, directory, f'{file_name}{extension}'), 'rb') as f:
+                outputs[kind] = f.read()
+    return outputs
+
+
+def first_byte_difference(expected, actual):
+    for offset, (expected_byte, actual_byte) in enumerate(zip(expected, actual)):
+        if expected_byte != actual_byte:
+            return offset
+    return min(len(expected), len(actual))
+
+
+def check_file(task):
+    """
+    Regenerates one (kind, pdf_file) output. Returns None when it matches the committed file
+    byte for byte, otherwise a description of the first difference.
+    """
+    kind, pdf_file = task
+    directory, extension = GOLDEN_KINDS[kind]
+    file_name, _ = os.path.splitext(os.path.basename(pdf_file))
+    golden_path = os.path.join(os.path.dirname(os.path.dirname(pdf_file)), directory, f'{file_name}{extension}')
+    if not os.path.exists(golden_path):
+        return f'{golden_path}: missing golden file'
+    with open(golden_path, 'rb') as golden_file:
+        expected_bytes = golden_file.read()
+    actual_bytes = extracted_outputs(pdf_file)[kind]
+    if actual_bytes == expected_bytes:
+        return None
+    offset = first_byte_difference(expected_bytes, actual_bytes)
+    line_number, expected_line, actual_line = first_difference(
+        expected_bytes.decode('utf-8', errors='replace'), actual_bytes.decode('utf-8', errors='replace')
+    )
+    return (
+        f'{golden_path}:{line_number} (first differing byte at offset {offset}, '
+        f'{len(expected_bytes)} bytes expected, {len(actual_bytes)} actual)\n'
+        f'    expected: {expected_line!r}\n    actual:   {actual_line!r}'
+    )
+
+
+def check_markdown(pdf_file):
+    """Returns None when the regenerated markdown matches, otherwise a description of the first difference."""
+    return check_file(('md', pdf_file))
+
+
+def main(args):
+    repo_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    pdf_files = []
+    for session_year in args.sessions:
+        pdf_files.extend(sorted(glob(os.path.join(repo_dir, f'data/{session_year}rs/pdf/*.pdf'))))
+    if args.limit:
+        pdf_files = pdf_files[:args.limit]
+
+    tasks = [(kind, pdf_file) for pdf_file in pdf_files for kind in args.kinds]
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        results = list(tqdm(executor.map(check_file, tasks, chunksize=4), total=len(tasks)))
+    for failure in results:
+        if failure is not None:
+            print(failure)
+    for kind in args.kinds:
+        kind_results = [failure for (task_kind, _), failure in zip(tasks, results) if task_kind == kind]
+        matching = sum(failure is None for failure in kind_results)
+        print(f'{matching} of {len(kind_results)} {kind} files match the golden output.')
+    return 1 if any(failure is not None for failure in results) else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare extract_legislation output with the committed markdown and plain text.')
+    parser.add_argument('--sessions', type=int, nargs='+', default=[2023, 2024, 2025], help='Sessions to check')
+    parser.add_argument('--kinds', nargs='+', choices=list(GOLDEN_KINDS), default=list(GOLDEN_KINDS), help='Outputs to check')
+    parser.add_argument('--limit', type=int, default=None, help='Only check the first N PDFs')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Number of worker processes')
+    args = parser.parse_args()
+    sys.exit(main(args))
@@ -0,0 +1,115 @@
+# On-disk conditional-GET cache for download_legislation.
+# Entries are keyed by URL and store the validators (ETag / Last-Modified) and a
+# SHA-256 of the body, so repeat syncs only move bytes that changed on the server.
+
+import os
+import json
+import hashlib
+import threading
+from crawler import fetch
+from file_utils import sha256_bytes, sha256_file, atomic_write_bytes
+from metrics import METRICS
+
+
+class CachedResponse:
+    """
+    Result of HttpCache.get. `changed` is True when the body differs from the one
+    seen on the previous sync (or no previous sync exists); `not_modified` is True
+    when the server answered 304 and no body was transferred.
+    """
+
+    def __init__(self, url, sha256, changed, not_modified, content=None, body_path=None):
+        self.url = url
+        self.sha256 = sha256
+        self.changed = changed
+        self.not_modified = not_modified
+        self._content = content
+        self.body_path = body_path
+
+    @property
+    def content(self):
+        if self._content is None and self.body_path is not None:
+            with open(self.body_path, 'rb') as f:
+                self._content = f.read()
+        return self._content
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class HttpCache:
+    """
+    URL-keyed cache stored under cache_dir as {key}.json metadata plus, for pages
+    without a destination file, a {key}.body copy of the last response body.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.stats_lock = threading.Lock()
+        self.stats = {'requests': 0, 'not_modified': 0, 'changed': 0, 'bytes_downloaded': 0}
+
+    def key(self, url):
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def metadata_path(self, url):
+        return os.path.join(self.cache_dir, f'{self.key(url)}.json')
+
+    def load(self, url):
+        path = self.metadata_path(url)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, OSError):
+            return None
+
+    def count(self, **increments):
+        with self.stats_lock:
+            for name, value in increments.items():
+                self.stats[name] += value
+        for name, value in increments.items():
+            METRICS.count(f'http_{name}', value)
+
+    def get(self, session, url, dest_path=None, limiter=None):
+        """
+        Conditionally GET url. When dest_path is given the body is written there (and the
+        existing file is treated as the cached copy); otherwise it is kept in the cache dir.
+        Raises requests.HTTPError for error responses.
+        """
+        body_path = dest_path or os.path.join(self.cache_dir, f'{self.key(url)}.body')
+        metadata = self.load(url)
+        headers = dict()
+        # Only revalidate when the cached body is still on disk and unmodified
+        body_intact = metadata is not None and os.path.exists(body_path) and \
+            (dest_path is None or sha256_file(body_path) == metadata.get('sha256'))
+        if body_intact:
+            if metadata.get('etag'):
+                headers['If-None-Match'] = metadata['etag']
+            if metadata.get('last_modified'):
+                headers['If-Modified-Since'] = metadata['last_modified']
+
+        with METRICS.timer('http_fetch_seconds'):
+            response = fetch(session, url, limiter=limiter, headers=headers)
+        self.count(requests=1)
+        if response.status_code == 304 and headers:
+            self.count(not_modified=1)
+            return CachedResponse(url, metadata['sha256'], changed=False, not_modified=True, body_path=body_path)
+        response.raise_for_status()
+
+        content = response.content
+        sha256 = sha256_bytes(content)
+        changed = metadata is None or metadata.get('sha256') != sha256
+        if changed or not body_intact:
+            atomic_write_bytes(body_path, content)
+        self.count(changed=int(changed), bytes_downloaded=len(content))
+        new_metadata = {
+            'url': url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'sha256': sha256,
+            'size': len(content),
+        }
+        atomic_write_bytes(self.metadata_path(url), json.dumps(new_metadata).encode('utf-8'))
+        return CachedResponse(url, sha256, changed=changed, not_modified=False, content=content, body_path=body_path)
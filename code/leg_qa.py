@@ -3,6 +3,7 @@
 # pip install ollama python-dotenv pydantic pandas google-genai openai
 
 import os
+import re
 import sys
 import json
 import argparse
@@ -14,11 +15,28 @@ from google import genai
 import ollama
 from ollama import chat
 from ollama import ChatResponse
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
 from typing import Literal, Optional
 from tqdm import tqdm
 import time
-from llm_utils import query_llm_with_retries
+import tiktoken
+from llm_utils import query_llm_with_retries, validated_response
+from llm_validation import validate_answers
+from llm_executor import LLMExecutor, budget_for, estimate_tokens
+from llm_cache import LLMCache, DEFAULT_CACHE_DIR
+from llm_batch import run_batch, BATCH_POLL_SECONDS
+import corpus_store
+from file_utils import sha256_bytes, atomic_open
+from count_tokens import MODEL as TOKENIZER_MODEL, count_tokens
+from bill_chunking import chunk_bill, STRUCK_MODES
+from embedding_index import EmbeddingIndex, DEFAULT_INDEX_DIR as DEFAULT_EMBEDDING_INDEX_DIR
+from metrics import METRICS
+
+
+DEFAULT_WORKERS = 8
+# Bills with more tokens than this are answered in parts (map) whose answers are then
+# combined (reduce). Leaves room for the prompt and answer in each family's context window.
+DEFAULT_MAX_BILL_TOKENS = {'gemini': 100000, 'gpt': 100000, 'ollama': 12000}
 
 
 question_dict = {
@@ -47,6 +65,30 @@ SYSTEM_PROMPT = SYSTEM_PROMPT.format(
     "\n".join([f"- {key}: {value}" for key, value in question_dict.items()])
 )
 
+CHUNK_SYSTEM_PROMPT = (
+    "You are reading one part of the markdown generated from the text of a long bill passed by the Maryland General Assembly. "
+    "The input starts with which part it is (e.g. PART 2 OF 5). "
+    "Please note that the strikethrough syntax (~~) means a word or section should be ignored. "
+    "Answer the following questions using only this part of the bill; answers from every part will be combined later:\n"
+    "{}\n"
+    "Please respond with only valid JSON in the specified format."
+)
+CHUNK_SYSTEM_PROMPT = CHUNK_SYSTEM_PROMPT.format(
+    "\n".join([f"- {key}: {value}" for key, value in question_dict.items()])
+)
+REDUCE_SYSTEM_PROMPT = (
+    "You are given JSON answers to questions about a bill passed by the Maryland General Assembly. "
+    "The bill was too long to read at once, so each answer was written from one part of the bill. "
+    "Combine them into one set of answers for the whole bill: write a single summary, "
+    "total the funding without counting the same money twice, "
+    "and use the highest score any part supports. The questions were:\n"
+    "{}\n"
+    "Please respond with only valid JSON in the specified format."
+)
+REDUCE_SYSTEM_PROMPT = REDUCE_SYSTEM_PROMPT.format(
+    "\n".join([f"- {key}: {value}" for key, value in question_dict.items()])
+)
+
 
 class AnswersToQuestions(BaseModel):
     bill_summary: str
@@ -62,75 +104,492 @@ class AnswersToQuestions(BaseModel):
     child_poverty_direct_score: int
 
 
-def main(args):
-    load_dotenv()
-    model_family = args.model_family.lower()
-    # Set default model names if not provided
-    if args.model is None:
-        if model_family == 'gemini':
-            model_name = 'gemini-2.5-flash'
-        elif model_family == 'gpt':
-            model_name = 'gpt-4.1-nano'
-        else:
-            model_name = 'phi4'
+class ValidatedAnswers(AnswersToQuestions):
+    """
+    AnswersToQuestions with the ranges the questions ask for. Responses are checked against
+    this model, while the provider (and the cache key) still get the AnswersToQuestions schema.
+    """
+
+    @field_validator('innovative_score', 'child_poverty_direct_score')
+    @classmethod
+    def score_in_range(cls, score):
+        if not 1 <= score <= 10:
+            raise ValueError('score must be from 1 to 10')
+        return score
+
+    @field_validator('funding')
+    @classmethod
+    def funding_not_negative(cls, funding):
+        if funding is not None and funding < 0:
+            raise ValueError('funding must not be negative')
+        return funding
+
+
+def default_model_name(model_family):
+    if model_family == 'gemini':
+        return 'gemini-2.5-flash'
+    elif model_family == 'gpt':
+        return 'gpt-4.1-nano'
     else:
-        model_name = args.model
+        return 'phi4'
+
 
+def make_client(model_family, model_name):
+    """
+    Creates the LLM client for model_family, or returns None (after printing why) when the
+    required API key is missing from the environment.
+    """
     if model_family == 'gemini':
         GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
         if GEMINI_API_KEY is None:
             print("Please provide a GEMINI_API_KEY in a .env file.")
-            return
-        client = genai.Client(api_key=GEMINI_API_KEY)
+            return None
+        return genai.Client(api_key=GEMINI_API_KEY)
     elif model_family == 'gpt':
         OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
         if OPENAI_API_KEY is None:
             print("Please provide an OPENAI_API_KEY in a .env file.")
-            return
-        client = OpenAI(api_key=OPENAI_API_KEY)
+            return None
+        return OpenAI(api_key=OPENAI_API_KEY)
     else:  # Assume all other models are served via ollama
         print(f"Pulling model: {model_name}")
         ollama.pull(model_name)
-        client = chat
+        return chat
+
+
+def bill_markdown_path(md_dir, bill_number):
+    """Prefers the amended bill markdown when one exists."""
+    bill_filepath = os.path.join(md_dir, f"{bill_number}_amended.md")
+    if not os.path.exists(bill_filepath):
+        bill_filepath = os.path.join(md_dir, f"{bill_number}.md")
+    return bill_filepath
+
+
+def load_tokenizer():
+    return tiktoken.encoding_for_model(TOKENIZER_MODEL)
 
-    csv_dir = os.path.abspath(f'data/{args.session_year}rs/csv')
-    md_dir = os.path.abspath(f'data/{args.session_year}rs/md')
-    csv_filepath = os.path.join(csv_dir, "legislation.csv")
-    data = pd.read_csv(csv_filepath)
-    data = data[['YearAndSession', 'BillNumber', 'Title', 'Synopsis']]
-    bill_numbers = data['BillNumber'].values.tolist()
 
-    model_responses = []
-    for bill_number in tqdm(bill_numbers):
-        bill_filepath = os.path.join(md_dir, f"{bill_number}_amended.md")
-        if not os.path.exists(bill_filepath):
-            bill_filepath = os.path.join(md_dir, f"{bill_number}.md")
-        with open(bill_filepath, 'r', encoding='utf-8') as b_f:
-            bill_md = b_f.read()
-        model_response = query_llm_with_retries(
+def is_oversized(tokenizer, bill_md, max_bill_tokens):
+    return tokenizer is not None and bool(max_bill_tokens) and count_tokens(tokenizer, bill_md) > max_bill_tokens
+
+
+def merge_answers(part_answers):
+    """
+    Combines answers from the parts of a bill without an LLM: summaries and parties are
+    joined, years widened, funding summed and the highest scores (with their summaries) kept.
+    """
+    def unique(values):
+        return list(dict.fromkeys(value for value in values if value))
+
+    def optional(values, combine):
+        values = [value for value in values if value is not None]
+        return combine(values) if values else None
+
+    most_innovative = max(part_answers, key=lambda answers: answers['innovative_score'])
+    most_child_poverty = max(part_answers, key=lambda answers: answers['child_poverty_direct_score'])
+    return {
+        'bill_summary': ' '.join(unique(answers['bill_summary'] for answers in part_answers)),
+        'programmatic': any(answers['programmatic'] for answers in part_answers),
+        'program_start_year': optional([answers.get('program_start_year') for answers in part_answers], min),
+        'program_end_year': optional([answers.get('program_end_year') for answers in part_answers], max),
+        'funding': optional([answers.get('funding') for answers in part_answers], sum),
+        'responsible_party': '; '.join(unique(answers['responsible_party'] for answers in part_answers)),
+        'stakeholders': '; '.join(unique(answers['stakeholders'] for answers in part_answers)),
+        'innovative_summary': most_innovative['innovative_summary'],
+        'innovative_score': most_innovative['innovative_score'],
+        'child_poverty_direct_summary': most_child_poverty['child_poverty_direct_summary'],
+        'child_poverty_direct_score': most_child_poverty['child_poverty_direct_score'],
+    }
+
+
+def answer_chunked_bill(query, bill_md, tokenizer, max_bill_tokens, struck='drop'):
+    """
+    Map-reduce QA for a bill over max_bill_tokens: each structural chunk is answered with
+    CHUNK_SYSTEM_PROMPT, then the LLM combines the part answers with REDUCE_SYSTEM_PROMPT
+    (falling back to merge_answers if that fails). Returns None if any part fails.
+    """
+    chunks = chunk_bill(bill_md, tokenizer, max_bill_tokens, struck)
+    part_answers = []
+    for index, chunk in enumerate(chunks):
+        answers = query(CHUNK_SYSTEM_PROMPT, f"PART {index + 1} OF {len(chunks)}\n\n{chunk}")
+        if answers is None:
+            print(f"No valid answer for part {index + 1} of {len(chunks)}")
+            return None
+        part_answers.append(answers)
+    if len(part_answers) == 1:
+        return part_answers[0]
+    reduce_input = "\n\n".join(
+        f"PART {index + 1} OF {len(part_answers)}:\n{json.dumps(answers)}" for index, answers in enumerate(part_answers)
+    )
+    combined = query(REDUCE_SYSTEM_PROMPT, reduce_input)
+    if combined is None:
+        combined = merge_answers(part_answers)
+    return combined
+
+
+def answer_bill(client, bill_md, model_name, model_family, cache=None, tokenizer=None, max_bill_tokens=None, struck='drop', rate_limiter=None):
+    """
+    Answers the questions for one bill. Without a tokenizer, or for bills of at most
+    max_bill_tokens tokens, the whole bill is sent in one request; longer bills are
+    answered in parts by answer_chunked_bill.
+    """
+    def query(system_prompt, content):
+        return query_llm_with_retries(
             client=client,
-            prompt=SYSTEM_PROMPT,
-            value=bill_md,
+            prompt=system_prompt,
+            value=content,
             response_format=AnswersToQuestions,
             model_name=model_name,
             max_retries=3,
-            model_family=model_family
+            model_family=model_family,
+            rate_limiter=rate_limiter,
+            estimated_tokens=estimate_tokens(system_prompt, content, tokenizer=tokenizer),
+            cache=cache,
+            validation_model=ValidatedAnswers,
+            tokenizer=tokenizer
+        )
+
+    if is_oversized(tokenizer, bill_md, max_bill_tokens):
+        return answer_chunked_bill(query, bill_md, tokenizer, max_bill_tokens, struck)
+    return query(SYSTEM_PROMPT, bill_md)
+
+
+def answer_bills_in_batch(client, bill_numbers, bill_mds, model_name, model_family, work_dir, cache=None, poll_seconds=BATCH_POLL_SECONDS):
+    """
+    Answers every bill through the provider's batch API instead of one request per bill.
+    Bills already in the cache are not submitted. Results are repaired and validated like
+    online answers, with any follow-up for invalid fields sent as a single request.
+
+    Returns:
+        The parsed answers (None for failed bills), in the order of bill_numbers.
+    """
+    answers = dict()
+    cache_keys = dict()
+    requests = []
+    for bill_number, bill_md in zip(bill_numbers, bill_mds):
+        if cache is not None:
+            cache_keys[bill_number] = cache.key(model_family, model_name, SYSTEM_PROMPT, AnswersToQuestions, bill_md)
+            cached_answers = cache.get(cache_keys[bill_number])
+            if cached_answers is not None:
+                answers[bill_number], errors, _ = validate_answers(cached_answers, ValidatedAnswers)
+                if not errors:
+                    continue
+        requests.append((bill_number, SYSTEM_PROMPT, bill_md, AnswersToQuestions))
+    print(f"{len(bill_numbers) - len(requests)} answers from the cache, {len(requests)} submitted in batch.")
+    if requests:
+        results = run_batch(client, model_family, model_name, requests, work_dir, 'leg_qa', poll_seconds)
+        for bill_number, text in results.items():
+            if text is None:
+                answers[bill_number] = None
+                continue
+            try:
+                answers[bill_number] = validated_response(
+                    client, SYSTEM_PROMPT, text, AnswersToQuestions, ValidatedAnswers, model_name, model_family
+                )
+            except Exception as e:
+                print(f"Invalid answer for {bill_number}: {e}")
+                answers[bill_number] = None
+            if cache is not None and answers[bill_number] is not None:
+                cache.put(cache_keys[bill_number], answers[bill_number], model_family, model_name)
+    return [answers.get(bill_number) for bill_number in bill_numbers]
+
+
+class QAJournal:
+    """
+    Append-only JSONL journal of QA results, one line per finished bill with its 'key' (bill
+    number), 'status' ('done' or 'failed'), 'run' (model and prompt identity) and answers.
+    Only the status and byte offset of each bill's latest line are held in memory; answers
+    are read back from disk when the CSV is assembled.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.latest = dict()
+        if not os.path.exists(path):
+            return
+        offset = 0
+        with open(path, 'rb') as journal_file:
+            for line in journal_file:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    entry = None
+                if entry is not None:
+                    self.latest[entry['key']] = (entry['status'], entry.get('run'), offset)
+                offset += len(line)
+        # Drop a torn final line from an interrupted write so the next append starts cleanly
+        if offset < os.path.getsize(path):
+            with open(path, 'r+b') as journal_file:
+                journal_file.truncate(offset)
+
+    def status(self, bill_number, run):
+        """'done' or 'failed' for a bill's latest entry from this run, or None if it has none."""
+        entry = self.latest.get(bill_number)
+        if entry is None or entry[1] != run:
+            return None
+        return entry[0]
+
+    def record(self, bill_number, status, run, **data):
+        line = (json.dumps(dict(key=bill_number, status=status, run=run, **data)) + '\n').encode('utf-8')
+        with open(self.path, 'ab') as journal_file:
+            offset = journal_file.tell()
+            journal_file.write(line)
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        self.latest[bill_number] = (status, run, offset)
+
+    def read(self, bill_number):
+        """The latest journal entry for a bill, or None."""
+        if bill_number not in self.latest:
+            return None
+        with open(self.path, 'rb') as journal_file:
+            journal_file.seek(self.latest[bill_number][2])
+            return json.loads(journal_file.readline())
+
+    def clear(self, bill_numbers=None):
+        """
+        Forgets every bill's entries, or only those of bill_numbers, rewriting the journal
+        without their lines so that the other bills' answers are kept.
+        """
+        if bill_numbers is None:
+            self.latest = dict()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        forgotten = set(bill_numbers) & set(self.latest)
+        if not forgotten:
+            return
+        latest = dict()
+        offset = 0
+        with open(self.path, 'rb') as journal_file, atomic_open(self.path, 'wb') as kept_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if entry['key'] in forgotten:
+                    continue
+                kept_file.write(line)
+                latest[entry['key']] = (entry['status'], entry.get('run'), offset)
+                offset += len(line)
+        self.latest = latest
+
+
+def answer_dtypes():
+    """
+    Column dtypes that keep the CSV format stable whichever bills failed: optional answers
+    are floats (as pandas writes a column with missing values), required ints and bools are
+    nullable so a failed bill's empty row does not turn them into floats.
+    """
+    dtypes = dict()
+    for name, field in AnswersToQuestions.model_fields.items():
+        if not field.is_required():
+            dtypes[name] = 'float64'
+        elif field.annotation is bool:
+            dtypes[name] = 'boolean'
+        elif field.annotation is int:
+            dtypes[name] = 'Int64'
+    return dtypes
+
+
+def answers_frame(answers):
+    """
+    A DataFrame of answer dicts with answer_dtypes() columns. Values that do not fit a
+    column's type (e.g. a score of 7.5 or "high" in an answer journaled before validation)
+    are left empty rather than failing the whole CSV.
+    """
+    response_df = pd.DataFrame.from_records(answers, columns=list(AnswersToQuestions.model_fields))
+    for name, dtype in answer_dtypes().items():
+        if dtype == 'boolean':
+            response_df[name] = response_df[name].map(lambda value: value if isinstance(value, bool) else None)
+        else:
+            values = pd.to_numeric(response_df[name], errors='coerce')
+            if dtype == 'Int64':
+                values = values.where(values == values.round())
+            response_df[name] = values
+    return response_df.astype(answer_dtypes())
+
+
+def responses_csv_path(csv_dir, prefilter=None):
+    """
+    legislation_model_responses.csv, or for a --prefilter run that only answers some bills,
+    legislation_model_responses_prefilter_<query slug>.csv beside it.
+    """
+    if not prefilter:
+        return os.path.join(csv_dir, 'legislation_model_responses.csv')
+    slug = re.sub(r'[^a-z0-9]+', '_', prefilter.lower()).strip('_')
+    return os.path.join(csv_dir, f'legislation_model_responses_prefilter_{slug}.csv')
+
+
+def write_responses_csv(data, journal, run, output_filepath, chunk_size=100):
+    """
+    Streams legislation_model_responses.csv from the journal in chunks of bills, in the order
+    of data. Bills without a successful answer from this run get empty answer columns.
+    """
+    with atomic_open(output_filepath) as csv_file:
+        for start in range(0, len(data), chunk_size):
+            chunk = data.iloc[start:start + chunk_size].reset_index(drop=True)
+            answers = []
+            for bill_number in chunk['BillNumber'].values.tolist():
+                entry = journal.read(bill_number) if journal.status(bill_number, run) == 'done' else None
+                answers.append(entry['answers'] if entry is not None else dict())
+            response_df = answers_frame(answers)
+            combined_df = pd.concat([chunk, response_df], axis=1)
+            combined_df.to_csv(csv_file, index=False, header=start == 0)
+
+
+def main(args):
+    load_dotenv()
+    model_family = args.model_family.lower()
+    # Set default model names if not provided
+    if args.model is None:
+        model_name = default_model_name(model_family)
+    else:
+        model_name = args.model
+
+    client = make_client(model_family, model_name)
+    if client is None:
+        return
+
+    csv_dir = os.path.abspath(f'data/{args.session_year}rs/csv')
+    md_dir = os.path.abspath(f'data/{args.session_year}rs/md')
+    conn = corpus_store.connect() if args.from_store else None
+    if args.from_store:
+        bills = corpus_store.load_bills(conn, [args.session_year])
+        data = pd.DataFrame({
+            'YearAndSession': bills['year_and_session'],
+            'BillNumber': bills['bill_number'],
+            'Title': bills['title'],
+            'Synopsis': bills['synopsis'],
+        })
+    else:
+        csv_filepath = os.path.join(csv_dir, "legislation.csv")
+        data = pd.read_csv(csv_filepath)
+        data = data[['YearAndSession', 'BillNumber', 'Title', 'Synopsis']]
+    if args.prefilter:
+        # Only the bills whose text is closest to the query go to the LLM
+        candidates = EmbeddingIndex.load(args.embedding_index_dir).candidate_bills(args.prefilter, args.prefilter_top, [args.session_year])
+        data = data[data['BillNumber'].isin(candidates['bill_number'])].reset_index(drop=True)
+        print(f"Pre-filtered to {len(data)} bills most similar to {args.prefilter!r}.")
+    bill_numbers = data['BillNumber'].values.tolist()
+
+    journal = QAJournal(os.path.join(os.path.dirname(csv_dir), 'qa_journal.jsonl'))
+    run = f"{model_family}:{model_name}:{sha256_bytes(SYSTEM_PROMPT.encode('utf-8'))[:12]}"
+    if args.retry_failed:
+        pending = [bill_number for bill_number in bill_numbers if journal.status(bill_number, run) == 'failed']
+    elif args.resume:
+        pending = [bill_number for bill_number in bill_numbers if journal.status(bill_number, run) != 'done']
+    elif args.prefilter:
+        # Only the candidates are answered again; the other bills keep their journal entries
+        journal.clear(bill_numbers)
+        pending = bill_numbers
+    else:
+        journal.clear()
+        pending = bill_numbers
+    print(f"Querying {len(pending)} of {len(bill_numbers)} bills.")
+
+    bill_mds = []
+    for bill_number in pending:
+        if args.from_store:
+            bill_md = corpus_store.bill_markdown(conn, args.session_year, bill_number)
+        else:
+            bill_filepath = bill_markdown_path(md_dir, bill_number)
+            with open(bill_filepath, 'r', encoding='utf-8') as b_f:
+                bill_md = b_f.read()
+        bill_mds.append(bill_md)
+
+    def save_answer(index, model_response):
+        if model_response is None:
+            journal.record(pending[index], 'failed', run, error='No valid response after retries')
+        else:
+            journal.record(pending[index], 'done', run, answers=model_response)
+        if args.from_store:
+            corpus_store.save_qa(conn, args.session_year, pending[index], model_response)
+
+    cache = None if args.no_cache else LLMCache(args.cache_dir, read_only=args.cache_read_only)
+    max_bill_tokens = args.max_bill_tokens if args.max_bill_tokens is not None else DEFAULT_MAX_BILL_TOKENS[model_family]
+    budget = budget_for(model_family, args.rpm, args.tpm)
+    # The tokenizer splits oversized bills and counts request tokens against the budget
+    tokenizer = load_tokenizer() if max_bill_tokens or budget.tokens is not None else None
+    workers = args.workers or (1 if model_family == 'ollama' else DEFAULT_WORKERS)
+    executor = LLMExecutor(
+        client, model_name, model_family, workers=workers, budget=budget, cache=cache, tokenizer=tokenizer
+    )
+
+    def answer(index):
+        return answer_bill(
+            client, bill_mds[index], model_name, model_family, cache=cache, tokenizer=tokenizer,
+            max_bill_tokens=max_bill_tokens, struck=args.struck, rate_limiter=executor.budget
         )
-        model_responses.append(model_response)
 
-    response_df = pd.DataFrame.from_records(model_responses)
-    combined_df = pd.concat([data.reset_index(drop=True), response_df.reset_index(drop=True)], axis=1)
-    output_filepath = os.path.join(csv_dir, "legislation_model_responses.csv")
-    combined_df.to_csv(output_filepath, index=False, encoding='utf-8')
+    indices = list(range(len(pending)))
+    oversized = {index for index in indices if is_oversized(tokenizer, bill_mds[index], max_bill_tokens)}
+    if oversized:
+        print(f"{len(oversized)} bills are over {max_bill_tokens} tokens and will be answered in parts.")
+    if args.batch:
+        # Chunked bills need their part answers before the combining request, so only
+        # bills that fit one request go in the batch; the rest are answered directly after it
+        batch_indices = [index for index in indices if index not in oversized]
+        work_dir = os.path.join(os.path.dirname(csv_dir), 'batch')
+        model_responses = answer_bills_in_batch(
+            client, [pending[index] for index in batch_indices], [bill_mds[index] for index in batch_indices],
+            model_name, model_family, work_dir, cache=cache, poll_seconds=args.batch_poll_seconds
+        )
+        for index, model_response in zip(batch_indices, model_responses):
+            save_answer(index, model_response)
+        indices = sorted(oversized)
+    if indices:
+        # Start the longest bills first so they do not hold up the end of the run
+        indices.sort(key=lambda index: len(bill_mds[index]), reverse=True)
+        executor.run(answer, indices, on_result=lambda position, model_response: save_answer(indices[position], model_response))
+        print(f"Rate limit budget: {executor.budget.stats}")
+    if cache is not None:
+        print(f"LLM cache: {cache.stats}")
+
+    output_filepath = responses_csv_path(csv_dir, args.prefilter)
+    write_responses_csv(data, journal, run, output_filepath)
     print(f"Saved model responses to {output_filepath}")
+    failed = [bill_number for bill_number in bill_numbers if journal.status(bill_number, run) != 'done']
+    if failed:
+        print(f"{len(failed)} bills have no answers: {', '.join(failed)}")
+        print("Re-run with --retry-failed (or --resume after an interruption) to query only those bills.")
+    if args.metrics:
+        METRICS.write(args.metrics)
+        print(f"Saved metrics to {args.metrics}")
         
 
-if __name__ == '__main__':
+def build_parser():
     parser = argparse.ArgumentParser(
         prog='Legislative scan question answerer',
         description='A program to answer questions about legislation')
     parser.add_argument('--model-family', default='gemini', choices=['gpt', 'gemini', 'ollama'], help='The LLM backend family to use')
     parser.add_argument('--model', default=None, help='The model name to use (e.g., gpt-4.1-nano, gemini-2.5-flash, llama3, etc.)')
+    parser.add_argument('--from-store', action='store_true', help='Read bills from the corpus store and save answers back to it')
+    parser.add_argument('--workers', type=int, default=None, help=f'Concurrent LLM requests (default: {DEFAULT_WORKERS}, or 1 for ollama)')
+    parser.add_argument('--rpm', type=int, default=None, help='Requests per minute budget (default: the model family\'s tier 1 limit)')
+    parser.add_argument('--tpm', type=int, default=None, help='Tokens per minute budget (default: the model family\'s tier 1 limit)')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='Directory of the LLM response cache')
+    parser.add_argument('--cache-read-only', action='store_true', help='Use cached responses but do not store new ones')
+    parser.add_argument('--no-cache', action='store_true', help='Query the LLM for every bill, ignoring the cache')
+    parser.add_argument('--resume', action='store_true', help='Only query bills without a successful answer in the QA journal')
+    parser.add_argument('--retry-failed', action='store_true', help='Only query bills whose latest QA journal entry failed')
+    parser.add_argument('--batch', action='store_true', help='Submit all bills through the provider batch API (gpt or gemini) and wait for the results')
+    parser.add_argument('--batch-poll-seconds', type=float, default=BATCH_POLL_SECONDS, help='Seconds between batch job status checks')
+    parser.add_argument('--max-bill-tokens', type=int, default=None, help='Answer bills over this many tokens in parts (default: 100000, or 12000 for ollama; 0 never splits bills)')
+    parser.add_argument('--struck', default='drop', choices=STRUCK_MODES, help='How struck text is handled in bills answered in parts: drop it, compress each run to ~~…~~, or keep it')
+    parser.add_argument('--metrics', default=None, help='Write LLM latency, retry, token and cache counters to this JSON (or .prom Prometheus textfile) path')
+    parser.add_argument('--prefilter', default=None, help='Only query the bills most similar to this text in the embedding index, e.g. "child poverty"')
+    parser.add_argument('--prefilter-top', type=int, default=100, help='Number of bills kept by --prefilter')
+    parser.add_argument('--embedding-index-dir', default=DEFAULT_EMBEDDING_INDEX_DIR, help='Directory of the embedding index used by --prefilter')
     parser.add_argument('session_year', type=int, help='The regular session year')
+    return parser
+
+
+if __name__ == '__main__':
+    parser = build_parser()
     args = parser.parse_args()
+    if args.batch and args.model_family == 'ollama':
+        parser.error('--batch requires --model-family gpt or gemini')
     main(args)
\ No newline at end of file
@@ -1,21 +1,60 @@
 import os
+import time
 import argparse
 from glob import glob
-import PyPDF2
-from PyPDF2 import PdfReader
+import pymupdf
 from tqdm import tqdm
+from file_utils import atomic_open
+from leg_to_md import words_to_markdown
+from metrics import METRICS
 
-def pdf_full_text(pdf_path):
-    pdf_reader = PdfReader(pdf_path)
-    text_list = list()
+
+def words_text(words):
+    """
+    The basic text of a page's PyMuPDF words: the markdown line layout, struck words
+    included but without strikethrough markers.
+    """
+    return words_to_markdown(words, set()) if words else ""
+
+
+def page_text(page):
+    """The basic text of one PyMuPDF page."""
+    return words_text(page.get_text("words"))
+
+
+def iter_pdf_text_pages(pdf_path):
+    """
+    Yields the extracted text of each page of a PDF one page at a time.
+    """
+    with pymupdf.open(pdf_path) as doc:
+        for page in doc:
+            yield page_text(page)
+
+
+def write_pdf_text(pdf_path, destination_file_path):
+    """
+    Streams a PDF's text to destination_file_path page by page, written under a temporary
+    name and renamed into place when complete.
+
+    Returns:
+        The number of pages written.
+    """
     page_count = 0
-    for page in pdf_reader.pages:
-        text_list.append(page.extract_text())
-        page_count += 1
-    return page_count, '\n'.join(text_list).replace('\x00','')
+    with atomic_open(destination_file_path) as destination_file:
+        for page_text in iter_pdf_text_pages(pdf_path):
+            if page_count:
+                destination_file.write('\n')
+            destination_file.write(page_text)
+            page_count += 1
+    return page_count
+
+
+def pdf_full_text(pdf_path):
+    text_list = list(iter_pdf_text_pages(pdf_path))
+    return len(text_list), '\n'.join(text_list)
 
 
-def main(session_year):
+def main(session_year, metrics_path=None):
     full_page_count = 0
     input_dir = os.path.abspath(f'data/{session_year}rs/pdf')
     output_dir = os.path.abspath(f'data/{session_year}rs/basic_txt')
@@ -27,18 +66,31 @@ def main(session_year):
         file_name, _ = os.path.splitext(file_basename)
         destination_basename = '{}.txt'.format(file_name)
         destination_file_path = os.path.join(output_dir, destination_basename)
+        start = time.perf_counter()
         try:
-            pdf_page_count, full_text = pdf_full_text(pdf_file)
-            full_page_count += pdf_page_count
-        except PyPDF2.errors.PdfReadError:
+            if os.path.exists(destination_file_path):
+                # Only the page count is needed, so skip text extraction
+                with pymupdf.open(pdf_file) as doc:
+                    page_count = doc.page_count
+                phase = 'count'
+            else:
+                page_count = write_pdf_text(pdf_file, destination_file_path)
+                phase = 'parse_write'
+        except pymupdf.FileDataError:
             print("Corrupted PDF: {}".format(file_basename))
-        if not os.path.exists(destination_file_path):
-            with open(destination_file_path, 'w', encoding='utf-8') as destination_file:
-                destination_file.write(full_text)
+            METRICS.count('basic_txt_failures')
+            continue
+        full_page_count += page_count
+        METRICS.record_document('basic_txt', file_basename, {phase: time.perf_counter() - start})
+        METRICS.count('basic_txt_pages', page_count)
     print(f'Total page count: {full_page_count}')
+    if metrics_path is not None:
+        METRICS.write(metrics_path)
+        print(f'Saved metrics to {metrics_path}')
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Parse Maryland legislation into basic text for token count.')
     parser.add_argument('session_year', type=int, help='The regular session year')
+    parser.add_argument('--metrics', default=None, help='Write per-document timings and counters to this JSON (or .prom Prometheus textfile) path')
     args = parser.parse_args()
-    main(args.session_year)
\ No newline at end of file
+    main(args.session_year, metrics_path=args.metrics)
@@ -1,26 +1,33 @@
 import os
 import argparse
 from glob import glob
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm import tqdm
+import numpy as np
 import pymupdf
+from file_utils import atomic_open
 
 
-def get_struck_word_rects(page: pymupdf.Page, height_threshold: float = 1.5) -> set[pymupdf.Rect]:
+# Documents with more pages than this are split into page ranges across workers
+LARGE_DOCUMENT_PAGES = 40
+# Vertical distance (a bit more than typical line spacing) that starts a new line
+LINE_BREAK_THRESHOLD = 10
+
+
+def find_strike_line_rects(page: pymupdf.Page, height_threshold: float = 1.5) -> list[pymupdf.Rect]:
     """
-    Identifies the bounding boxes of words that intersect with potential
-    strikethrough drawings (thin, black, filled rectangles).
+    Finds potential strikethrough lines: thin, wide, black, filled rectangles.
 
     Args:
         page: The pymupdf.Page object to analyze.
         height_threshold: Max height for a drawing rect to be considered a strike line.
 
     Returns:
-        A set containing the pymupdf.Rect objects of words identified as struck through.
+        A list of pymupdf.Rect objects, one per candidate strike line.
     """
     strikethrough_line_rects = []
     drawings = page.get_drawings()
 
-    # 1. Filter drawings for potential strikethrough lines
     for drawing in drawings:
         if drawing.get("type") == "f" and drawing.get("fill") == (0.0, 0.0, 0.0):
             for item in drawing.get("items", []):
@@ -28,32 +35,120 @@ def get_struck_word_rects(page: pymupdf.Page, height_threshold: float = 1.5) ->
                     rect = pymupdf.Rect(item[1])
                     if 0 < rect.height < height_threshold and rect.width > rect.height * 2: # Check aspect ratio
                         strikethrough_line_rects.append(rect)
+    return strikethrough_line_rects
+
+
+def match_struck_words(words: list, strikethrough_line_rects: list[pymupdf.Rect]) -> set[pymupdf.Rect]:
+    """
+    Finds the words crossed by a strike line: the strike's vertical centre lies within a
+    quarter of the word height of the word's centre, and it covers more than half the
+    word's width (or more than 5 points of it).
+
+    Strike lines are indexed by vertical centre, so each word is only tested against the
+    strikes in its own y-band, and those tests run as NumPy array operations.
+
+    Args:
+        words: Output of page.get_text("words"), i.e. (x0, y0, x1, y1, word, ...) tuples.
+        strikethrough_line_rects: Candidate strike lines from find_strike_line_rects.
+
+    Returns:
+        A set containing the pymupdf.Rect objects of words identified as struck through.
+    """
+    if not words or not strikethrough_line_rects:
+        return set()
+
+    word_boxes = np.array([word_data[:4] for word_data in words], dtype=np.float64)
+    has_text = np.array([bool(word_data[4].strip()) for word_data in words])
+    word_x0, word_y0, word_x1, word_y1 = word_boxes.T
+    candidate_words = np.flatnonzero(has_text & (word_x0 < word_x1) & (word_y0 < word_y1))
+    if candidate_words.size == 0:
+        return set()
+
+    strike_boxes = np.array([tuple(rect) for rect in strikethrough_line_rects], dtype=np.float64)
+    strike_centers = strike_boxes[:, 1] + (strike_boxes[:, 3] - strike_boxes[:, 1]) / 2
+    strike_order = np.argsort(strike_centers, kind='stable')
+    sorted_strike_centers = strike_centers[strike_order]
+
+    word_heights = word_y1[candidate_words] - word_y0[candidate_words]
+    word_centers = word_y0[candidate_words] + word_heights / 2
+    # Band lookup with a little slack; the exact comparison below decides
+    band = word_heights / 4 + 1e-6
+    lower = np.searchsorted(sorted_strike_centers, word_centers - band, side='left')
+    upper = np.searchsorted(sorted_strike_centers, word_centers + band, side='right')
+    counts = upper - lower
+    if counts.sum() == 0:
+        return set()
+
+    # Expand the (word, strike) candidate pairs
+    pair_words = np.repeat(np.arange(candidate_words.size), counts)
+    pair_offsets = np.arange(pair_words.size) - np.repeat(np.cumsum(counts) - counts, counts)
+    pair_strikes = strike_order[np.repeat(lower, counts) + pair_offsets]
+    pair_word_boxes = word_boxes[candidate_words[pair_words]]
+    pair_strike_boxes = strike_boxes[pair_strikes]
+
+    # Rect intersection is computed by MuPDF in single precision, so mirror that here
+    intersection = np.concatenate([
+        np.maximum(pair_word_boxes[:, :2].astype(np.float32), pair_strike_boxes[:, :2].astype(np.float32)),
+        np.minimum(pair_word_boxes[:, 2:].astype(np.float32), pair_strike_boxes[:, 2:].astype(np.float32)),
+    ], axis=1).astype(np.float64)
+    intersects = (intersection[:, 0] < intersection[:, 2]) & (intersection[:, 1] < intersection[:, 3])
+    intersect_widths = intersection[:, 2] - intersection[:, 0]
+
+    pair_word_widths = pair_word_boxes[:, 2] - pair_word_boxes[:, 0]
+    aligned = np.abs(word_centers[pair_words] - strike_centers[pair_strikes]) < (word_heights[pair_words] / 4)
+    covered = (intersect_widths > pair_word_widths * 0.5) | (intersect_widths > 5)
+    struck_pairs = intersects & aligned & covered
+
+    struck_words = candidate_words[np.unique(pair_words[struck_pairs])]
+    return {pymupdf.Rect(words[index][:4]) for index in struck_words}
+
+
+def get_struck_word_rects(page: pymupdf.Page, height_threshold: float = 1.5) -> set[pymupdf.Rect]:
+    """
+    Identifies the bounding boxes of words that intersect with potential
+    strikethrough drawings (thin, black, filled rectangles).
+
+    Args:
+        page: The pymupdf.Page object to analyze.
+        height_threshold: Max height for a drawing rect to be considered a strike line.
 
-    # 2. Get words and their bounding boxes
+    Returns:
+        A set containing the pymupdf.Rect objects of words identified as struck through.
+    """
+    strikethrough_line_rects = find_strike_line_rects(page, height_threshold)
+    if not strikethrough_line_rects:
+        return set()
     words = page.get_text("words")  # List of (x0, y0, x1, y1, word, ...)
+    return match_struck_words(words, strikethrough_line_rects)
 
-    struck_word_bounding_boxes = set()
+def estimate_row_centers(y0s: np.ndarray) -> np.ndarray:
+    """
+    Clusters word y0 values into text rows. Sorted distinct y0 values closer than 3 points
+    to their predecessor belong to the same row, whose centre is the mean of its values.
 
-    # 3. Check for intersections
-    for word_data in words:
-        word_rect = pymupdf.Rect(word_data[:4])
-        word_text = word_data[4]
+    Returns:
+        A sorted array of row centre y-coordinates.
+    """
+    unique_y0s = np.unique(y0s)
+    break_indices = np.flatnonzero(np.diff(unique_y0s) >= 3) + 1
+    # Python's sum keeps the row means bit-for-bit identical to the original implementation
+    return np.array([
+        sum(row_group) / len(row_group)
+        for row_group in (group.tolist() for group in np.split(unique_y0s, break_indices))
+    ])
 
-        if word_rect.is_empty or not word_text.strip():
-            continue
 
-        for strike_rect in strikethrough_line_rects:
-            intersect_rect = word_rect & strike_rect
-            if not intersect_rect.is_empty:
-                 # Check vertical alignment and horizontal overlap
-                 word_v_center = word_rect.y0 + word_rect.height / 2
-                 strike_v_center = strike_rect.y0 + strike_rect.height / 2
-                 if (abs(word_v_center - strike_v_center) < (word_rect.height / 4)) and \
-                    (intersect_rect.width > word_rect.width * 0.5 or intersect_rect.width > 5):
-                     struck_word_bounding_boxes.add(word_rect)
-                     break # Word is struck, no need to check other lines
+def snap_to_rows(y0s: np.ndarray, row_centers: np.ndarray) -> np.ndarray:
+    """
+    Snaps each y0 to its nearest row centre (the lower centre on ties) with a binary search.
+    """
+    if len(row_centers) == 1:
+        return np.full_like(y0s, row_centers[0])
+    upper = np.clip(np.searchsorted(row_centers, y0s, side='left'), 1, len(row_centers) - 1)
+    lower = upper - 1
+    use_lower = np.abs(y0s - row_centers[lower]) <= np.abs(y0s - row_centers[upper])
+    return np.where(use_lower, row_centers[lower], row_centers[upper])
 
-    return struck_word_bounding_boxes
 
 def pdf_page_to_markdown(page: pymupdf.Page, include_struck: bool = True) -> str:
     """
@@ -67,136 +162,253 @@ def pdf_page_to_markdown(page: pymupdf.Page, include_struck: bool = True) -> str
     Returns:
         A string containing the Markdown representation of the page.
     """
-    struck_rects = get_struck_word_rects(page)
     words = page.get_text("words") # (x0, y0, x1, y1, word, block_no, line_no, word_no)
 
     if not words:
         return ""
 
+    strikethrough_line_rects = find_strike_line_rects(page)
+    struck_boxes = {tuple(rect) for rect in match_struck_words(words, strikethrough_line_rects)}
+    return words_to_markdown(words, struck_boxes, include_struck)
+
+
+def reading_order(words: list) -> tuple:
+    """
+    Orders extracted words for reading.
+
+    Returns:
+        (words, snapped_y0s, order): the words sorted by (y0, x0), each word's y0 snapped to
+        its text row, and the word indices in reading order (by snapped y0, then x0).
+    """
     # Sort words primarily by vertical position (y0), then horizontal (x0)
     # This helps approximate the reading order
-    words.sort(key=lambda w: (w[1], w[0]))
-    # Refine vertical alignment
-    if words:
-        # 1. Estimate distinct row y-coordinates by finding clusters
-        unique_y0s = sorted(list(set(w[1] for w in words)))
-        row_y_estimates = []
-        if unique_y0s:
-            current_row_group = [unique_y0s[0]]
-            for y in unique_y0s[1:]:
-                # Group y-coordinates that are close together (e.g., within 3 points)
-                if y - current_row_group[-1] < 3:
-                    current_row_group.append(y)
-                else:
-                    # Calculate the average y for the completed group
-                    row_y_estimates.append(sum(current_row_group) / len(current_row_group))
-                    current_row_group = [y]
-            # Add the last group
-            row_y_estimates.append(sum(current_row_group) / len(current_row_group))
-
-        # Ensure row_y_estimates is not empty if unique_y0s was not
-        if not row_y_estimates and unique_y0s:
-             row_y_estimates.append(unique_y0s[0])
-
-
-        # 2. Snap each word's y0 to the nearest estimated row center
-        snapped_words_data = []
-        for word_data in words:
-            original_y0 = word_data[1]
-            # Find the closest row y-coordinate estimate
-            if row_y_estimates:
-                closest_row_y = min(row_y_estimates, key=lambda row_y: abs(original_y0 - row_y))
-                # Create a new list for the word data with the snapped y0
-                # Keep original y1 for bounding box purposes if needed elsewhere,
-                # but use snapped y0 for sorting and line breaking.
-                snapped_data = list(word_data)
-                snapped_data[1] = closest_row_y # Update y0
-                snapped_words_data.append(snapped_data)
-            else:
-                # Should not happen if words list is not empty, but handle defensively
-                 snapped_words_data.append(list(word_data))
+    words = sorted(words, key=lambda w: (w[1], w[0]))
 
+    # Refine vertical alignment: snap each word's y0 to the nearest estimated row
+    # center, then resort on snapped y0, then original x0
+    y0s = np.array([word_data[1] for word_data in words], dtype=np.float64)
+    snapped_y0s = snap_to_rows(y0s, estimate_row_centers(y0s)).tolist()
+    order = sorted(range(len(words)), key=lambda i: (snapped_y0s[i], words[i][0]))
+    return words, snapped_y0s, order
 
-        # 3. Resort words based on snapped y0, then original x0
-        snapped_words_data.sort(key=lambda w: (w[1], w[0]))
-        words = snapped_words_data # Use the list with snapped y0 values
 
-    markdown_output = []
-    current_line = ""
-    last_y0 = words[0][1] # Y-coordinate of the first word
-    last_x1 = words[0][0] # X-coordinate to track horizontal spacing
+def words_to_markdown(words: list, struck_boxes: set, include_struck: bool = True) -> str:
+    """
+    Lays out extracted words as lines of Markdown text.
 
-    # Define a threshold for detecting line breaks (adjust as needed)
-    # A bit more than typical line spacing
-    line_break_threshold = 10
+    Args:
+        words: Output of page.get_text("words"); must not be empty.
+        struck_boxes: (x0, y0, x1, y1) tuples of struck words, as matched by match_struck_words.
+        include_struck: If True, include struck text wrapped in '~~'.
+                        If False, omit struck text.
 
-    for i, word_data in enumerate(words):
-        x0, y0, x1, y1, word_text, _, _, _ = word_data
-        word_rect = pymupdf.Rect(x0, y0, x1, y1)
+    Returns:
+        A string containing the Markdown representation of the words.
+    """
+    words, snapped_y0s, order = reading_order(words)
+
+    markdown_output = []
+    line_parts = []
+    line_has_text = False
+    last_y0 = snapped_y0s[order[0]] # Y-coordinate of the first word
+    last_x1 = words[order[0]][0] # X-coordinate to track horizontal spacing
+
+    for i in order:
+        x0, _, x1, y1, word_text = words[i][:5]
+        y0 = snapped_y0s[i]
 
         # Check for line break based on vertical distance
-        if y0 > last_y0 + line_break_threshold:
-            markdown_output.append(current_line.strip())
-            current_line = ""
+        if y0 > last_y0 + LINE_BREAK_THRESHOLD:
+            markdown_output.append("".join(line_parts).strip())
+            line_parts = []
+            line_has_text = False
             # Add extra newline for larger gaps (potential paragraph break)
-            if y0 > last_y0 + line_break_threshold * 2:
+            if y0 > last_y0 + LINE_BREAK_THRESHOLD * 2:
                  markdown_output.append("") # Add blank line
             last_x1 = x0 # Reset horizontal position for new line
 
         # Add space if it's not the start of a line and there's a gap
-        if current_line and x0 > last_x1 + 2: # Add space if gap > 2 points
-             current_line += " "
-
-        is_struck = word_rect in struck_rects
+        if line_has_text and x0 > last_x1 + 2: # Add space if gap > 2 points
+             line_parts.append(" ")
 
-        if is_struck:
+        # Struck boxes are matched on the snapped y0, as the word rects always have been
+        if (x0, y0, x1, y1) in struck_boxes:
             if include_struck:
-                current_line += f"~~{word_text}~~"
-            else:
-                # Omit the word - effectively adds nothing to current_line
-                pass
-        else:
-            current_line += word_text
+                line_parts.append(f"~~{word_text}~~")
+                line_has_text = True
+        elif word_text:
+            line_parts.append(word_text)
+            line_has_text = True
 
         last_y0 = y0
         last_x1 = x1 # Update the end position of the last added word/strikeout
 
-        # Handle the last word/line
-        if i == len(words) - 1:
-            markdown_output.append(current_line.strip())
-
+    # Handle the last line
+    markdown_output.append("".join(line_parts).strip())
 
     return "\n".join(markdown_output)
 
 
+def iter_pdf_pages(pdf_file, start=0, stop=None):
+    """
+    Yields the marked-up markdown of pages [start, stop) of a PDF one page at a time, so
+    callers never hold more than one page in memory.
+    """
+    with pymupdf.open(pdf_file) as doc:
+        stop = doc.page_count if stop is None else min(stop, doc.page_count)
+        for index in range(start, stop):
+            yield f'START OF PAGE {index + 1}\n{pdf_page_to_markdown(doc[index])}\nEND OF PAGE {index + 1}'
+
+
+def write_pages(page_texts, destination_file_path):
+    """
+    Streams page texts to a markdown file, separated by blank lines. The file is written
+    under a temporary name and renamed into place when complete.
+
+    Returns:
+        The number of pages written.
+    """
+    page_count = 0
+    with atomic_open(destination_file_path) as destination_file:
+        for page_text in page_texts:
+            if page_count:
+                destination_file.write("\n\n")
+            destination_file.write(page_text)
+            page_count += 1
+    return page_count
+
+
+def write_pdf_markdown(pdf_file, destination_file_path):
+    return write_pages(iter_pdf_pages(pdf_file), destination_file_path)
+
+
+def iter_markdown_file_pages(md_file):
+    """
+    Streams an existing leg_to_md output file back one page at a time, yielding
+    (page_number, page_markdown) without the START/END OF PAGE marker lines.
+    """
+    page_number = None
+    page_lines = []
+    with open(md_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if page_number is None:
+                if line.startswith('START OF PAGE '):
+                    page_number = int(line[len('START OF PAGE '):])
+                    page_lines = []
+            elif line == f'END OF PAGE {page_number}':
+                yield page_number, '\n'.join(page_lines)
+                page_number = None
+            else:
+                page_lines.append(line)
+
+
+def pdf_page_range_text(pdf_file, start, stop):
+    """
+    Converts pages [start, stop) of a PDF, returning one marked-up string per page.
+    """
+    return list(iter_pdf_pages(pdf_file, start, stop))
+
+
 def pdf_text(pdf_file):
-    page_texts = list()
-    doc = pymupdf.open(pdf_file) # open a document
-    for index, page in enumerate(doc):
-        page_text = f'START OF PAGE {index + 1}\n{pdf_page_to_markdown(page)}\nEND OF PAGE {index + 1}'
-        page_texts.append(page_text)
-    return "\n\n".join(page_texts)
+    return "\n\n".join(iter_pdf_pages(pdf_file))
+
+
+def limit_worker_memory(max_memory_mb):
+    """
+    Process pool initializer capping each worker's address space, so one pathological
+    PDF fails with MemoryError instead of exhausting the machine. Not supported on Windows.
+    """
+    try:
+        import resource
+    except ImportError:
+        return
+    limit = max_memory_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
 
 
-def main(session_year):
+def plan_conversion_tasks(pdf_files, workers, large_document_pages):
+    """
+    Splits the work into (pdf_file, start, stop) page ranges. Documents longer than
+    large_document_pages are cut into ranges so one huge bill can use several workers.
+    """
+    tasks = []
+    for pdf_file in pdf_files:
+        with pymupdf.open(pdf_file) as doc:
+            page_count = doc.page_count
+        if page_count > large_document_pages:
+            chunk_size = max(large_document_pages // 2, -(-page_count // workers))
+            for start in range(0, page_count, chunk_size):
+                tasks.append((pdf_file, start, min(start + chunk_size, page_count)))
+        else:
+            tasks.append((pdf_file, 0, page_count))
+    return tasks
+
+
+def convert_pdfs(pdf_files, output_dir, workers=1, max_memory_mb=None, large_document_pages=LARGE_DOCUMENT_PAGES):
+    """
+    Converts PDFs to markdown files in output_dir, in a process pool when workers > 1.
+    Page ranges are reassembled in page order, so the output is identical to the serial path.
+
+    Returns:
+        The total number of pages converted.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    pdf_files = sorted(pdf_files)
+
+    def destination_path(pdf_file):
+        file_name, _ = os.path.splitext(os.path.basename(pdf_file))
+        return os.path.join(output_dir, '{}.md'.format(file_name))
+
+    if workers <= 1:
+        total_page_count = 0
+        for pdf_file in tqdm(pdf_files):
+            total_page_count += write_pdf_markdown(pdf_file, destination_path(pdf_file))
+        return total_page_count
+
+    tasks = plan_conversion_tasks(pdf_files, workers, large_document_pages)
+    remaining_ranges = dict()
+    for pdf_file, _, _ in tasks:
+        remaining_ranges[pdf_file] = remaining_ranges.get(pdf_file, 0) + 1
+    finished_ranges = {pdf_file: dict() for pdf_file in pdf_files}
+    total_page_count = 0
+    initializer = limit_worker_memory if max_memory_mb else None
+    initargs = (max_memory_mb,) if max_memory_mb else ()
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+        futures = {executor.submit(pdf_page_range_text, *task): task for task in tasks}
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            pdf_file, start, _ = futures[future]
+            try:
+                page_texts = future.result()
+                if finished_ranges[pdf_file] is not None:
+                    finished_ranges[pdf_file][start] = page_texts
+            except MemoryError:
+                print("Worker memory limit exceeded converting {}".format(os.path.basename(pdf_file)))
+                finished_ranges[pdf_file] = None
+            remaining_ranges[pdf_file] -= 1
+            if remaining_ranges[pdf_file] == 0 and finished_ranges[pdf_file] is not None:
+                page_texts = (
+                    page_text
+                    for range_start in sorted(finished_ranges[pdf_file])
+                    for page_text in finished_ranges[pdf_file][range_start]
+                )
+                total_page_count += write_pages(page_texts, destination_path(pdf_file))
+                del finished_ranges[pdf_file]
+    return total_page_count
+
+
+def main(session_year, workers=1, max_memory_mb=None):
     input_dir = os.path.abspath(f'data/{session_year}rs/pdf')
     output_dir = os.path.abspath(f'data/{session_year}rs/md')
-    os.makedirs(output_dir, exist_ok=True)
     pdf_wildcard = os.path.join(input_dir, '*.pdf')
     pdf_files = glob(pdf_wildcard)
-    for pdf_file in tqdm(pdf_files):
-        file_basename = os.path.basename(pdf_file)
-        file_name, _ = os.path.splitext(file_basename)
-        destination_basename = '{}.md'.format(file_name)
-        destination_file_path = os.path.join(output_dir, destination_basename)
-        # if not os.path.exists(destination_file_path):
-        full_text = pdf_text(pdf_file)
-        with open(destination_file_path, 'w', encoding='utf-8') as destination_file:
-            destination_file.write(full_text)
+    convert_pdfs(pdf_files, output_dir, workers=workers, max_memory_mb=max_memory_mb)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Parse Maryland legislation into markdown.')
     parser.add_argument('session_year', type=int, help='The regular session year')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Number of worker processes (1 converts serially)')
+    parser.add_argument('--max-memory-mb', type=int, default=None, help='Address-space limit for each worker process, in MB')
     args = parser.parse_args()
 
-    main(args.session_year)
\ No newline at end of file
+    main(args.session_year, workers=args.workers, max_memory_mb=args.max_memory_mb)
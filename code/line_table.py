@@ -0,0 +1,291 @@
+# Line-addressed table of a bill's printed lines.
+# Built from the same word pass and row layout as the markdown, it keeps what the markdown
+# drops: each line's printed margin line number, its position on the page, and its words as
+# character spans with strike flags. Everything is held in flat NumPy arrays (CSR-style
+# offsets from pages to rows and from rows to spans) and saved as one compressed .npz per
+# document, with a dense per-page index so "page N, line M" resolves in O(1).
+
+import os
+import argparse
+import numpy as np
+import pymupdf
+from file_utils import atomic_open
+from leg_to_md import find_strike_line_rects, match_struck_words, reading_order, LINE_BREAK_THRESHOLD
+
+
+MAX_MARGIN_NUMBER = 99
+# Margin numbers line up in one column, left- or right-aligned, to within this many points
+MARGIN_COLUMN_TOLERANCE = 3
+# A page is numbered when at least this share of its rows carry a margin number
+MIN_NUMBERED_ROW_SHARE = 0.5
+
+
+def line_table_path(session_dir, file_name):
+    return os.path.join(session_dir, 'lines', f'{file_name}.npz')
+
+
+def load_line_table(session_dir, file_name):
+    """The saved line table of file_name.pdf in session_dir, or None if it has not been extracted."""
+    path = line_table_path(session_dir, file_name)
+    return LineTable.load(path) if os.path.exists(path) else None
+
+
+def words_to_rows(words, struck_boxes):
+    """
+    Groups a page's words into rows, breaking lines exactly where words_to_markdown does.
+
+    Returns:
+        A list of rows, each a list of (x0, x1, y0, text, struck) words in reading order.
+    """
+    if not words:
+        return []
+    words, snapped_y0s, order = reading_order(words)
+    rows = []
+    current = []
+    last_y0 = snapped_y0s[order[0]]
+    for i in order:
+        x0, _, x1, y1, word_text = words[i][:5]
+        y0 = snapped_y0s[i]
+        if y0 > last_y0 + LINE_BREAK_THRESHOLD and current:
+            rows.append(current)
+            current = []
+        if word_text:
+            current.append((x0, x1, y0, word_text, (x0, y0, x1, y1) in struck_boxes))
+        last_y0 = y0
+    if current:
+        rows.append(current)
+    return rows
+
+
+def margin_numbers(rows):
+    """
+    Finds the printed margin line numbers of a page's rows: a leading 1-2 digit word in one
+    column, increasing down the page, on most rows of the page. The column may be
+    left-aligned (1-9 start where 10+ do) or right-aligned (1-9 end where 10+ do).
+
+    Returns:
+        A list with each row's line number, or 0 for rows without one.
+    """
+    candidates = [
+        (index, int(row[0][3]), row[0][0], row[0][1]) for index, row in enumerate(rows)
+        if len(row) > 1 and row[0][3].isdigit() and 0 < int(row[0][3]) <= MAX_MARGIN_NUMBER and not row[0][4]
+    ]
+    numbers = [0] * len(rows)
+    if not candidates:
+        return numbers
+    column_x0 = float(np.median([x0 for _, _, x0, _ in candidates]))
+    column_x1 = float(np.median([x1 for _, _, _, x1 in candidates]))
+    in_column = [
+        (index, number) for index, number, x0, x1 in candidates
+        if abs(x0 - column_x0) <= MARGIN_COLUMN_TOLERANCE or abs(x1 - column_x1) <= MARGIN_COLUMN_TOLERANCE
+    ]
+    increasing = all(later[1] > earlier[1] for earlier, later in zip(in_column, in_column[1:]))
+    if not increasing or len(in_column) < MIN_NUMBERED_ROW_SHARE * len(rows):
+        return numbers
+    for index, number in in_column:
+        numbers[index] = number
+    return numbers
+
+
+def row_text(row_words):
+    """
+    Joins a row's words with the same spacing as the markdown.
+
+    Returns:
+        (text, spans) where spans holds (start, end, struck) character offsets of each word.
+    """
+    parts = []
+    spans = []
+    length = 0
+    last_x1 = None
+    for x0, x1, _, word_text, struck in row_words:
+        if last_x1 is not None and x0 > last_x1 + 2:
+            parts.append(' ')
+            length += 1
+        spans.append((length, length + len(word_text), struck))
+        parts.append(word_text)
+        length += len(word_text)
+        last_x1 = x1
+    return ''.join(parts), spans
+
+
+class LineTable:
+    """
+    Array-backed table of a document's text rows.
+
+    Rows of page p are page_row_offsets[p - 1]:page_row_offsets[p]. Row r has its printed
+    line number (0 if none), y position, left x and the UTF-8 text bytes
+    text_bytes[row_text_offsets[r]:row_text_offsets[r + 1]], whose word spans are
+    row_span_offsets[r]:row_span_offsets[r + 1] of span_starts / span_ends / span_struck.
+    line_rows[page_line_offsets[p - 1] + m - 1] is the row of line m on page p (-1 if none).
+    """
+
+    FIELDS = (
+        'page_row_offsets', 'row_line_numbers', 'row_y', 'row_x0', 'row_text_offsets', 'text_bytes',
+        'row_span_offsets', 'span_starts', 'span_ends', 'span_struck', 'page_line_offsets', 'line_rows',
+    )
+
+    def __init__(self, **arrays):
+        for name in self.FIELDS:
+            setattr(self, name, arrays[name])
+
+    @classmethod
+    def from_pages(cls, pages):
+        """Builds a table from one words_to_rows() result per page, in page order."""
+        page_row_offsets = [0]
+        row_line_numbers, row_y, row_x0, row_text_offsets = [], [], [], [0]
+        text_chunks = []
+        row_span_offsets = [0]
+        span_starts, span_ends, span_struck = [], [], []
+        page_line_offsets = [0]
+        line_rows = []
+        for rows in pages:
+            numbers = margin_numbers(rows)
+            page_lines = [-1] * max(numbers, default=0)
+            for row_words, number in zip(rows, numbers):
+                row_index = len(row_line_numbers)
+                if number:
+                    page_lines[number - 1] = row_index
+                    row_words = row_words[1:]
+                text, spans = row_text(row_words)
+                encoded = text.encode('utf-8')
+                text_chunks.append(encoded)
+                row_text_offsets.append(row_text_offsets[-1] + len(encoded))
+                row_line_numbers.append(number)
+                row_y.append(row_words[0][2])
+                row_x0.append(row_words[0][0])
+                for start, end, struck in spans:
+                    span_starts.append(start)
+                    span_ends.append(end)
+                    span_struck.append(struck)
+                row_span_offsets.append(len(span_starts))
+            page_row_offsets.append(len(row_line_numbers))
+            line_rows.extend(page_lines)
+            page_line_offsets.append(len(line_rows))
+        return cls(
+            page_row_offsets=np.array(page_row_offsets, dtype=np.int32),
+            row_line_numbers=np.array(row_line_numbers, dtype=np.int16),
+            row_y=np.array(row_y, dtype=np.float32),
+            row_x0=np.array(row_x0, dtype=np.float32),
+            row_text_offsets=np.array(row_text_offsets, dtype=np.int64),
+            text_bytes=np.frombuffer(b''.join(text_chunks), dtype=np.uint8),
+            row_span_offsets=np.array(row_span_offsets, dtype=np.int64),
+            span_starts=np.array(span_starts, dtype=np.int32),
+            span_ends=np.array(span_ends, dtype=np.int32),
+            span_struck=np.array(span_struck, dtype=np.bool_),
+            page_line_offsets=np.array(page_line_offsets, dtype=np.int32),
+            line_rows=np.array(line_rows, dtype=np.int32),
+        )
+
+    @classmethod
+    def from_pdf(cls, pdf_file):
+        pages = []
+        with pymupdf.open(pdf_file) as doc:
+            for page in doc:
+                words = page.get_text("words")
+                struck_boxes = {tuple(rect) for rect in match_struck_words(words, find_strike_line_rects(page))} if words else set()
+                pages.append(words_to_rows(words, struck_boxes))
+        return cls.from_pages(pages)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            return cls(**{name: arrays[name] for name in cls.FIELDS})
+
+    def save(self, path):
+        with atomic_open(path, 'wb') as f:
+            np.savez_compressed(f, **{name: getattr(self, name) for name in self.FIELDS})
+
+    @property
+    def page_count(self):
+        return len(self.page_row_offsets) - 1
+
+    def __len__(self):
+        return len(self.row_line_numbers)
+
+    def page_rows(self, page):
+        """The row indices of a page (numbered from 1)."""
+        return range(int(self.page_row_offsets[page - 1]), int(self.page_row_offsets[page]))
+
+    def lookup(self, page, line):
+        """The row index of printed line `line` on `page`, or None if there is no such line."""
+        if not 1 <= page <= self.page_count:
+            return None
+        start = self.page_line_offsets[page - 1]
+        if not 1 <= line <= self.page_line_offsets[page] - start:
+            return None
+        row = int(self.line_rows[start + line - 1])
+        return row if row >= 0 else None
+
+    def text(self, row, struck='keep'):
+        """
+        A row's text: 'keep' leaves struck words in, 'mark' wraps them in ~~ as the markdown
+        does, 'drop' removes them.
+        """
+        text = bytes(self.text_bytes[self.row_text_offsets[row]:self.row_text_offsets[row + 1]]).decode('utf-8')
+        if struck == 'keep':
+            return text
+        span_range = slice(self.row_span_offsets[row], self.row_span_offsets[row + 1])
+        if not self.span_struck[span_range].any():
+            return text
+        parts = []
+        position = 0
+        for start, end, is_struck in zip(self.span_starts[span_range].tolist(), self.span_ends[span_range].tolist(), self.span_struck[span_range].tolist()):
+            if not is_struck:
+                continue
+            parts.append(text[position:start])
+            if struck == 'mark':
+                parts.append(f'~~{text[start:end]}~~')
+            position = end
+        parts.append(text[position:])
+        joined = ''.join(parts)
+        return ' '.join(joined.split()) if struck == 'drop' else joined
+
+    def page_line_numbers(self, page):
+        """The printed line number of each row of a page, or 0 for rows without one."""
+        rows = self.page_rows(page)
+        numbers = [0] * len(rows)
+        for line in range(1, int(self.page_line_offsets[page] - self.page_line_offsets[page - 1]) + 1):
+            row = self.lookup(page, line)
+            if row is not None:
+                numbers[row - rows.start] = line
+        return numbers
+
+    def line_text(self, page, line, struck='keep'):
+        row = self.lookup(page, line)
+        return None if row is None else self.text(row, struck)
+
+    def row(self, row):
+        """A row as a dict of its page, printed line number, position, text and word spans."""
+        page = int(np.searchsorted(self.page_row_offsets, row, side='right'))
+        span_range = slice(self.row_span_offsets[row], self.row_span_offsets[row + 1])
+        return {
+            'page': page,
+            'line': int(self.row_line_numbers[row]) or None,
+            'y': float(self.row_y[row]),
+            'x0': float(self.row_x0[row]),
+            'text': self.text(row),
+            'spans': list(zip(self.span_starts[span_range].tolist(), self.span_ends[span_range].tolist(), self.span_struck[span_range].tolist())),
+        }
+
+
+def main(args):
+    table = LineTable.load(args.path) if args.path.endswith('.npz') else LineTable.from_pdf(args.path)
+    numbered = int(np.count_nonzero(table.row_line_numbers))
+    print(f'{table.page_count} pages, {len(table)} rows, {numbered} with printed line numbers')
+    if args.page is not None and args.line is not None:
+        row = table.lookup(args.page, args.line)
+        print(table.row(row) if row is not None else f'No line {args.line} on page {args.page}')
+    elif args.page is not None:
+        for row in table.page_rows(args.page):
+            line = table.row_line_numbers[row]
+            print(f"{line or '':>3} {table.text(row, 'mark')}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Show the line table of a bill PDF or of a saved .npz line table.')
+    parser.add_argument('path', help='Bill PDF, or a line table saved by extract_legislation.py')
+    parser.add_argument('--page', type=int, default=None, help='Print this page (with --line, only that printed line)')
+    parser.add_argument('--line', type=int, default=None, help='Printed line number to look up on --page')
+    args = parser.parse_args()
+    main(args)
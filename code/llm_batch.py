@@ -0,0 +1,209 @@
+# Provider batch APIs for bulk LLM requests.
+# A whole session's requests are written to one JSONL job file, submitted through the OpenAI
+# Batch API or Gemini Batch Mode, polled until the job finishes, and read back keyed by each
+# request's custom id. Batch jobs trade latency (up to 24 hours) for throughput and about half
+# the per-token price. The submitted job's id is kept next to the job file, so an interrupted
+# run resumes polling the same job instead of paying for it again.
+
+import os
+import json
+import time
+from google.genai import types
+from file_utils import sha256_file, atomic_open, atomic_write_text
+from llm_cache import schema_of
+
+
+BATCH_POLL_SECONDS = 30
+OPENAI_TERMINAL_STATES = {'completed', 'failed', 'expired', 'cancelled'}
+GEMINI_TERMINAL_STATES = {
+    'JOB_STATE_SUCCEEDED', 'JOB_STATE_PARTIALLY_SUCCEEDED', 'JOB_STATE_FAILED',
+    'JOB_STATE_CANCELLED', 'JOB_STATE_EXPIRED',
+}
+
+
+def strict_json_schema(schema):
+    """
+    A JSON schema in the strict form OpenAI structured outputs require: every object lists
+    all its properties as required and allows no others, and null defaults are dropped
+    (optional fields stay nullable through their anyOf).
+    """
+    if isinstance(schema, list):
+        return [strict_json_schema(item) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+    schema = {key: strict_json_schema(value) for key, value in schema.items()}
+    if schema.get('type') == 'object' and 'properties' in schema:
+        schema['additionalProperties'] = False
+        schema['required'] = list(schema['properties'])
+    if 'default' in schema and schema['default'] is None:
+        del schema['default']
+    return schema
+
+
+def openai_response_format(response_format):
+    """The json_schema response_format for a pydantic model, as client.beta.chat.completions.parse sends it."""
+    return {
+        'type': 'json_schema',
+        'json_schema': {
+            'name': response_format.__name__,
+            'schema': strict_json_schema(response_format.model_json_schema()),
+            'strict': True,
+        },
+    }
+
+
+def openai_job_line(custom_id, model_name, system_prompt, content, response_format):
+    messages = [{'role': 'user', 'content': content}]
+    if system_prompt:
+        messages.insert(0, {'role': 'system', 'content': system_prompt})
+    body = {'model': model_name, 'messages': messages}
+    if response_format is not None:
+        body['response_format'] = openai_response_format(response_format)
+    return {'custom_id': custom_id, 'method': 'POST', 'url': '/v1/chat/completions', 'body': body}
+
+
+def gemini_job_line(custom_id, system_prompt, content, response_format):
+    request = {'contents': [{'role': 'user', 'parts': [{'text': content}]}]}
+    if system_prompt:
+        request['systemInstruction'] = {'parts': [{'text': system_prompt}]}
+    if response_format is not None:
+        request['generationConfig'] = {
+            'responseMimeType': 'application/json',
+            'responseJsonSchema': schema_of(response_format),
+        }
+    return {'key': custom_id, 'request': request}
+
+
+def write_job_file(model_family, model_name, requests, job_path):
+    """
+    Writes (custom_id, system_prompt, content, response_format) requests as a provider
+    batch input file.
+    """
+    os.makedirs(os.path.dirname(job_path) or '.', exist_ok=True)
+    with atomic_open(job_path) as job_file:
+        for custom_id, system_prompt, content, response_format in requests:
+            if model_family == 'gpt':
+                line = openai_job_line(custom_id, model_name, system_prompt, content, response_format)
+            elif model_family == 'gemini':
+                line = gemini_job_line(custom_id, system_prompt, content, response_format)
+            else:
+                raise ValueError(f"Batch mode is not available for model_family: {model_family}")
+            job_file.write(json.dumps(line) + '\n')
+
+
+def submit_batch(client, model_family, model_name, job_path, display_name):
+    """Uploads a job file and starts a batch job. Returns the provider's job id."""
+    if model_family == 'gpt':
+        with open(job_path, 'rb') as job_file:
+            input_file = client.files.create(file=job_file, purpose='batch')
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint='/v1/chat/completions',
+            completion_window='24h',
+            metadata={'description': display_name},
+        )
+        return batch.id
+    uploaded = client.files.upload(file=job_path, config=types.UploadFileConfig(display_name=display_name, mime_type='jsonl'))
+    job = client.batches.create(model=model_name, src=uploaded.name, config={'display_name': display_name})
+    return job.name
+
+
+def get_batch(client, model_family, batch_id):
+    """Returns (job, state, finished) for a submitted batch job."""
+    if model_family == 'gpt':
+        job = client.batches.retrieve(batch_id)
+        return job, job.status, job.status in OPENAI_TERMINAL_STATES
+    job = client.batches.get(name=batch_id)
+    return job, job.state.name, job.state.name in GEMINI_TERMINAL_STATES
+
+
+def wait_for_batch(client, model_family, batch_id, poll_seconds=BATCH_POLL_SECONDS):
+    """Polls a batch job until it reaches a terminal state, printing each state change."""
+    last_state = None
+    while True:
+        job, state, finished = get_batch(client, model_family, batch_id)
+        if state != last_state:
+            print(f"Batch {batch_id}: {state}")
+            last_state = state
+        if finished:
+            return job
+        time.sleep(poll_seconds)
+
+
+def openai_result_text(entry):
+    response = entry.get('response')
+    if entry.get('error') or response is None or response.get('status_code') != 200:
+        print(f"Batch request {entry.get('custom_id')} failed: {entry.get('error') or response}")
+        return None
+    return response['body']['choices'][0]['message']['content']
+
+
+def gemini_result_text(entry):
+    if entry.get('error') or 'response' not in entry:
+        print(f"Batch request {entry.get('key')} failed: {entry.get('error')}")
+        return None
+    candidates = entry['response'].get('candidates') or []
+    if not candidates:
+        print(f"Batch request {entry.get('key')} returned no candidates")
+        return None
+    return ''.join(part.get('text', '') for part in candidates[0].get('content', {}).get('parts', []))
+
+
+def download_results(client, model_family, job):
+    """
+    Reads a finished batch job's output.
+
+    Returns:
+        A dict mapping each custom id to the response text, or None for failed requests.
+    """
+    results = dict()
+    if model_family == 'gpt':
+        for file_id in (job.output_file_id, job.error_file_id):
+            if file_id:
+                for line in client.files.content(file_id).text.splitlines():
+                    if line.strip():
+                        entry = json.loads(line)
+                        results[entry['custom_id']] = openai_result_text(entry)
+        return results
+    if job.dest is not None and job.dest.file_name:
+        for line in client.files.download(file=job.dest.file_name).decode('utf-8').splitlines():
+            if line.strip():
+                entry = json.loads(line)
+                results[entry['key']] = gemini_result_text(entry)
+    return results
+
+
+def run_batch(client, model_family, model_name, requests, work_dir, display_name, poll_seconds=BATCH_POLL_SECONDS):
+    """
+    Runs (custom_id, system_prompt, content, response_format) requests as one batch job and
+    waits for it. The job file and a state file holding the submitted job id are kept in
+    work_dir until the results are read, so an identical re-run after an interruption resumes
+    the submitted job.
+
+    Returns:
+        A dict mapping each custom id to the response text, or None if that request failed.
+    """
+    job_path = os.path.join(work_dir, f'{display_name}.jsonl')
+    state_path = os.path.join(work_dir, f'{display_name}.state.json')
+    write_job_file(model_family, model_name, requests, job_path)
+    job_sha256 = sha256_file(job_path)
+
+    state = None
+    if os.path.exists(state_path):
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    if state is not None and state['job_sha256'] == job_sha256 and state['model_family'] == model_family:
+        batch_id = state['batch_id']
+        print(f"Resuming batch {batch_id} ({len(requests)} requests)")
+    else:
+        batch_id = submit_batch(client, model_family, model_name, job_path, display_name)
+        atomic_write_text(state_path, json.dumps({'batch_id': batch_id, 'model_family': model_family, 'job_sha256': job_sha256}))
+        print(f"Submitted batch {batch_id} ({len(requests)} requests)")
+
+    job = wait_for_batch(client, model_family, batch_id, poll_seconds)
+    results = download_results(client, model_family, job)
+    for custom_id, _, _, _ in requests:
+        results.setdefault(custom_id, None)
+    os.remove(state_path)
+    os.remove(job_path)
+    return results
@@ -0,0 +1,153 @@
+# Persistent, content-addressed cache of LLM responses.
+# Entries are keyed by a SHA-256 of the model family, model name, system prompt, response
+# schema and the content sent, so re-running leg_qa or amend_leg_md only pays for documents,
+# prompts or models that changed. Each entry is one JSON file under data/llm_cache/, and
+# its modification time records when it was last used, for least-recently-used eviction.
+
+import os
+import json
+import time
+import hashlib
+import argparse
+import threading
+from file_utils import sha256_bytes, atomic_write_text
+from metrics import METRICS
+
+
+DEFAULT_CACHE_DIR = 'data/llm_cache'
+
+
+def schema_of(response_format):
+    """A JSON-serialisable form of a response format (pydantic model, schema dict or None)."""
+    if hasattr(response_format, 'model_json_schema'):
+        return response_format.model_json_schema()
+    return response_format
+
+
+class LLMCache:
+    """
+    LLM response cache stored under cache_dir as {key[:2]}/{key}.json. A read_only cache
+    serves hits but never writes, touches or evicts entries.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, read_only=False):
+        self.cache_dir = cache_dir
+        self.read_only = read_only
+        if not read_only:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.stats_lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evicted': 0}
+
+    def key(self, model_family, model_name, system_prompt, response_format, content):
+        key_fields = {
+            'model_family': model_family,
+            'model_name': model_name,
+            'system_prompt_sha256': sha256_bytes((system_prompt or '').encode('utf-8')),
+            'schema': schema_of(response_format),
+            'content_sha256': sha256_bytes(content.encode('utf-8')),
+        }
+        return hashlib.sha256(json.dumps(key_fields, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f'{key}.json')
+
+    def count(self, **increments):
+        with self.stats_lock:
+            for name, value in increments.items():
+                self.stats[name] += value
+        for name, value in increments.items():
+            METRICS.count(f'llm_cache_{name}', value)
+
+    def get(self, key):
+        """Returns the cached response for key, or None on a miss."""
+        path = self.path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.count(misses=1)
+            return None
+        if not self.read_only:
+            os.utime(path)
+        self.count(hits=1)
+        return entry['response']
+
+    def put(self, key, response, model_family=None, model_name=None):
+        if self.read_only:
+            return
+        entry = {
+            'model_family': model_family,
+            'model_name': model_name,
+            'created_at': time.time(),
+            'response': response,
+        }
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write_text(path, json.dumps(entry))
+        self.count(writes=1)
+
+    def entries(self):
+        """Yields (path, size_bytes, last_used) for every cache entry."""
+        if not os.path.isdir(self.cache_dir):
+            return
+        for shard in os.scandir(self.cache_dir):
+            if shard.is_dir():
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith('.json'):
+                        stat = entry.stat()
+                        yield entry.path, stat.st_size, stat.st_mtime
+
+    def evict(self, max_bytes=None, max_age_days=None):
+        """
+        Removes entries unused for more than max_age_days, then the least recently used
+        entries until the cache is no larger than max_bytes.
+
+        Returns:
+            The number of entries removed.
+        """
+        if self.read_only:
+            return 0
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        removed = []
+        if max_age_days is not None:
+            cutoff = time.time() - max_age_days * 86400
+            removed = [entry for entry in entries if entry[2] < cutoff]
+            entries = entries[len(removed):]
+        if max_bytes is not None:
+            total_bytes = sum(size for _, size, _ in entries)
+            for entry in entries:
+                if total_bytes <= max_bytes:
+                    break
+                removed.append(entry)
+                total_bytes -= entry[1]
+        for path, _, _ in removed:
+            os.remove(path)
+        self.count(evicted=len(removed))
+        return len(removed)
+
+    def summary(self):
+        sizes = [size for _, size, _ in self.entries()]
+        return {'entries': len(sizes), 'bytes': sum(sizes), **self.stats}
+
+
+def main(args):
+    cache = LLMCache(args.cache_dir, read_only=args.command == 'stats')
+    if args.command == 'evict':
+        max_bytes = int(args.max_mb * 1e6) if args.max_mb is not None else None
+        print(f'Evicted {cache.evict(max_bytes=max_bytes, max_age_days=args.max_age_days)} entries')
+    elif args.command == 'clear':
+        print(f'Evicted {cache.evict(max_bytes=0)} entries')
+    print(cache.summary())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inspect and evict the LLM response cache.')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='Directory of the LLM response cache')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('stats', help='Print the number and size of cached responses')
+    evict_parser = subparsers.add_parser('evict', help='Remove old or least recently used responses')
+    evict_parser.add_argument('--max-mb', type=float, default=None, help='Keep at most this many megabytes of responses')
+    evict_parser.add_argument('--max-age-days', type=float, default=None, help='Remove responses unused for this many days')
+    subparsers.add_parser('clear', help='Remove every cached response')
+    args = parser.parse_args()
+    main(args)
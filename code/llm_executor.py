@@ -0,0 +1,210 @@
+# Concurrent executor for LLM queries.
+# A thread pool runs query_llm_with_retries for many inputs at once, while a ModelBudget
+# shared by every worker for the same model family keeps requests and tokens per minute under
+# the provider's limits. A 429 from the provider pauses all workers and halves the budget's
+# rate, which then recovers gradually as requests succeed. Results are returned in input order.
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+from tqdm import tqdm
+from llm_utils import query_llm_with_retries
+from metrics import METRICS
+
+
+# Requests and tokens per minute for each model family (None means unlimited).
+# Gemini 2.5 Flash and GPT-4.1 nano tier 1 limits; local Ollama models are unlimited.
+DEFAULT_BUDGETS = {
+    'gemini': {'requests_per_minute': 1000, 'tokens_per_minute': 1000000},
+    'gpt': {'requests_per_minute': 500, 'tokens_per_minute': 200000},
+    'ollama': {'requests_per_minute': None, 'tokens_per_minute': None},
+}
+# Allowance for the structured answer in each request's token estimate
+OUTPUT_TOKEN_ESTIMATE = 1000
+MIN_RATE_SCALE = 1 / 16
+RATE_RECOVERY_STEP = 0.05
+MAX_THROTTLE_SECONDS = 60
+
+
+def estimate_tokens(*texts, tokenizer=None):
+    """
+    Token estimate for a request: its texts counted with tokenizer (the count_tokens.py
+    tiktoken encoding, as leg_qa and cost_estimator load it), or at about four characters per
+    token without one, plus OUTPUT_TOKEN_ESTIMATE for the answer.
+    """
+    if tokenizer is not None:
+        return sum(len(tokenizer.encode_ordinary(text)) for text in texts) + OUTPUT_TOKEN_ESTIMATE
+    return sum(len(text) for text in texts) // 4 + OUTPUT_TOKEN_ESTIMATE
+
+
+class TokenBucket:
+    """Refills capacity units per minute, scaled by the owning budget's current rate scale."""
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self, now, scale):
+        self.level = min(self.per_minute, self.level + (now - self.updated) * self.per_minute * scale / 60)
+        self.updated = now
+
+    def wait_seconds(self, amount, scale):
+        # A request larger than a whole minute's budget only waits for a full bucket
+        amount = min(amount, self.per_minute)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60 / (self.per_minute * scale)
+
+
+class ModelBudget:
+    """
+    Thread-safe requests-per-minute and tokens-per-minute budget with adaptive backoff.
+
+    acquire() blocks until one request and its tokens fit the budget. throttle() is called on
+    a 429: it pauses every caller (for the server's Retry-After when given) and halves the
+    refill rate; each later successful acquire restores a little of it.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.lock = threading.Lock()
+        self.rate_scale = 1.0
+        self.paused_until = 0.0
+        self.consecutive_throttles = 0
+        self.stats = {'requests': 0, 'tokens': 0, 'rate_limited': 0, 'waited_seconds': 0.0}
+
+    def acquire(self, tokens=0):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                wait = self.paused_until - now
+                if wait <= 0:
+                    buckets = [(bucket, amount) for bucket, amount in ((self.requests, 1), (self.tokens, tokens)) if bucket is not None]
+                    for bucket, _ in buckets:
+                        bucket.refill(now, self.rate_scale)
+                    wait = max([bucket.wait_seconds(amount, self.rate_scale) for bucket, amount in buckets], default=0.0)
+                    if wait <= 0:
+                        for bucket, amount in buckets:
+                            bucket.level -= min(amount, bucket.per_minute)
+                        self.rate_scale = min(1.0, self.rate_scale + RATE_RECOVERY_STEP)
+                        self.consecutive_throttles = 0
+                        self.stats['requests'] += 1
+                        self.stats['tokens'] += tokens
+                        return
+                self.stats['waited_seconds'] += wait
+            METRICS.count('llm_budget_wait_seconds', wait)
+            time.sleep(wait)
+
+    def throttle(self, retry_after=None):
+        """
+        Records a rate limit response. Returns how long the caller should wait before retrying.
+        """
+        with self.lock:
+            self.stats['rate_limited'] += 1
+            METRICS.count('llm_rate_limited')
+            self.consecutive_throttles += 1
+            self.rate_scale = max(MIN_RATE_SCALE, self.rate_scale / 2)
+            delay = retry_after if retry_after is not None else min(MAX_THROTTLE_SECONDS, 2 ** (self.consecutive_throttles - 1))
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            return delay
+
+
+budgets = dict()
+budgets_lock = threading.Lock()
+
+
+def budget_for(model_family, requests_per_minute=None, tokens_per_minute=None):
+    """
+    Returns the process-wide budget for model_family, creating it with the given limits
+    (or DEFAULT_BUDGETS) on first use, so every executor for a family shares one budget.
+    """
+    with budgets_lock:
+        if model_family not in budgets:
+            limits = dict(DEFAULT_BUDGETS.get(model_family, {}))
+            if requests_per_minute is not None:
+                limits['requests_per_minute'] = requests_per_minute
+            if tokens_per_minute is not None:
+                limits['tokens_per_minute'] = tokens_per_minute
+            budgets[model_family] = ModelBudget(**limits)
+        return budgets[model_family]
+
+
+class LLMExecutor:
+    """
+    Runs query_llm_with_retries over many inputs with `workers` concurrent requests, all
+    drawing on the model family's shared ModelBudget. Responses found in the optional
+    LLMCache use no budget. Token estimates use the optional tokenizer (see estimate_tokens).
+    """
+
+    def __init__(self, client, model_name, model_family, workers=8, budget=None, max_retries=3, cache=None, tokenizer=None):
+        self.client = client
+        self.model_name = model_name
+        self.model_family = model_family
+        self.workers = max(1, workers)
+        self.budget = budget or budget_for(model_family)
+        self.max_retries = max_retries
+        self.cache = cache
+        self.tokenizer = tokenizer
+        self.latencies = []
+
+    def query(self, prompt, value, response_format):
+        return query_llm_with_retries(
+            client=self.client,
+            prompt=prompt,
+            value=value,
+            response_format=response_format,
+            model_name=self.model_name,
+            max_retries=self.max_retries,
+            model_family=self.model_family,
+            rate_limiter=self.budget,
+            estimated_tokens=estimate_tokens(prompt, value, tokenizer=self.tokenizer),
+            cache=self.cache,
+            tokenizer=self.tokenizer,
+        )
+
+    def timed(self, function, value):
+        start = time.perf_counter()
+        result = function(value)
+        return result, time.perf_counter() - start
+
+    def run(self, function, values, on_result=None, progress=True):
+        """
+        Calls function(value) for every value on the thread pool. function should make its
+        LLM requests through self.query so they share the budget and cache.
+
+        Args:
+            on_result: Optional callback on_result(index, result), called from the calling
+                thread as each result arrives (in completion order), e.g. to save progress.
+            progress: Show a tqdm progress bar.
+
+        Returns:
+            The results, in the order of values.
+        """
+        values = list(values)
+        results = [None] * len(values)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.timed, function, value): index for index, value in enumerate(values)}
+            for future in tqdm(as_completed(futures), total=len(futures), disable=not progress):
+                index = futures[future]
+                results[index], latency = future.result()
+                self.latencies.append(latency)
+                if on_result is not None:
+                    on_result(index, results[index])
+        return results
+
+    def map(self, prompt, values, response_format, on_result=None, progress=True):
+        """
+        Queries the LLM once per value with the same system prompt and response format.
+
+        Returns:
+            The parsed results (None for failed queries), in the order of values.
+        """
+        return self.run(lambda value: self.query(prompt, value, response_format), values, on_result, progress)
+
+    def latency_percentiles(self, percentiles=(50, 90, 99)):
+        if not self.latencies:
+            return dict()
+        return dict(zip(percentiles, np.percentile(self.latencies, percentiles).tolist()))
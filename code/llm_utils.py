@@ -4,70 +4,222 @@ import os
 import json
 import time
 import tiktoken
-from openai import OpenAI, OpenAIError
+from openai import OpenAI, OpenAIError, RateLimitError
 import google
 from google import genai
 from google.genai.types import GenerateContentConfig
 import ollama
 from ollama import chat
 from ollama import ChatResponse
+from metrics import METRICS
+from llm_validation import (
+    InvalidResponse, repair_json, validate_answers, follow_up_model, follow_up_request, is_model
+)
 
-def query_llm_with_retries(client, prompt, value, response_format, model_name, max_retries=5, model_family='gemini'):
+def is_rate_limit_error(error):
+    """True for a provider's HTTP 429 / quota exhausted error."""
+    if isinstance(error, RateLimitError):
+        return True
+    if isinstance(error, google.genai.errors.APIError):
+        return error.code == 429
+    if isinstance(error, ollama.ResponseError):
+        return error.status_code == 429
+    return False
+
+
+def retry_after_seconds(error):
+    """The Retry-After delay a rate limit error's response asked for, or None."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers or headers.get('Retry-After') is None:
+        return None
+    try:
+        return max(0.0, float(headers['Retry-After']))
+    except ValueError:
+        return None
+
+
+def backoff_seconds(error, attempt, rate_limiter=None):
+    """
+    How long to wait before retrying after error. Rate limit errors are reported to the
+    rate_limiter (when one is shared between concurrent callers), which decides the delay.
+    """
+    if rate_limiter is not None and is_rate_limit_error(error):
+        return rate_limiter.throttle(retry_after_seconds(error))
+    return (2 ** attempt) * 1
+
+
+def response_token_usage(model_family, response):
+    """The (input, output) token counts a provider reported for a response, 0 when absent."""
+    if model_family == 'gemini':
+        usage = getattr(response, 'usage_metadata', None)
+        return getattr(usage, 'prompt_token_count', 0) or 0, getattr(usage, 'candidates_token_count', 0) or 0
+    if model_family == 'gpt':
+        usage = getattr(response, 'usage', None)
+        return getattr(usage, 'prompt_tokens', 0) or 0, getattr(usage, 'completion_tokens', 0) or 0
+    return getattr(response, 'prompt_eval_count', 0) or 0, getattr(response, 'eval_count', 0) or 0
+
+
+def record_llm_error(error, attempt, max_retries, model_family, model_name):
+    """Counts a failed attempt in metrics.METRICS as a retry, or as a failure on the last attempt."""
+    METRICS.count('llm_errors', model_family=model_family, model=model_name, error=type(error).__name__)
+    if attempt < max_retries - 1:
+        METRICS.count('llm_retries', model_family=model_family, model=model_name)
+    else:
+        METRICS.count('llm_failures', model_family=model_family, model=model_name)
+
+
+def request_structured(client, prompt, value, response_format, model_name, model_family):
+    """
+    Sends one request for structured output and records its latency and token usage in
+    metrics.METRICS.
+
+    Returns:
+        The response JSON text (ollama, gemini), or the parsed dict (gpt, whose structured
+        outputs the client parses against response_format).
+    """
+    start = time.perf_counter()
+    if model_family == 'ollama':
+        formattedPromptContents = [
+            {'role': 'system', 'content': prompt},
+            {'role': 'user', 'content': value},
+        ]
+        response = client(
+            model=model_name,
+            format=response_format.model_json_schema() if hasattr(response_format, 'model_json_schema') else response_format,
+            messages=formattedPromptContents,
+            options={'temperature': 0.2}
+        )
+        content = response.message.content
+    elif model_family == 'gemini':
+        response = client.models.generate_content(
+            model=model_name,
+            contents=value,
+            config=GenerateContentConfig(
+                system_instruction=prompt,
+                response_mime_type='application/json',
+                response_schema=response_format
+            ),
+        )
+        content = response.text
+    elif model_family == 'gpt':
+        response = client.beta.chat.completions.parse(
+            model=model_name,
+            messages=[
+                {'role': 'system', 'content': prompt},
+                {'role': 'user', 'content': value},
+            ],
+            response_format=response_format
+        )
+        content = response.choices[0].message.parsed.model_dump()
+    else:
+        raise ValueError(f"Unknown model_family: {model_family}")
+    input_tokens, output_tokens = response_token_usage(model_family, response)
+    METRICS.observe('llm_latency_seconds', time.perf_counter() - start, model_family=model_family, model=model_name)
+    METRICS.count('llm_requests', model_family=model_family, model=model_name)
+    METRICS.count('llm_input_tokens', input_tokens, model_family=model_family, model=model_name)
+    METRICS.count('llm_output_tokens', output_tokens, model_family=model_family, model=model_name)
+    return content
+
+
+def validated_response(client, prompt, content, response_format, validation_model, model_name, model_family, rate_limiter=None, follow_up=True, tokenizer=None):
+    """
+    Turns a response into answers that pass validation_model: JSON is repaired locally,
+    fields of the wrong type are coerced, and the fields still missing or invalid are asked
+    for again in one small follow-up request (the system prompt and the other answers, never
+    the original input). Each repair path taken is counted as llm_validation in
+    metrics.METRICS. The follow-up is charged to rate_limiter as llm_executor.estimate_tokens
+    counts it with tokenizer.
+
+    Raises:
+        json.JSONDecodeError: when no JSON object can be recovered.
+        InvalidResponse: when fields are still invalid after the follow-up.
+    """
+    labels = {'model_family': model_family, 'model': model_name}
+    if isinstance(content, str):
+        parsed, repaired = repair_json(content)
+    else:
+        parsed, repaired = content, False
+    answers, errors, coerced = validate_answers(parsed, validation_model)
+    paths = [path for path, fired in (('json_repaired', repaired), ('fields_coerced', coerced)) if fired]
+    if errors and follow_up and len(errors) < len(validation_model.model_fields):
+        print(f"Asking again for invalid fields: {', '.join(errors)}")
+        follow_up_prompt, follow_up_value = follow_up_request(prompt, answers, errors, parsed)
+        if rate_limiter is not None:
+            # Imported here: llm_executor imports this module
+            from llm_executor import estimate_tokens
+            rate_limiter.acquire(estimate_tokens(follow_up_prompt, follow_up_value, tokenizer=tokenizer))
+        follow_up_format = follow_up_model(response_format if is_model(response_format) else validation_model, errors)
+        follow_up_content = request_structured(client, follow_up_prompt, follow_up_value, follow_up_format, model_name, model_family)
+        if isinstance(follow_up_content, str):
+            follow_up_content, _ = repair_json(follow_up_content)
+        answers, errors, _ = validate_answers({**answers, **{name: follow_up_content.get(name) for name in errors if name in follow_up_content}}, validation_model)
+        paths.append('follow_up')
+    if errors:
+        METRICS.count('llm_validation', **labels, path='invalid')
+        raise InvalidResponse(f"Invalid fields: {errors}")
+    for path in paths or ['valid']:
+        METRICS.count('llm_validation', **labels, path=path)
+    return answers
+
+
+def query_llm_with_retries(client, prompt, value, response_format, model_name, max_retries=5, model_family='gemini', rate_limiter=None, estimated_tokens=0, cache=None, validation_model=None, tokenizer=None):
     """
     Query Gemini, OpenAI (GPT), or Ollama LLM with retries and error handling. Returns parsed JSON or None.
     model_family: 'gemini', 'gpt', or 'ollama'
+    rate_limiter: optional shared budget (see llm_executor.ModelBudget); every attempt first
+    acquires one request and estimated_tokens from it, and 429 errors throttle it.
+    cache: optional llm_cache.LLMCache; a cached response that passes validation_model is
+    returned without querying the LLM, and successful responses are stored in it. Failures
+    are never cached.
+    validation_model: pydantic model the answers must pass (default: response_format when it
+    is one), e.g. a subclass adding range checks; see validated_response. The whole request
+    is only retried when the response cannot be repaired.
+    tokenizer: optional tiktoken encoding that a follow-up request's tokens are counted with.
+    Latency, retries and token usage are recorded in metrics.METRICS.
     """
+    if validation_model is None and is_model(response_format):
+        validation_model = response_format
+    if cache is not None:
+        cache_key = cache.key(model_family, model_name, prompt, response_format, value)
+        cached_response = cache.get(cache_key)
+        if cached_response is not None and validation_model is not None:
+            # Responses cached before validation (or under looser checks) are queried again
+            cached_response, errors, _ = validate_answers(cached_response, validation_model)
+            if errors:
+                cached_response = None
+        if cached_response is not None:
+            return cached_response
     for attempt in range(max_retries):
         try:
-            if model_family == 'ollama':
-                formattedPromptContents = [
-                    {'role': 'system', 'content': prompt},
-                    {'role': 'user', 'content': value},
-                ]
-                response = client(
-                    model=model_name,
-                    format=response_format.model_json_schema() if hasattr(response_format, 'model_json_schema') else response_format,
-                    messages=formattedPromptContents,
-                    options={'temperature': 0.2}
-                )
-                parsed_response_content = json.loads(response.message.content)
-                return parsed_response_content
-            elif model_family == 'gemini':
-                response = client.models.generate_content(
-                    model=model_name,
-                    contents=value,
-                    config=GenerateContentConfig(
-                        system_instruction=prompt,
-                        response_mime_type='application/json',
-                        response_schema=response_format
-                    ),
-                )
-                return json.loads(response.text)
-            elif model_family == 'gpt':
-                response = client.beta.chat.completions.parse(
-                    model=model_name,
-                    messages=[
-                        {'role': 'system', 'content': prompt},
-                        {'role': 'user', 'content': value},
-                    ],
-                    response_format=response_format
+            if rate_limiter is not None:
+                rate_limiter.acquire(estimated_tokens)
+            content = request_structured(client, prompt, value, response_format, model_name, model_family)
+            if validation_model is not None:
+                parsed_response_content = validated_response(
+                    client, prompt, content, response_format, validation_model, model_name, model_family,
+                    rate_limiter=rate_limiter, tokenizer=tokenizer
                 )
-                return response.choices[0].message.parsed.model_dump()
             else:
-                raise ValueError(f"Unknown model_family: {model_family}")
+                parsed_response_content = json.loads(content) if isinstance(content, str) else content
+            if cache is not None:
+                cache.put(cache_key, parsed_response_content, model_family, model_name)
+            return parsed_response_content
         except (google.genai.errors.ServerError, OpenAIError) as e:
             print(f"Connection error: {e}")
+            record_llm_error(e, attempt, max_retries, model_family, model_name)
             if attempt < max_retries - 1:
-                sleep_duration = (2 ** attempt) * 1
+                sleep_duration = backoff_seconds(e, attempt, rate_limiter)
                 print(f"Retrying in {sleep_duration} seconds...")
                 time.sleep(sleep_duration)
             else:
                 print("Max retries reached. Returning None.")
                 return None
-        except json.JSONDecodeError as e:
-            print(f"JSON decode error: {e}")
+        except (json.JSONDecodeError, InvalidResponse) as e:
+            print(f"Invalid response: {e}")
+            record_llm_error(e, attempt, max_retries, model_family, model_name)
             if attempt < max_retries - 1:
-                sleep_duration = (2 ** attempt) * 1
+                sleep_duration = backoff_seconds(e, attempt, rate_limiter)
                 print(f"Retrying in {sleep_duration} seconds...")
                 time.sleep(sleep_duration)
             else:
@@ -76,8 +228,9 @@ def query_llm_with_retries(client, prompt, value, response_format, model_name, m
         except Exception as e:
             # For Ollama or any other unexpected error
             print(f"Unexpected error: {e}")
+            record_llm_error(e, attempt, max_retries, model_family, model_name)
             if attempt < max_retries - 1:
-                sleep_duration = (2 ** attempt) * 1
+                sleep_duration = backoff_seconds(e, attempt, rate_limiter)
                 print(f"Retrying in {sleep_duration} seconds...")
                 time.sleep(sleep_duration)
             else:
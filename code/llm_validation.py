@@ -0,0 +1,226 @@
+# Validation and local repair of structured LLM responses.
+# A response is checked against a pydantic model (which may add range checks, e.g. scores
+# from 1 to 10, to the schema the provider was given). Malformed JSON is repaired locally
+# (code fences, Python literals, trailing commas, truncated output), and fields of the
+# wrong type are coerced where the intent is unambiguous (an answer of just "$2.5 million"
+# for a number, "yes" for a boolean, "N/A" for an optional field). Whatever is still missing
+# or invalid is returned by name, so the caller can ask the model about just those fields.
+
+import re
+import json
+import typing
+from pydantic import BaseModel, ValidationError, create_model
+
+
+JSON_STRING_PATTERN = re.compile(r'"(?:\\.|[^"\\])*"', re.DOTALL)
+CODE_FENCE_PATTERN = re.compile(r'^\s*```(?:json)?\s*(.*?)\s*```\s*$', re.DOTALL | re.IGNORECASE)
+TRAILING_COMMA_PATTERN = re.compile(r',\s*([}\]])')
+PYTHON_LITERALS = {'True': 'true', 'False': 'false', 'None': 'null'}
+PYTHON_LITERAL_PATTERN = re.compile(r'\b(True|False|None)\b')
+# A whole answer that is one number: an optional sign and $, digits with or without
+# thousands separators, and an optional scale word
+NUMBER_PATTERN = re.compile(r'(-?)\$?\s*((?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?)\s*(thousand|million|billion|k|mm|m|bn|b)?', re.IGNORECASE)
+MULTIPLIERS = {'thousand': 1e3, 'k': 1e3, 'million': 1e6, 'm': 1e6, 'mm': 1e6, 'billion': 1e9, 'bn': 1e9, 'b': 1e9}
+TRUE_STRINGS = {'true', 'yes', 'y'}
+FALSE_STRINGS = {'false', 'no', 'n'}
+EMPTY_STRINGS = {'', 'n/a', 'na', 'none', 'null', 'unknown', 'not specified', 'not applicable', 'not stated', 'not mentioned'}
+# How each response was made valid, counted per model in metrics as llm_validation{path=...}
+REPAIR_PATHS = ('valid', 'json_repaired', 'fields_coerced', 'follow_up', 'invalid')
+
+
+class InvalidResponse(Exception):
+    """A response whose fields are still invalid after repair."""
+
+
+FOLLOW_UP_INSTRUCTIONS = (
+    "\n\nYour JSON answers had missing or invalid fields. The input below holds your valid answers "
+    "and, for each field to answer again, your previous value and what was wrong with it. "
+    "Please respond with only valid JSON containing exactly those fields."
+)
+
+
+def outside_strings(text, function):
+    """Applies function to the parts of JSON text that are not inside string literals."""
+    parts = []
+    position = 0
+    for match in JSON_STRING_PATTERN.finditer(text):
+        parts.append(function(text[position:match.start()]))
+        parts.append(match.group(0))
+        position = match.end()
+    parts.append(function(text[position:]))
+    return ''.join(parts)
+
+
+def close_truncated(text):
+    """Closes the string, arrays and objects left open by a response cut off mid-way."""
+    stack = []
+    in_string = False
+    escaped = False
+    for character in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif character == '\\':
+                escaped = True
+            elif character == '"':
+                in_string = False
+        elif character == '"':
+            in_string = True
+        elif character in '{[':
+            stack.append('}' if character == '{' else ']')
+        elif character in '}]' and stack:
+            stack.pop()
+    if in_string:
+        text += '"'
+    text = re.sub(r'[,:]\s*$', '', text.rstrip())
+    # A key left without a value
+    text = re.sub(r',\s*"[^"]*"\s*$', '', text)
+    return text + ''.join(reversed(stack))
+
+
+def repair_json(text):
+    """
+    Parses a JSON object from model output, repairing it locally when needed.
+
+    Returns:
+        (parsed dict, whether it needed repair)
+
+    Raises:
+        json.JSONDecodeError if no object can be recovered.
+    """
+    try:
+        parsed = json.loads(text)
+        if isinstance(parsed, dict):
+            return parsed, False
+    except json.JSONDecodeError:
+        pass
+    repaired = text
+    fence_match = CODE_FENCE_PATTERN.match(repaired)
+    if fence_match:
+        repaired = fence_match.group(1)
+    start = repaired.find('{')
+    if start == -1:
+        raise json.JSONDecodeError('No JSON object in response', text, 0)
+    end = repaired.rfind('}')
+    repaired = repaired[start:end + 1] if end > start else repaired[start:]
+    repaired = outside_strings(repaired, lambda part: PYTHON_LITERAL_PATTERN.sub(lambda match: PYTHON_LITERALS[match.group(1)], part))
+    repaired = outside_strings(repaired, lambda part: TRAILING_COMMA_PATTERN.sub(r'\1', part))
+    try:
+        parsed = json.loads(repaired)
+    except json.JSONDecodeError:
+        parsed = json.loads(close_truncated(repaired))
+    if not isinstance(parsed, dict):
+        raise json.JSONDecodeError('Response is not a JSON object', text, 0)
+    return parsed, True
+
+
+def field_type(annotation):
+    """The type of a field, without Optional, and whether None is allowed."""
+    arguments = typing.get_args(annotation)
+    if typing.get_origin(annotation) is typing.Union:
+        types = [argument for argument in arguments if argument is not type(None)]
+        return (types[0] if len(types) == 1 else None), type(None) in arguments
+    return annotation, False
+
+
+def parse_number(text):
+    """
+    The number text consists of (e.g. "$2.5 million" or "1,200"), scaled by its 'million',
+    'bn' etc., or None when text is anything more than one number (e.g. "July 1, 2025" or
+    "$500 per child").
+    """
+    match = NUMBER_PATTERN.fullmatch(text.strip())
+    if match is None:
+        return None
+    value = float(match.group(2).replace(',', ''))
+    if match.group(3):
+        value *= MULTIPLIERS[match.group(3).lower()]
+    return -value if match.group(1) else value
+
+
+def coerce_value(value, annotation):
+    """
+    A value of the field's type for value when the conversion is unambiguous, otherwise
+    value unchanged (and left for validation to reject).
+    """
+    target, optional = field_type(annotation)
+    if isinstance(value, str):
+        stripped = value.strip().lower()
+        if optional and stripped in EMPTY_STRINGS:
+            return None
+        if target is bool:
+            if stripped in TRUE_STRINGS:
+                return True
+            if stripped in FALSE_STRINGS:
+                return False
+        if target in (int, float):
+            number = parse_number(value)
+            if number is None:
+                return value
+            value = number
+    if target is int and isinstance(value, float) and value.is_integer():
+        return int(value)
+    if target is float and isinstance(value, int) and not isinstance(value, bool):
+        return float(value)
+    return value
+
+
+def field_errors(error):
+    """Maps each top-level field of a ValidationError to its first error message."""
+    errors = dict()
+    for detail in error.errors():
+        name = detail['loc'][0] if detail['loc'] else '__root__'
+        errors.setdefault(name, detail['msg'])
+    return errors
+
+
+def validate_answers(data, model):
+    """
+    Validates a response dict against model, coercing the fields that fail when possible.
+
+    Returns:
+        (the valid fields as a dict, {field: error message} for the fields still missing or
+        invalid, whether any field was coerced)
+    """
+    data = {name: value for name, value in data.items() if name in model.model_fields}
+    try:
+        return model.model_validate(data).model_dump(), dict(), False
+    except ValidationError as error:
+        errors = field_errors(error)
+    coerced = False
+    for name in errors:
+        if name in data:
+            value = coerce_value(data[name], model.model_fields[name].annotation)
+            if value is not data[name]:
+                data[name] = value
+                coerced = True
+    try:
+        return model.model_validate(data).model_dump(), dict(), coerced
+    except ValidationError as error:
+        errors = field_errors(error)
+    valid = {name: value for name, value in data.items() if name not in errors}
+    return valid, errors, coerced
+
+
+def follow_up_model(model, field_names):
+    """A model with only the given fields of model, for the follow-up response schema."""
+    return create_model(
+        f'{model.__name__}FollowUp',
+        **{name: (model.model_fields[name].annotation, model.model_fields[name]) for name in field_names}
+    )
+
+
+def follow_up_request(prompt, valid, errors, previous):
+    """
+    The system prompt and input of a follow-up asking only about the invalid fields. It
+    repeats the original system prompt (the questions) but never the original input.
+    """
+    fields = {
+        name: {'previous_value': previous.get(name), 'problem': 'missing' if name not in previous else message}
+        for name, message in errors.items()
+    }
+    return (prompt or '') + FOLLOW_UP_INSTRUCTIONS, json.dumps({'valid_answers': valid, 'answer_again': fields}, default=str)
+
+
+def is_model(response_format):
+    return isinstance(response_format, type) and issubclass(response_format, BaseModel)
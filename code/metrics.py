@@ -0,0 +1,206 @@
+# Process-wide instrumentation for pipeline runs.
+# Every stage records into one registry: counters (HTTP bytes, cache hits, LLM retries and
+# token usage), timing samples (LLM latency, stage wall time) and per-document phase timings
+# (e.g. parse, strike detection and write for each extracted PDF). The registry is written
+# as a JSON report or, for a path ending in .prom, a Prometheus textfile-collector file.
+# profile() wraps a stage in cProfile, or pyinstrument when it is installed and requested.
+
+import os
+import sys
+import json
+import time
+import threading
+import contextlib
+from collections import defaultdict
+from datetime import datetime, timezone
+import numpy as np
+from file_utils import atomic_write_text
+
+
+METRIC_PREFIX = 'legi_scanner'
+QUANTILES = (0.5, 0.9, 0.99)
+PROFILERS = ('cprofile', 'pyinstrument')
+
+
+def peak_rss_bytes(children=False):
+    """
+    Peak resident set size of this process (or of its finished child processes, e.g. the
+    extraction workers), or None where the resource module is unavailable (Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+
+
+def label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+class MetricsRegistry:
+    """
+    Thread-safe counters, timing samples and per-document phase timings. Labels are keyword
+    arguments, e.g. count('llm_requests', model_family='gemini', outcome='ok').
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.counters = defaultdict(float)
+        self.timings = defaultdict(list)
+        self.documents = defaultdict(lambda: defaultdict(float))
+
+    def count(self, name, value=1, **labels):
+        with self.lock:
+            self.counters[(name, label_key(labels))] += value
+
+    def observe(self, name, seconds, **labels):
+        with self.lock:
+            self.timings[(name, label_key(labels))].append(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def record_document(self, stage, document, phase_seconds):
+        """Adds a document's {phase: seconds} timings, also observed as {stage}_phase_seconds."""
+        with self.lock:
+            totals = self.documents[f'{stage}/{document}']
+            for phase, seconds in phase_seconds.items():
+                totals[phase] += seconds
+                self.timings[(f'{stage}_phase_seconds', label_key({'phase': phase}))].append(seconds)
+
+    def snapshot(self):
+        """The registry's contents as plain data, for returning from worker processes."""
+        with self.lock:
+            return {
+                'counters': list(self.counters.items()),
+                'timings': list(self.timings.items()),
+                'documents': {document: dict(phases) for document, phases in self.documents.items()},
+            }
+
+    def merge(self, snapshot):
+        with self.lock:
+            for key, value in snapshot['counters']:
+                self.counters[key] += value
+            for key, samples in snapshot['timings']:
+                self.timings[key].extend(samples)
+            for document, phases in snapshot['documents'].items():
+                for phase, seconds in phases.items():
+                    self.documents[document][phase] += seconds
+
+    def report(self):
+        with self.lock:
+            counters = [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self.counters.items())
+            ]
+            timings = []
+            for (name, labels), samples in sorted(self.timings.items()):
+                timing = {
+                    'name': name,
+                    'labels': dict(labels),
+                    'count': len(samples),
+                    'sum': float(np.sum(samples)),
+                    'max': float(np.max(samples)),
+                }
+                timing.update(zip((f'p{round(q * 100)}' for q in QUANTILES), np.quantile(samples, QUANTILES).tolist()))
+                timings.append(timing)
+            documents = {document: dict(phases) for document, phases in sorted(self.documents.items())}
+        return {
+            'started': datetime.fromtimestamp(self.started, timezone.utc).isoformat(),
+            'elapsed_seconds': time.time() - self.started,
+            'peak_rss_bytes': peak_rss_bytes(),
+            'peak_rss_children_bytes': peak_rss_bytes(children=True),
+            'counters': counters,
+            'timings': timings,
+            'documents': documents,
+        }
+
+    def prometheus_text(self):
+        """The report in the Prometheus text exposition format (without per-document timings)."""
+        report = self.report()
+
+        def labels_text(labels, **extra):
+            labels = {**labels, **extra}
+            if not labels:
+                return ''
+            return '{' + ','.join(f'{name}="{str(value)}"' for name, value in sorted(labels.items())) + '}'
+
+        lines = [f'{METRIC_PREFIX}_elapsed_seconds {report["elapsed_seconds"]}']
+        for name in ('peak_rss_bytes', 'peak_rss_children_bytes'):
+            if report[name] is not None:
+                lines.append(f'{METRIC_PREFIX}_{name} {report[name]}')
+        typed = set()
+        for counter in report['counters']:
+            metric = f"{METRIC_PREFIX}_{counter['name']}_total"
+            if metric not in typed:
+                lines.append(f'# TYPE {metric} counter')
+                typed.add(metric)
+            lines.append(f"{metric}{labels_text(counter['labels'])} {counter['value']}")
+        for timing in report['timings']:
+            metric = f"{METRIC_PREFIX}_{timing['name']}"
+            if metric not in typed:
+                lines.append(f'# TYPE {metric} summary')
+                typed.add(metric)
+            for quantile in QUANTILES:
+                lines.append(f"{metric}{labels_text(timing['labels'], quantile=quantile)} {timing[f'p{round(quantile * 100)}']}")
+            lines.append(f"{metric}_sum{labels_text(timing['labels'])} {timing['sum']}")
+            lines.append(f"{metric}_count{labels_text(timing['labels'])} {timing['count']}")
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Writes a Prometheus textfile for a .prom path and a JSON report otherwise."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        if path.endswith('.prom'):
+            atomic_write_text(path, self.prometheus_text())
+        else:
+            atomic_write_text(path, json.dumps(self.report(), indent=1))
+
+
+METRICS = MetricsRegistry()
+
+
+@contextlib.contextmanager
+def profile(stage, output_dir=None, profiler='cprofile'):
+    """
+    Profiles the enclosed code into output_dir/{stage}.prof (cProfile, readable with pstats
+    or snakeviz) or output_dir/{stage}.html (pyinstrument). Does nothing without output_dir.
+    """
+    if output_dir is None:
+        yield
+        return
+    os.makedirs(output_dir, exist_ok=True)
+    if profiler == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print('pyinstrument is not installed; profiling with cProfile instead.')
+            profiler = 'cprofile'
+    if profiler == 'pyinstrument':
+        stage_profiler = Profiler()
+        stage_profiler.start()
+        try:
+            yield
+        finally:
+            stage_profiler.stop()
+            atomic_write_text(os.path.join(output_dir, f'{stage}.html'), stage_profiler.output_html())
+    else:
+        import cProfile
+        stage_profiler = cProfile.Profile()
+        stage_profiler.enable()
+        try:
+            yield
+        finally:
+            stage_profiler.disable()
+            stage_profiler.dump_stats(os.path.join(output_dir, f'{stage}.prof'))
@@ -0,0 +1,345 @@
+# Local mock of the OpenAI Batch API and Gemini Batch Mode.
+# It accepts the same uploads, batch creation and status calls as the real providers (so the
+# official SDKs talk to it unchanged through OPENAI_BASE_URL / GOOGLE_GEMINI_BASE_URL),
+# finishes each job after a configurable delay, and answers every request with JSON that
+# matches the request's response schema, or echoes the bill for plain amendment prompts.
+# Run without arguments it tests the whole batch flow of leg_qa.py and amend_leg_md.py
+# offline in a temporary copy of a session.
+
+import os
+import re
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import pandas as pd
+
+
+BILL_PATTERN = re.compile(r'<bill>\n(.*)\n</bill>', re.DOTALL)
+
+
+def sample_from_schema(schema, definitions=None):
+    """Builds a value that satisfies a JSON schema (as produced by pydantic)."""
+    definitions = definitions if definitions is not None else schema.get('$defs', {})
+    if '$ref' in schema:
+        return sample_from_schema(definitions[schema['$ref'].split('/')[-1]], definitions)
+    if 'anyOf' in schema:
+        options = [option for option in schema['anyOf'] if option.get('type') != 'null']
+        return sample_from_schema(options[0], definitions) if options else None
+    if 'enum' in schema:
+        return schema['enum'][0]
+    schema_type = schema.get('type')
+    if isinstance(schema_type, list):
+        schema_type = next(item for item in schema_type if item != 'null')
+    if schema_type == 'object':
+        return {name: sample_from_schema(property_schema, definitions) for name, property_schema in schema.get('properties', {}).items()}
+    if schema_type == 'array':
+        return []
+    return {'string': 'mock answer', 'integer': 1, 'number': 1.0, 'boolean': False}.get(schema_type)
+
+
+def mock_completion(prompt_text, schema):
+    """The mock model: schema-shaped JSON for structured requests, else the bill unchanged."""
+    if schema is not None:
+        return json.dumps(sample_from_schema(schema))
+    bill_match = BILL_PATTERN.search(prompt_text)
+    return bill_match.group(1) if bill_match else prompt_text
+
+
+def openai_output_line(request_line, index, fail_every):
+    entry = json.loads(request_line)
+    if fail_every and (index + 1) % fail_every == 0:
+        return None, {'id': f'batch_req_{index}', 'custom_id': entry['custom_id'], 'response': None,
+                      'error': {'code': 'server_error', 'message': 'Injected failure'}}
+    body = entry['body']
+    response_format = body.get('response_format') or {}
+    schema = response_format.get('json_schema', {}).get('schema') if response_format.get('type') == 'json_schema' else None
+    content = mock_completion(body['messages'][-1]['content'], schema)
+    completion = {
+        'id': f'chatcmpl-{index}', 'object': 'chat.completion', 'created': int(time.time()), 'model': body['model'],
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content, 'refusal': None}, 'finish_reason': 'stop', 'logprobs': None}],
+        'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+    }
+    return {'id': f'batch_req_{index}', 'custom_id': entry['custom_id'],
+            'response': {'status_code': 200, 'request_id': f'req_{index}', 'body': completion}, 'error': None}, None
+
+
+def gemini_output_line(request_line, index, fail_every):
+    entry = json.loads(request_line)
+    if fail_every and (index + 1) % fail_every == 0:
+        return {'key': entry['key'], 'error': {'code': 500, 'message': 'Injected failure', 'status': 'INTERNAL'}}
+    request = entry['request']
+    generation_config = request.get('generationConfig', {})
+    text = mock_completion(request['contents'][-1]['parts'][0]['text'], generation_config.get('responseJsonSchema'))
+    return {'key': entry['key'], 'response': {
+        'candidates': [{'content': {'role': 'model', 'parts': [{'text': text}]}, 'finishReason': 'STOP'}],
+    }}
+
+
+def make_handler(job_seconds, fail_every):
+    files = dict()
+    batches = dict()
+    uploads = dict()
+    lock = threading.RLock()
+    counter = {'requests': 0}
+
+    def next_id(prefix):
+        with lock:
+            counter['requests'] += 1
+            return f'{prefix}{counter["requests"]}'
+
+    def add_file(name, content):
+        with lock:
+            files[name] = content
+
+    def openai_batch_view(batch):
+        """Advances an OpenAI batch through validating, in_progress and completed as time passes."""
+        elapsed = time.time() - batch['created_at']
+        if batch['status'] != 'completed':
+            if elapsed >= job_seconds:
+                output_lines, error_lines = [], []
+                for index, line in enumerate(files[batch['input_file_id']].decode('utf-8').splitlines()):
+                    output_line, error_line = openai_output_line(line, index, fail_every)
+                    (output_lines if output_line else error_lines).append(json.dumps(output_line or error_line))
+                batch['output_file_id'] = next_id('file-')
+                add_file(batch['output_file_id'], '\n'.join(output_lines).encode('utf-8'))
+                if error_lines:
+                    batch['error_file_id'] = next_id('file-')
+                    add_file(batch['error_file_id'], '\n'.join(error_lines).encode('utf-8'))
+                batch['status'] = 'completed'
+                batch['completed_at'] = int(time.time())
+                batch['request_counts'] = {'total': len(output_lines) + len(error_lines), 'completed': len(output_lines), 'failed': len(error_lines)}
+            elif elapsed >= job_seconds / 2:
+                batch['status'] = 'in_progress'
+        return batch
+
+    def gemini_batch_view(batch):
+        """Advances a Gemini batch through pending, running and succeeded as time passes."""
+        elapsed = time.time() - batch['created']
+        metadata = batch['metadata']
+        if metadata['state'] != 'BATCH_STATE_SUCCEEDED':
+            if elapsed >= job_seconds:
+                input_lines = files[batch['input_file']].decode('utf-8').splitlines()
+                output_lines = [json.dumps(gemini_output_line(line, index, fail_every)) for index, line in enumerate(input_lines)]
+                output_name = f"files/{next_id('output')}"
+                add_file(output_name, '\n'.join(output_lines).encode('utf-8'))
+                metadata['state'] = 'BATCH_STATE_SUCCEEDED'
+                metadata['output'] = {'responsesFile': output_name}
+                metadata['endTime'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+            elif elapsed >= job_seconds / 2:
+                metadata['state'] = 'BATCH_STATE_RUNNING'
+        return {'name': batch['name'], 'metadata': metadata}
+
+    class MockBatchHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, payload, status=200, headers=None):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_bytes(body, 'application/json', status, headers)
+
+        def send_bytes(self, body, content_type, status=200, headers=None):
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def not_found(self):
+            self.send_json({'error': {'message': f'Not found: {self.path}'}}, status=404)
+
+        def read_body(self):
+            return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            body = self.read_body()
+            if url.path == '/v1/files':
+                message = BytesParser(policy=HTTP).parsebytes(
+                    f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode('utf-8') + body
+                )
+                part = next(part for part in message.iter_parts() if part.get_param('name', header='content-disposition') == 'file')
+                file_id = next_id('file-')
+                add_file(file_id, part.get_payload(decode=True))
+                self.send_json({'id': file_id, 'object': 'file', 'bytes': len(files[file_id]), 'created_at': int(time.time()),
+                                'filename': part.get_filename(), 'purpose': 'batch', 'status': 'processed'})
+            elif url.path == '/v1/batches':
+                request = json.loads(body)
+                batch_id = next_id('batch_')
+                batch = {
+                    'id': batch_id, 'object': 'batch', 'endpoint': request['endpoint'], 'errors': None,
+                    'input_file_id': request['input_file_id'], 'completion_window': request['completion_window'],
+                    'status': 'validating', 'output_file_id': None, 'error_file_id': None,
+                    'created_at': int(time.time()), 'metadata': request.get('metadata'),
+                    'request_counts': {'total': 0, 'completed': 0, 'failed': 0},
+                }
+                with lock:
+                    batches[batch_id] = batch
+                self.send_json(batch)
+            elif url.path == '/upload/v1beta/files':
+                command = self.headers.get('X-Goog-Upload-Command', '')
+                if 'start' in command:
+                    upload_id = next_id('upload')
+                    metadata = json.loads(body or b'{}').get('file', {})
+                    with lock:
+                        uploads[upload_id] = {'metadata': metadata, 'content': b''}
+                    upload_url = f'http://{self.headers["Host"]}/upload/v1beta/files?upload_id={upload_id}'
+                    self.send_json({}, headers={'X-Goog-Upload-URL': upload_url, 'X-Goog-Upload-Status': 'active'})
+                    return
+                upload_id = parse_qs(url.query)['upload_id'][0]
+                with lock:
+                    uploads[upload_id]['content'] += body
+                if 'finalize' in command:
+                    name = f"files/{next_id('input')}"
+                    add_file(name, uploads[upload_id]['content'])
+                    file_info = {'name': name, 'displayName': uploads[upload_id]['metadata'].get('displayName'),
+                                 'mimeType': 'jsonl', 'sizeBytes': str(len(files[name])), 'state': 'ACTIVE'}
+                    self.send_json({'file': file_info}, headers={'X-Goog-Upload-Status': 'final'})
+                else:
+                    self.send_json({}, headers={'X-Goog-Upload-Status': 'active'})
+            else:
+                model_match = re.match(r'^/v1beta/models/([^/:]+):batchGenerateContent$', url.path)
+                if not model_match:
+                    self.not_found()
+                    return
+                request = json.loads(body)['batch']
+                name = f"batches/{next_id('batch')}"
+                batch = {
+                    'name': name, 'created': time.time(), 'input_file': request['inputConfig']['fileName'],
+                    'metadata': {
+                        '@type': 'type.googleapis.com/google.ai.generativelanguage.v1main.GenerateContentBatch',
+                        'model': f'models/{model_match.group(1)}', 'displayName': request.get('displayName'),
+                        'state': 'BATCH_STATE_PENDING', 'createTime': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                    },
+                }
+                with lock:
+                    batches[name] = batch
+                self.send_json({'name': name, 'metadata': batch['metadata']})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            openai_batch_match = re.match(r'^/v1/batches/([\w-]+)$', url.path)
+            openai_file_match = re.match(r'^/v1/files/([\w-]+)/content$', url.path)
+            gemini_batch_match = re.match(r'^/v1beta/(batches/[\w-]+)$', url.path)
+            gemini_file_match = re.match(r'^/(?:download/)?v1beta/(files/[\w-]+):download$', url.path)
+            if openai_batch_match and openai_batch_match.group(1) in batches:
+                with lock:
+                    batch = openai_batch_view(batches[openai_batch_match.group(1)])
+                self.send_json(batch)
+            elif openai_file_match and openai_file_match.group(1) in files:
+                self.send_bytes(files[openai_file_match.group(1)], 'application/octet-stream')
+            elif gemini_batch_match and gemini_batch_match.group(1) in batches:
+                with lock:
+                    view = gemini_batch_view(batches[gemini_batch_match.group(1)])
+                self.send_json(view)
+            elif gemini_file_match and gemini_file_match.group(1) in files:
+                self.send_bytes(files[gemini_file_match.group(1)], 'application/octet-stream')
+            else:
+                self.not_found()
+
+    return MockBatchHandler
+
+
+def start_server(job_seconds=2.0, fail_every=0, port=0):
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(job_seconds, fail_every))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_session_copy(repo_dir, session_year, limit, amended_bills):
+    """
+    Copies the first `limit` bills of a session (CSV and markdown) into a temporary working
+    directory, with two synthetic amendments for each of the first `amended_bills` bills.
+    """
+    work_dir = tempfile.mkdtemp(prefix='mock_batch_')
+    session_dir = os.path.join(work_dir, f'data/{session_year}rs')
+    os.makedirs(os.path.join(session_dir, 'csv'))
+    os.makedirs(os.path.join(session_dir, 'md'))
+    data = pd.read_csv(os.path.join(repo_dir, f'data/{session_year}rs/csv/legislation.csv')).head(limit)
+    data.to_csv(os.path.join(session_dir, 'csv', 'legislation.csv'), index=False)
+    for index, bill_number in enumerate(data['BillNumber'].values.tolist()):
+        shutil.copy(os.path.join(repo_dir, f'data/{session_year}rs/md/{bill_number}.md'), os.path.join(session_dir, 'md'))
+        if index < amended_bills:
+            for amendment_number in (1, 2):
+                with open(os.path.join(session_dir, 'md', f'{bill_number}_amd{amendment_number}.md'), 'w', encoding='utf-8') as f:
+                    f.write(f'START OF PAGE 1\nAMENDMENT NO. {amendment_number}\nOn page 1, in line 1, strike "{bill_number}".\nEND OF PAGE 1')
+    return work_dir, data['BillNumber'].values.tolist()
+
+
+def run_flow(base_url, session_year, limit, amended_bills, model_family):
+    """Runs leg_qa.py and amend_leg_md.py in batch mode in a temporary session copy."""
+    import leg_qa
+    import amend_leg_md
+    from google import genai
+    repo_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    work_dir, bill_numbers = make_session_copy(repo_dir, session_year, limit, amended_bills)
+    previous_dir = os.getcwd()
+    os.environ.update({
+        'OPENAI_API_KEY': 'mock', 'OPENAI_BASE_URL': f'{base_url}/v1',
+        'GEMINI_API_KEY': 'mock', 'GOOGLE_GEMINI_BASE_URL': base_url,
+    })
+    os.chdir(work_dir)
+    try:
+        # Parsed by leg_qa's own parser, so options added to leg_qa get their defaults here
+        args = leg_qa.build_parser().parse_args([
+            str(session_year), '--model-family', model_family, '--cache-dir', 'data/llm_cache',
+            '--batch', '--batch-poll-seconds', '0.5',
+        ])
+        start = time.perf_counter()
+        leg_qa.main(args)
+        qa_seconds = time.perf_counter() - start
+        responses = pd.read_csv(f'data/{session_year}rs/csv/legislation_model_responses.csv')
+        answered = int(responses['bill_summary'].notna().sum())
+
+        start = time.perf_counter()
+        amend_leg_md.batch_main(genai.Client(api_key='mock'), session_year, poll_seconds=0.5)
+        amend_seconds = time.perf_counter() - start
+        amended = [bill_number for bill_number in bill_numbers if os.path.exists(f'data/{session_year}rs/md/{bill_number}_amended.md')]
+    finally:
+        os.chdir(previous_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print(f'leg_qa --batch ({model_family}): {answered} of {len(bill_numbers)} bills answered in {qa_seconds:.1f} s')
+    print(f'amend_leg_md --batch: {len(amended)} of {amended_bills} bills amended in {amend_seconds:.1f} s')
+    return answered == len(bill_numbers) and len(amended) == amended_bills
+
+
+def main(args):
+    server = start_server(args.job_seconds, args.fail_every, args.port)
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    if args.serve:
+        print(f'Mock batch server listening on {base_url}')
+        print(f'export OPENAI_BASE_URL={base_url}/v1 GOOGLE_GEMINI_BASE_URL={base_url} OPENAI_API_KEY=mock GEMINI_API_KEY=mock')
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+        server.shutdown()
+        return
+    try:
+        ok = all([run_flow(base_url, args.session_year, args.limit, args.amended_bills, model_family) for model_family in args.model_families])
+    finally:
+        server.shutdown()
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mock OpenAI/Gemini batch server, and an offline test of the batch flows.')
+    parser.add_argument('--serve', action='store_true', help='Only run the server until interrupted')
+    parser.add_argument('--port', type=int, default=0, help='Port to listen on (default: any free port)')
+    parser.add_argument('--job-seconds', type=float, default=2.0, help='Seconds before a submitted batch job completes')
+    parser.add_argument('--fail-every', type=int, default=0, help='Fail every Nth request of a job (0 to disable)')
+    parser.add_argument('--session-year', type=int, default=2025, help='Session whose committed data is copied for the test')
+    parser.add_argument('--limit', type=int, default=20, help='Number of bills in the test session')
+    parser.add_argument('--amended-bills', type=int, default=3, help='Number of bills given synthetic amendments')
+    parser.add_argument('--model-families', nargs='+', choices=['gpt', 'gemini'], default=['gpt', 'gemini'], help='Batch APIs to test leg_qa.py with')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,345 @@
+# Incremental runner for the whole code/ pipeline.
+# Every artifact is rebuilt only when one of its inputs changed content, its stage version
+# changed, or it is missing, in the spirit of make. Input hashes and stage versions for each
+# artifact are kept in data/{session_year}rs/pipeline_state.json.
+
+import os
+import json
+import argparse
+from glob import glob
+import pandas as pd
+from dotenv import load_dotenv
+from tqdm import tqdm
+from file_utils import sha256_file, sha256_bytes, atomic_write_text
+from metrics import METRICS, PROFILERS, profile
+
+
+# Bump a stage's version whenever its code changes in a way that alters output,
+# so every artifact of that stage is rebuilt on the next run.
+STAGE_VERSIONS = {
+    'amended': 2,
+    'qa': 1,
+}
+STAGES = ['download', 'extract', 'amended', 'qa', 'count_tokens']
+STATE_SAVE_INTERVAL = 25
+
+
+class PipelineState:
+    """
+    Maps each artifact path (relative to the session directory) to the stage version and
+    input content hashes it was last built from.
+    """
+
+    def __init__(self, session_dir):
+        self.session_dir = session_dir
+        self.path = os.path.join(session_dir, 'pipeline_state.json')
+        self.artifacts = dict()
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.artifacts = json.load(f)
+        self.hash_memo = dict()
+        self.unsaved = 0
+
+    def relative(self, path):
+        return os.path.relpath(path, self.session_dir).replace(os.sep, '/')
+
+    def input_hashes(self, input_paths):
+        hashes = dict()
+        for input_path in input_paths:
+            if input_path not in self.hash_memo:
+                self.hash_memo[input_path] = sha256_file(input_path)
+            hashes[self.relative(input_path)] = self.hash_memo[input_path]
+        return hashes
+
+    def is_current(self, output_path, version, input_hashes, side_outputs=()):
+        entry = self.artifacts.get(self.relative(output_path))
+        return (
+            entry is not None
+            and os.path.exists(output_path)
+            and all(os.path.exists(side_output) for side_output in side_outputs)
+            and entry['version'] == version
+            and entry['inputs'] == input_hashes
+        )
+
+    def record(self, output_path, stage, version, input_hashes):
+        self.artifacts[self.relative(output_path)] = {'stage': stage, 'version': version, 'inputs': input_hashes}
+        # Outputs rewritten in this run must be re-hashed when used as inputs downstream
+        self.hash_memo.clear()
+        self.unsaved += 1
+        if self.unsaved >= STATE_SAVE_INTERVAL:
+            self.save()
+
+    def save(self):
+        atomic_write_text(self.path, json.dumps(self.artifacts, indent=1, sort_keys=True))
+        self.unsaved = 0
+
+
+def run_stage(state, stage, version, tasks, build, dry_run=False, assume_current=False, side_outputs=None, cost=None, budget=None, profile_dir=None, profiler='cprofile'):
+    """
+    Runs build(output_path, input_paths) for every (output_path, input_paths) task whose
+    recorded inputs or version differ. build returns False to signal a failure that should
+    be retried next run. With assume_current, existing outputs are recorded as up to date
+    without being rebuilt (useful when adopting data produced before the pipeline existed).
+    side_outputs(output_path) lists further files a build writes, which must also exist.
+    cost(output_path, input_paths) estimates a build's LLM cost in USD: stale artifacts are
+    then built most expensive first and, with a budget dict, only while their cost fits in
+    budget['remaining'] (which is shared by the stages given the same dict). The builds are
+    timed in metrics.METRICS and, with profile_dir, profiled into it (see metrics.profile).
+
+    Returns:
+        The list of output paths that were (or, for a dry run, would be) rebuilt.
+    """
+    stale = []
+    for output_path, input_paths in tasks:
+        input_hashes = state.input_hashes(input_paths)
+        if not state.is_current(output_path, version, input_hashes, side_outputs(output_path) if side_outputs else ()):
+            stale.append((output_path, input_paths, input_hashes))
+    print(f'{stage}: {len(stale)} of {len(tasks)} artifacts out of date.')
+    if cost is not None and stale and not assume_current:
+        costs = {output_path: cost(output_path, input_paths) for output_path, input_paths, _ in stale}
+        stale.sort(key=lambda task: costs[task[0]], reverse=True)
+        print(f'{stage}: estimated LLM cost ${sum(costs.values()):.2f}.')
+        if budget is not None:
+            affordable = []
+            for task in stale:
+                if costs[task[0]] <= budget['remaining']:
+                    budget['remaining'] -= costs[task[0]]
+                    affordable.append(task)
+            if len(affordable) < len(stale):
+                print(f'{stage}: {len(stale) - len(affordable)} artifacts left out of date to stay within --max-cost.')
+            stale = affordable
+    if dry_run:
+        return [output_path for output_path, _, _ in stale]
+    rebuilt = []
+    with METRICS.timer('stage_seconds', stage=stage), profile(stage, profile_dir, profiler):
+        for output_path, input_paths, input_hashes in tqdm(stale, desc=stage, disable=not stale):
+            if assume_current and os.path.exists(output_path):
+                state.record(output_path, stage, version, input_hashes)
+                continue
+            with METRICS.timer('artifact_build_seconds', stage=stage):
+                built = build(output_path, input_paths) is not False
+            METRICS.count('artifacts', stage=stage, outcome='rebuilt' if built else 'failed')
+            if not built:
+                continue
+            state.record(output_path, stage, version, input_hashes)
+            rebuilt.append(output_path)
+    state.save()
+    return rebuilt
+
+
+def pdf_files(session_dir):
+    return sorted(glob(os.path.join(session_dir, 'pdf', '*.pdf')))
+
+
+def extract_tasks(session_dir):
+    from extract_legislation import output_paths
+    tasks = []
+    for pdf_file in pdf_files(session_dir):
+        _, _, meta_path = output_paths(session_dir, os.path.splitext(os.path.basename(pdf_file))[0])
+        tasks.append((meta_path, [pdf_file]))
+    return tasks
+
+
+def extract_side_outputs(meta_path):
+    from extract_legislation import output_paths
+    from line_table import line_table_path
+    session_dir = os.path.dirname(os.path.dirname(meta_path))
+    file_name = os.path.splitext(os.path.basename(meta_path))[0]
+    txt_path, md_path, _ = output_paths(session_dir, file_name)
+    return [txt_path, md_path, line_table_path(session_dir, file_name)]
+
+
+def build_extract(output_path, input_paths):
+    from extract_legislation import extract_document, CORRUPTED_PDF_ERRORS
+    try:
+        txt_path, md_path, lines_path = extract_side_outputs(output_path)
+        extract_document(input_paths[0], txt_path, md_path, output_path, lines_path=lines_path)
+    except CORRUPTED_PDF_ERRORS:
+        print("Corrupted PDF: {}".format(os.path.basename(input_paths[0])))
+        return False
+
+
+def amended_tasks(session_dir):
+    from amendment_engine import load_amendment_order, in_adoption_order
+    md_dir = os.path.join(session_dir, 'md')
+    amendment_order = load_amendment_order(session_dir)
+    amendments_by_bill = dict()
+    for amendment_file in glob(os.path.join(md_dir, '*_amd*.md')):
+        amendment_name = os.path.splitext(os.path.basename(amendment_file))[0]
+        amendments_by_bill.setdefault(amendment_name.split('_')[0], []).append(amendment_name)
+    tasks = []
+    for bill_number, amendment_names in sorted(amendments_by_bill.items()):
+        bill_file = os.path.join(md_dir, f'{bill_number}.md')
+        if os.path.exists(bill_file):
+            amendment_files = [os.path.join(md_dir, f'{name}.md') for name in in_adoption_order(amendment_names, amendment_order.get(bill_number, []))]
+            tasks.append((os.path.join(md_dir, f'{bill_number}_amended.md'), [bill_file] + amendment_files))
+    return tasks
+
+
+def qa_tasks(session_dir):
+    from leg_qa import bill_markdown_path
+    data = pd.read_csv(os.path.join(session_dir, 'csv', 'legislation.csv'))
+    md_dir = os.path.join(session_dir, 'md')
+    tasks = []
+    for bill_number in data['BillNumber'].values.tolist():
+        bill_filepath = bill_markdown_path(md_dir, bill_number)
+        if os.path.exists(bill_filepath):
+            tasks.append((os.path.join(session_dir, 'qa', f'{bill_number}.json'), [bill_filepath]))
+    return tasks
+
+
+def write_qa_csv(session_dir):
+    """
+    Assembles legislation_model_responses.csv from the per-bill QA rows. Bills without a
+    QA row (a failed build, or one --max-cost left stale) get empty answer columns.
+    """
+    from leg_qa import answers_frame
+    csv_dir = os.path.join(session_dir, 'csv')
+    data = pd.read_csv(os.path.join(csv_dir, 'legislation.csv'))
+    data = data[['YearAndSession', 'BillNumber', 'Title', 'Synopsis']]
+    model_responses = []
+    for bill_number in data['BillNumber'].values.tolist():
+        qa_path = os.path.join(session_dir, 'qa', f'{bill_number}.json')
+        model_response = dict()
+        if os.path.exists(qa_path):
+            with open(qa_path, 'r', encoding='utf-8') as f:
+                model_response = json.load(f)
+        model_responses.append(model_response)
+    response_df = answers_frame(model_responses)
+    combined_df = pd.concat([data.reset_index(drop=True), response_df.reset_index(drop=True)], axis=1)
+    output_filepath = os.path.join(csv_dir, 'legislation_model_responses.csv')
+    combined_df.to_csv(output_filepath, index=False, encoding='utf-8')
+    print(f"Saved model responses to {output_filepath}")
+
+
+def main(args):
+    session_dir = f'data/{args.session_year}rs'
+    stages = args.stages or STAGES
+    state = PipelineState(session_dir)
+
+    if args.download or (args.stages and 'download' in args.stages):
+        import download_legislation
+        with METRICS.timer('stage_seconds', stage='download'), profile('download', args.profile_dir, args.profiler):
+            download_legislation.main(args.session_year)
+
+    rebuilt_extract = []
+    if 'extract' in stages:
+        from extract_legislation import ENGINE_VERSION
+        rebuilt_extract = run_stage(
+            state, 'extract', ENGINE_VERSION, extract_tasks(session_dir), build_extract,
+            args.dry_run, args.assume_current, side_outputs=extract_side_outputs,
+            profile_dir=args.profile_dir, profiler=args.profiler
+        )
+
+    llm_cache = None
+    estimator = None
+    if not args.no_cache and ('amended' in stages or 'qa' in stages):
+        from llm_cache import LLMCache
+        llm_cache = LLMCache()
+    if 'amended' in stages or 'qa' in stages:
+        from cost_estimator import CostEstimator
+        estimator = CostEstimator()
+    budget = {'remaining': args.max_cost} if args.max_cost is not None else None
+
+    def read_inputs(input_paths):
+        texts = []
+        for input_path in input_paths:
+            with open(input_path, 'r', encoding='utf-8') as f:
+                texts.append(f.read())
+        return texts
+
+    if 'amended' in stages:
+        from amend_leg_md import PROMPT_TEMPLATE, apply_amendments
+        from line_table import load_line_table
+        from amendment_engine import ENGINE_VERSION as AMENDMENT_ENGINE_VERSION
+        amended_version = f"{STAGE_VERSIONS['amended']}:{AMENDMENT_ENGINE_VERSION}:{sha256_bytes(PROMPT_TEMPLATE.encode('utf-8'))[:12]}"
+        gemini_client = dict()
+
+        def build_amended(output_path, input_paths):
+            if 'client' not in gemini_client:
+                from google import genai
+                load_dotenv()
+                GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+                if GEMINI_API_KEY is None:
+                    print("No GEMINI_API_KEY in .env: amendments that need the LLM will not be applied.")
+                gemini_client['client'] = genai.Client(api_key=GEMINI_API_KEY) if GEMINI_API_KEY is not None else None
+            bill_mds = read_inputs(input_paths)
+            bill_name = os.path.splitext(os.path.basename(input_paths[0]))[0]
+            line_table = load_line_table(os.path.dirname(os.path.dirname(input_paths[0])), bill_name)
+            amended_bill_md = apply_amendments(gemini_client['client'], bill_mds[0], bill_mds[1:], cache=llm_cache, line_table=line_table)
+            if amended_bill_md is None:
+                return False
+            atomic_write_text(output_path, amended_bill_md)
+
+        def amended_cost(output_path, input_paths):
+            bill_mds = read_inputs(input_paths)
+            return estimator.amendment_estimate(bill_mds[0], bill_mds[1:])['cost']
+
+        run_stage(
+            state, 'amended', amended_version, amended_tasks(session_dir), build_amended, args.dry_run, args.assume_current,
+            cost=amended_cost, budget=budget, profile_dir=args.profile_dir, profiler=args.profiler
+        )
+
+    if 'qa' in stages:
+        from leg_qa import SYSTEM_PROMPT, DEFAULT_MAX_BILL_TOKENS, default_model_name, make_client, answer_bill
+        model_family = args.model_family.lower()
+        model_name = args.model or default_model_name(model_family)
+        qa_version = f"{STAGE_VERSIONS['qa']}:{model_family}:{model_name}:{sha256_bytes(SYSTEM_PROMPT.encode('utf-8'))[:12]}"
+        qa_client = dict()
+
+        def build_qa(output_path, input_paths):
+            if 'client' not in qa_client:
+                load_dotenv()
+                qa_client['client'] = make_client(model_family, model_name)
+            if qa_client['client'] is None:
+                return False
+            bill_md, = read_inputs(input_paths)
+            model_response = answer_bill(
+                qa_client['client'], bill_md, model_name, model_family, cache=llm_cache,
+                tokenizer=estimator.tokenizer, max_bill_tokens=DEFAULT_MAX_BILL_TOKENS[model_family]
+            )
+            if model_response is None:
+                return False
+            atomic_write_text(output_path, json.dumps(model_response))
+
+        def qa_cost(output_path, input_paths):
+            bill_md, = read_inputs(input_paths)
+            return estimator.qa_estimate(bill_md, model_family, model_name)['cost']
+
+        rebuilt_qa = run_stage(
+            state, 'qa', qa_version, qa_tasks(session_dir), build_qa, args.dry_run, args.assume_current,
+            cost=qa_cost, budget=budget, profile_dir=args.profile_dir, profiler=args.profiler
+        )
+        output_csv = os.path.join(session_dir, 'csv', 'legislation_model_responses.csv')
+        if not args.dry_run and (rebuilt_qa or not os.path.exists(output_csv)):
+            write_qa_csv(session_dir)
+
+    if estimator is not None:
+        estimator.save()
+
+    if 'count_tokens' in stages and rebuilt_extract and not args.dry_run:
+        import count_tokens
+        with METRICS.timer('stage_seconds', stage='count_tokens'), profile('count_tokens', args.profile_dir, args.profiler):
+            count_tokens.main(args.session_year)
+
+    if args.metrics:
+        METRICS.write(args.metrics)
+        print(f'Saved metrics to {args.metrics}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Incrementally run the Legi-Scanner pipeline for a session.')
+    parser.add_argument('session_year', type=int, help='The regular session year')
+    parser.add_argument('--download', action='store_true', help='Sync legislation and PDFs from the MGA website first')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=None, help='Only run these stages (default: all)')
+    parser.add_argument('--model-family', default='gemini', choices=['gpt', 'gemini', 'ollama'], help='The LLM backend family used for QA')
+    parser.add_argument('--model', default=None, help='The model name used for QA')
+    parser.add_argument('--dry-run', action='store_true', help='Only report which artifacts are out of date')
+    parser.add_argument('--no-cache', action='store_true', help='Query the LLM for every rebuilt artifact, ignoring the LLM response cache')
+    parser.add_argument('--max-cost', type=float, default=None, help='Estimated USD to spend on the amended and qa stages; the most expensive stale artifacts that fit are built first')
+    parser.add_argument('--metrics', default=None, help='Write stage and per-document timings, HTTP, LLM and cache counters and peak RSS to this JSON (or .prom Prometheus textfile) path')
+    parser.add_argument('--profile-dir', default=None, help='Profile each stage into this directory')
+    parser.add_argument('--profiler', default='cprofile', choices=PROFILERS, help='Profiler used with --profile-dir (pyinstrument must be installed separately)')
+    parser.add_argument('--assume-current', action='store_true', help='Record existing outputs as up to date instead of rebuilding them')
+    args = parser.parse_args()
+    main(args)
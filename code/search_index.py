@@ -0,0 +1,230 @@
+# Full-text search index over leg_to_md markdown.
+# Each page of every bill, amendment and amended bill is one row of an SQLite FTS5 table,
+# with the current text and the ~~struck~~ text indexed as separate columns so a query can
+# match either. Page numbers come from the START OF PAGE markers. The index is rebuilt
+# incrementally: only markdown files whose content hash changed are re-indexed.
+
+import os
+import re
+import time
+import sqlite3
+import argparse
+from glob import glob
+import pandas as pd
+from tqdm import tqdm
+from file_utils import sha256_file
+from leg_to_md import iter_markdown_file_pages
+from corpus_store import classify_document
+
+
+DEFAULT_INDEX_PATH = 'data/search_index.sqlite'
+MMAP_SIZE = 1 << 30
+# FTS rowids are doc_id * PAGE_STRIDE + page_number, so a document's pages form one rowid range
+PAGE_STRIDE = 100000
+FIELDS = ('current', 'struck')
+STRUCK_PATTERN = re.compile(r'~~(.+?)~~')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id INTEGER PRIMARY KEY,
+    session_year INTEGER NOT NULL,
+    doc_name TEXT NOT NULL,
+    bill_number TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    chapter_number TEXT,
+    md_sha256 TEXT NOT NULL,
+    page_count INTEGER NOT NULL,
+    UNIQUE (session_year, doc_name)
+);
+CREATE INDEX IF NOT EXISTS documents_bill ON documents (session_year, bill_number);
+CREATE VIRTUAL TABLE IF NOT EXISTS page_text USING fts5(
+    current, struck, tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+
+def connect(path=DEFAULT_INDEX_PATH, read_only=False):
+    """
+    Opens the index, creating it if needed. read_only connections never create or modify it.
+    """
+    if read_only:
+        conn = sqlite3.connect(f'file:{os.path.abspath(path)}?mode=ro', uri=True)
+    else:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = sqlite3.connect(path)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.executescript(SCHEMA)
+    conn.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+    return conn
+
+
+def split_struck(page_markdown):
+    """
+    Splits a page of markdown into its current text (struck words removed) and the
+    struck words, one line of struck text per line they appeared on.
+    """
+    current_lines = []
+    struck_lines = []
+    for line in page_markdown.split('\n'):
+        struck_words = STRUCK_PATTERN.findall(line)
+        if struck_words:
+            struck_lines.append(' '.join(struck_words))
+            line = STRUCK_PATTERN.sub(' ', line)
+        current_lines.append(line)
+    return '\n'.join(current_lines), '\n'.join(struck_lines)
+
+
+def chapter_numbers(session_dir):
+    """Maps each bill number to its chapter number, for the bills of a session that were enacted."""
+    csv_path = os.path.join(session_dir, 'csv', 'legislation.csv')
+    if not os.path.exists(csv_path):
+        return dict()
+    data = pd.read_csv(csv_path, usecols=['BillNumber', 'ChapterNumber'], dtype=str, keep_default_na=False)
+    return {bill_number: chapter_number for bill_number, chapter_number in data.values.tolist() if chapter_number}
+
+
+def delete_document(conn, doc_id):
+    conn.execute('DELETE FROM page_text WHERE rowid BETWEEN ? AND ?', (doc_id * PAGE_STRIDE, (doc_id + 1) * PAGE_STRIDE - 1))
+    conn.execute('DELETE FROM documents WHERE doc_id = ?', (doc_id,))
+
+
+def index_document(conn, session_year, md_path, chapter_number=None, force=False):
+    """
+    Indexes one markdown document page by page, replacing any previous version.
+    Markdown without page markers (e.g. LLM-written amended bills) is indexed as page 0.
+
+    Returns:
+        True if the document was (re)indexed, False if it was unchanged.
+    """
+    doc_name, _ = os.path.splitext(os.path.basename(md_path))
+    bill_number, kind, _ = classify_document(doc_name)
+    md_sha256 = sha256_file(md_path)
+    existing = conn.execute(
+        'SELECT doc_id, md_sha256, chapter_number FROM documents WHERE session_year = ? AND doc_name = ?',
+        (session_year, doc_name)
+    ).fetchone()
+    if existing is not None and not force and existing[1:] == (md_sha256, chapter_number):
+        return False
+    if existing is not None:
+        delete_document(conn, existing[0])
+
+    pages = list(iter_markdown_file_pages(md_path))
+    if not pages:
+        with open(md_path, 'r', encoding='utf-8') as f:
+            pages = [(0, f.read())]
+    cursor = conn.execute(
+        'INSERT INTO documents (session_year, doc_name, bill_number, kind, chapter_number, md_sha256, page_count) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+        (session_year, doc_name, bill_number, kind, chapter_number, md_sha256, len(pages))
+    )
+    doc_id = cursor.lastrowid
+    conn.executemany(
+        'INSERT INTO page_text (rowid, current, struck) VALUES (?, ?, ?)',
+        [(doc_id * PAGE_STRIDE + page_number, *split_struck(page_markdown)) for page_number, page_markdown in pages]
+    )
+    return True
+
+
+def index_session(conn, session_year, force=False):
+    """
+    Brings the index up to date with a session's md directory, dropping documents whose
+    markdown no longer exists.
+    """
+    session_dir = f'data/{session_year}rs'
+    chapters = chapter_numbers(session_dir)
+    md_files = sorted(glob(os.path.join(session_dir, 'md', '*.md')))
+    indexed = 0
+    for md_path in tqdm(md_files, desc=f'{session_year} documents'):
+        doc_name, _ = os.path.splitext(os.path.basename(md_path))
+        indexed += index_document(conn, session_year, md_path, chapters.get(classify_document(doc_name)[0]), force=force)
+    doc_names = {os.path.splitext(os.path.basename(md_path))[0] for md_path in md_files}
+    removed = [
+        doc_id for doc_id, doc_name in conn.execute('SELECT doc_id, doc_name FROM documents WHERE session_year = ?', (session_year,))
+        if doc_name not in doc_names
+    ]
+    for doc_id in removed:
+        delete_document(conn, doc_id)
+    conn.commit()
+    print(f'{session_year}: {indexed} of {len(md_files)} documents indexed ({len(md_files) - indexed} unchanged, {len(removed)} removed)')
+
+
+def search(conn, query, field=None, session_years=None, enacted=None, kinds=None, limit=20, current_weight=1.0, struck_weight=1.0):
+    """
+    Runs an FTS5 query (phrases in double quotes, AND/OR/NOT, prefix*) over page text.
+
+    Args:
+        conn: A connection from connect().
+        query: The FTS5 query string.
+        field: 'current' or 'struck' to match only that text; None matches either.
+        session_years: Only search these sessions.
+        enacted: True for bills with a chapter number only, False for bills without one.
+        kinds: Only search these document kinds ('bill', 'amendment', 'amended').
+        limit: The maximum number of pages returned.
+        current_weight, struck_weight: BM25 column weights.
+
+    Returns:
+        A DataFrame of matching pages, best BM25 score first.
+    """
+    if field is not None:
+        if field not in FIELDS:
+            raise ValueError(f'field must be one of {FIELDS}')
+        query = f'{{{field}}} : ({query})'
+    sql = (
+        'SELECT d.session_year, d.bill_number, d.doc_name, d.chapter_number, '
+        f'p.rowid % {PAGE_STRIDE} AS page_number, bm25(page_text, ?, ?) AS score, '
+        "replace(snippet(page_text, -1, '[', ']', '...', 12), char(10), ' ') AS snippet "
+        f'FROM page_text p JOIN documents d ON d.doc_id = p.rowid / {PAGE_STRIDE} '
+        'WHERE page_text MATCH ?'
+    )
+    params = [current_weight, struck_weight, query]
+    if session_years:
+        sql += f" AND d.session_year IN ({', '.join(['?'] * len(session_years))})"
+        params += list(session_years)
+    if kinds:
+        sql += f" AND d.kind IN ({', '.join(['?'] * len(kinds))})"
+        params += list(kinds)
+    if enacted is not None:
+        sql += ' AND d.chapter_number IS NOT NULL' if enacted else ' AND d.chapter_number IS NULL'
+    sql += ' ORDER BY score LIMIT ?'
+    params.append(limit)
+    return pd.read_sql_query(sql, conn, params=params)
+
+
+def main(args):
+    if args.command == 'build':
+        conn = connect(args.index)
+        for session_year in args.session_years:
+            index_session(conn, session_year, force=args.force)
+        conn.execute("INSERT INTO page_text (page_text) VALUES ('optimize')")
+        conn.commit()
+        conn.close()
+    elif args.command == 'search':
+        conn = connect(args.index, read_only=True)
+        start = time.perf_counter()
+        results = search(
+            conn, args.query, field=args.field, session_years=args.sessions,
+            enacted=True if args.enacted else None, kinds=args.kinds, limit=args.limit
+        )
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with pd.option_context('display.max_rows', None, 'display.max_colwidth', 80, 'display.width', None):
+            print(results)
+        print(f'{len(results)} pages in {elapsed_ms:.1f} ms')
+        conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build and query the full-text search index over bill markdown.')
+    parser.add_argument('--index', default=DEFAULT_INDEX_PATH, help='Path of the SQLite search index')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help='Index (or re-index changed) markdown for sessions')
+    build_parser.add_argument('session_years', type=int, nargs='+', help='The regular session years')
+    build_parser.add_argument('--force', action='store_true', help='Re-index documents even if unchanged')
+    search_parser = subparsers.add_parser('search', help='Search the index')
+    search_parser.add_argument('query', help='FTS5 query, e.g. \'"child care" AND license*\'')
+    search_parser.add_argument('--field', choices=FIELDS, default=None, help='Only match current or struck text (default: either)')
+    search_parser.add_argument('--sessions', type=int, nargs='+', default=None, help='Only search these session years')
+    search_parser.add_argument('--enacted', action='store_true', help='Only search bills with a chapter number')
+    search_parser.add_argument('--kinds', nargs='+', choices=['bill', 'amendment', 'amended'], default=None, help='Only search these document kinds')
+    search_parser.add_argument('--limit', type=int, default=20, help='Maximum number of pages to return')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,190 @@
+# Statute-section impact index across sessions.
+# Maps each Article/section of the Annotated Code (from the Statutes field of every bill,
+# via the bill_statutes tables of bill_tables.py) to the bills and sessions that touch it.
+# Entries are kept sorted by "article_code section" in one .npz, so a section or a section
+# prefix such as Health Occupations 13-* is two binary searches. download_legislation
+# replaces one session's entries on each sync; the other sessions are left as they are.
+
+import os
+import re
+import time
+import argparse
+import fnmatch
+import numpy as np
+import pandas as pd
+from file_utils import atomic_open
+from bill_tables import normalise_tables, load_session_table, tables_dir
+
+
+DEFAULT_INDEX_PATH = 'data/statute_index.npz'
+FIELDS = ('keys', 'article_code', 'article_title', 'section', 'session_year', 'bill_number')
+# A section range such as "5-801 through 5-803" is indexed under each of its sections
+RANGE_PATTERN = re.compile(r'\s+through\s+', re.IGNORECASE)
+# The common prefix and final number of a range endpoint, e.g. "7-14A-" and "01"
+SECTION_NUMBER_PATTERN = re.compile(r'^(.*?)(\d+)$')
+MAX_RANGE_SECTIONS = 500
+KEY_END = '\U0010ffff'
+
+
+def range_sections(section):
+    """
+    The sections a section or section range covers: "1-307 through 1-310" is 1-307, 1-308,
+    1-309 and 1-310 (zero-padded like its first section, as in "7-14A-01"). A range whose
+    endpoints do not share a prefix is taken as its first section only.
+    """
+    endpoints = RANGE_PATTERN.split(section)
+    if len(endpoints) != 2:
+        return [endpoints[0]]
+    first_match = SECTION_NUMBER_PATTERN.match(endpoints[0])
+    last_match = SECTION_NUMBER_PATTERN.match(endpoints[1].strip())
+    if first_match is None or last_match is None or first_match.group(1) != last_match.group(1):
+        return [endpoints[0]]
+    prefix, first_number = first_match.groups()
+    first, last = int(first_number), int(last_match.group(2))
+    if not first <= last < first + MAX_RANGE_SECTIONS:
+        return [endpoints[0]]
+    return [f'{prefix}{number:0{len(first_number)}d}' for number in range(first, last + 1)]
+
+
+def index_keys(article_code, section):
+    return [f'{article_code} {member}' for member in range_sections(section)]
+
+
+class StatuteIndex:
+    """
+    Sorted arrays of (article_code, article_title, section, session_year, bill_number)
+    entries, one per bill per statute section it touches, with keys[i] the sort key
+    "article_code section" of entry i. A bill touching a section range has one entry for
+    each section of the range, each listing the range as its section.
+    """
+
+    def __init__(self, **arrays):
+        for name in FIELDS:
+            setattr(self, name, arrays[name])
+
+    @classmethod
+    def from_table(cls, statutes):
+        """Builds an index from a (possibly multi-session) bill_statutes DataFrame."""
+        row_keys = [index_keys(article_code, section) for article_code, section in zip(statutes['article_code'], statutes['section'])]
+        rows = np.repeat(np.arange(len(row_keys)), [len(keys) for keys in row_keys])
+        keys = np.array([key for keys in row_keys for key in keys], dtype=str)
+        bill_numbers = statutes['bill_number'].to_numpy(dtype=str)[rows]
+        session_years = statutes['session_year'].to_numpy(dtype=np.int16)[rows]
+        key_order = np.lexsort((bill_numbers, session_years, keys))
+        order = rows[key_order]
+        return cls(
+            keys=keys[key_order],
+            article_code=statutes['article_code'].to_numpy(dtype=str)[order],
+            article_title=statutes['article_title'].to_numpy(dtype=str)[order],
+            section=statutes['section'].to_numpy(dtype=str)[order],
+            session_year=session_years[key_order],
+            bill_number=bill_numbers[key_order],
+        )
+
+    @classmethod
+    def load(cls, path=DEFAULT_INDEX_PATH):
+        with np.load(path) as arrays:
+            return cls(**{name: arrays[name] for name in FIELDS})
+
+    def save(self, path=DEFAULT_INDEX_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with atomic_open(path, 'wb') as f:
+            np.savez(f, **{name: getattr(self, name) for name in FIELDS})
+
+    def __len__(self):
+        return len(self.keys)
+
+    def to_frame(self, rows=slice(None)):
+        return pd.DataFrame({name: getattr(self, name)[rows] for name in FIELDS if name != 'keys'})
+
+    def replace_session(self, session_year, statutes):
+        """Returns a new index with session_year's entries replaced by the bill_statutes rows given."""
+        kept = self.to_frame(self.session_year != session_year)
+        return StatuteIndex.from_table(pd.concat([kept, statutes[kept.columns]], ignore_index=True))
+
+    def article_codes(self, article):
+        """The article codes matching an article code or (case-insensitive) title."""
+        article = article.strip()
+        codes = set(self.article_code[self.article_code == article].tolist())
+        codes.update(self.article_code[np.char.lower(self.article_title) == article.lower()].tolist())
+        return sorted(codes)
+
+    def query(self, article, section='*', since=None, until=None):
+        """
+        Bills touching sections of an article (code, e.g. 'gho', or title, e.g. 'Health
+        Occupations'). section is an exact section ('13-101'), a prefix pattern ('13-*') or
+        any fnmatch pattern ('13-1?1'); a range matches on any of its sections.
+
+        Returns:
+            A DataFrame of matching entries, sorted by section, session and bill, with each
+            bill's range listed once however many of its sections match.
+        """
+        prefix = section.strip().rstrip('*')
+        # Only a pattern with wildcards before its end needs scanning the article's entries
+        pattern = any(character in prefix for character in '*?[')
+        matches = [np.array([], dtype=np.int64)]
+        for article_code in self.article_codes(article):
+            start_key = f'{article_code} {"" if pattern else prefix}'
+            end_key = start_key if prefix == section.strip() and not pattern else start_key + KEY_END
+            rows = np.arange(
+                np.searchsorted(self.keys, start_key, side='left'),
+                np.searchsorted(self.keys, end_key, side='right')
+            )
+            if pattern:
+                first_sections = [key.split(' ', 1)[1] for key in self.keys[rows]]
+                rows = rows[np.array([fnmatch.fnmatchcase(first_section, section.strip()) for first_section in first_sections], dtype=bool)]
+            matches.append(rows)
+        rows = np.concatenate(matches)
+        if since is not None:
+            rows = rows[self.session_year[rows] >= since]
+        if until is not None:
+            rows = rows[self.session_year[rows] <= until]
+        return self.to_frame(rows).drop_duplicates().reset_index(drop=True)
+
+
+def session_statutes(session_year):
+    """A session's bill_statutes table, built from legislation.csv when it was never saved."""
+    if os.path.exists(os.path.join(tables_dir(session_year), 'bill_statutes.npz')):
+        return load_session_table(session_year, 'bill_statutes')
+    data = pd.read_csv(f'data/{session_year}rs/csv/legislation.csv', dtype=str, keep_default_na=False)
+    return normalise_tables(data, session_year)['bill_statutes']
+
+
+def update_session(session_year, statutes, path=DEFAULT_INDEX_PATH):
+    """Replaces one session's entries in the saved index (creating it if needed)."""
+    if os.path.exists(path):
+        index = StatuteIndex.load(path).replace_session(session_year, statutes)
+    else:
+        index = StatuteIndex.from_table(statutes)
+    index.save(path)
+    return index
+
+
+def main(args):
+    if args.command == 'build':
+        index = StatuteIndex.from_table(pd.concat([session_statutes(session_year) for session_year in args.session_years], ignore_index=True))
+        index.save(args.index)
+        print(f'Indexed {len(index)} bill sections from {len(args.session_years)} sessions in {args.index}')
+    elif args.command == 'query':
+        index = StatuteIndex.load(args.index)
+        start = time.perf_counter()
+        matches = index.query(args.article, args.section, since=args.since, until=args.until)
+        elapsed = time.perf_counter() - start
+        with pd.option_context('display.max_rows', None, 'display.width', 200):
+            print(matches.to_string(index=False) if len(matches) else 'No bills found.')
+        print(f"{len(matches)} entries, {matches['bill_number'].nunique() if len(matches) else 0} bills, found in {elapsed * 1000:.2f} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build or query the statute section index of bills across sessions.')
+    parser.add_argument('--index', default=DEFAULT_INDEX_PATH, help='Path of the index file')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help='Rebuild the index from the given sessions')
+    build_parser.add_argument('session_years', type=int, nargs='+', help='Regular session years')
+    query_parser = subparsers.add_parser('query', help='List the bills that touch an article section')
+    query_parser.add_argument('article', help="Article code or title, e.g. gho or 'Health Occupations'")
+    query_parser.add_argument('section', nargs='?', default='*', help="Section, prefix or pattern, e.g. 13-101 or '13-*' (default: every section)")
+    query_parser.add_argument('--since', type=int, default=None, help='First session year')
+    query_parser.add_argument('--until', type=int, default=None, help='Last session year')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,63 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'code'))
+
+from line_table import LineTable, margin_numbers
+from amendment_engine import AddressedBill
+from bill_diff import document_lines
+
+
+def numbered_rows(count, number_x, text_x0=72):
+    """Rows 'n text of line n' with margin number n at number_x(n) -> (x0, x1)."""
+    rows = []
+    for number in range(1, count + 1):
+        x0, x1 = number_x(number)
+        y0 = 100 + 14 * number
+        rows.append([(x0, x1, y0, str(number), False), (text_x0, text_x0 + 20, y0, 'text', False), (text_x0 + 24, text_x0 + 60, y0, f'of line {number}', False)])
+    return rows
+
+
+def test_left_aligned_margin_numbers():
+    rows = numbered_rows(12, lambda number: (50, 55 if number < 10 else 60))
+    assert margin_numbers(rows) == list(range(1, 13))
+
+
+def test_right_aligned_margin_numbers():
+    rows = numbered_rows(12, lambda number: (55 if number < 10 else 50, 60))
+    assert margin_numbers(rows) == list(range(1, 13))
+
+
+def test_unnumbered_page_is_not_numbered():
+    rows = [
+        [(72, 110, 100, 'Chapter', False), (112, 120, 100, '5', False)],
+        [(72, 76, 114, '1', False), (78, 90, 114, 'of', False), (92, 110, 114, 'this item', False)],
+        [(72, 90, 128, 'applies', False)],
+    ]
+    assert margin_numbers(rows) == [0, 0, 0]
+
+
+def test_addressed_bill_numbers_lines_from_the_line_table():
+    chapter_page = [
+        [(72, 110, 100, 'Chapter', False), (112, 120, 100, '5', False)],
+        [(72, 76, 114, '1', False), (78, 90, 114, 'of', False), (92, 110, 114, 'this item', False)],
+        [(72, 90, 128, 'applies', False)],
+    ]
+    bill_page = numbered_rows(3, lambda number: (50, 55))
+    table = LineTable.from_pages([chapter_page, bill_page])
+    bill_md = '\n'.join([
+        'START OF PAGE 1', 'Chapter 5', '', '1 of this item', 'applies', 'END OF PAGE 1',
+        'START OF PAGE 2', '1 text of line 1', '2 text of line 2', '3 text of line 3', 'END OF PAGE 2',
+    ])
+    assert (1, 1) in AddressedBill(bill_md).line_index
+    bill = AddressedBill(bill_md, table)
+    assert (1, 1) not in bill.line_index
+    assert [key for key in bill.line_index] == [(2, 1), (2, 2), (2, 3)]
+    assert bill.entries[bill.find_line(2, 2)]['text'] == table.line_text(2, 2)
+    assert (1, None, '1 of this item') in document_lines(bill_md, line_table=table)
+
+
+def test_misaligned_page_falls_back_to_the_markdown():
+    table = LineTable.from_pages([numbered_rows(3, lambda number: (50, 55))])
+    bill_md = '\n'.join(['START OF PAGE 1', '1 text of line 1', '2 text of line 2', 'END OF PAGE 1'])
+    assert list(AddressedBill(bill_md, table).line_index) == [(1, 1), (1, 2)]